@@ -5,67 +5,254 @@ atlas_vector_search.py
 Performs semantic vector search on a MongoDB Atlas collection using Atlas Search's $vectorSearch operator.
 Encodes queries with SentenceTransformer and retrieves the most similar documents from the database.
 
+Top-k, the candidate multiplier (numCandidates = top_k * multiplier, or a fixed numCandidates),
+the index, the namespace and exact (ENN) search are configurable. Query vectors are sent as BSON
+float32 vectors (BinData subtype 9) rather than arrays of doubles. Auto-tuning picks the smallest
+numCandidates whose recall@k, measured against a local exact search, meets a target.
+
+Metadata filters ({"label": 1} or {"label": {"$in": [1, 2]}}) are passed as the $vectorSearch `filter`;
+'label' must be declared as a filter field in the vector index. Hybrid mode fuses the vector results
+with an Atlas Search BM25 ranking by reciprocal rank fusion (see hybrid_search.py). With --rerank
+the top RERANK_CANDIDATES hits are re-scored by a local cross-encoder (see reranker.py).
+
 Usage:
     python atlas_vector_search.py --mongo_url <MONGODB_ATLAS_URI> "Your query text here"
+    python atlas_vector_search.py --label 1 --hybrid "Atlanta Braves"
+    python atlas_vector_search.py --top_k 10 --candidate_multiplier 15 --index vector_index --namespace testdb.ag_news "..."
+    python atlas_vector_search.py --exact "Atlanta Braves"
+    python atlas_vector_search.py --rerank "Atlanta Braves"
+    # smallest numCandidates reaching recall@5 >= 0.95 on 100 sampled headlines
+    python atlas_vector_search.py --tune --recall_target 0.95 --sample 100
 
 If --mongo_url is omitted, it defaults to the MONGO_URL environment variable or localhost.
+
+Environment:
+    ATLAS_VECTOR_INDEX: vector search index name (default: vector_index)
+    ATLAS_NAMESPACE: database.collection to search (default: testdb.ag_news)
+    ATLAS_CANDIDATE_MULTIPLIER: numCandidates per requested result (default: 20)
+    ATLAS_NUM_CANDIDATES: fixed numCandidates, e.g. the value found by --tune (overrides the multiplier)
+    ATLAS_BINARY_QUERY: set to "false" to send query vectors as arrays of doubles
+    ENCODER_BACKEND: query encoder backend, see encoder_backends.py (default: torch)
 """
 
-import argparse, dotenv, os
-from pymongo import MongoClient
-from sentence_transformers import SentenceTransformer
-
-def run_atlas_vector_search(query_text, mongo_url) -> list:
-    # Connect to MongoDB
-    client = MongoClient(mongo_url)
-    db = client["testdb"]
-    collection = db["ag_news"]
-
-    # Load model and encode query
-    model = SentenceTransformer("all-MiniLM-L6-v2")
-    query_vector = list(model.encode([query_text])[0])
-
-    # Perform vector search using Atlas Search
-    results = collection.aggregate([
-        {
-            "$vectorSearch": {
-                "index": "vector_index",
-                "path": "embedding",
-                "queryVector": query_vector,
-                "numCandidates": 100,
-                "limit": 5,
-                "similarity": "dotProduct"
-            }
-        },
-        {
-            "$project": {
-                "_id": 1,
-                "text": 1,
-                "label": 1,
-                "score": {"$meta": "vectorSearchScore"}
-            }
-        }
-    ])
-
-    headlines = []
-    for doc in results:
-        item = {"text": doc["text"], "label": doc["label"], "score": float(doc['score'])}
-        headlines.append(item)
-    
-    return headlines
+import argparse, dotenv, json, os, time
+import numpy as np
+from bson.binary import Binary, BinaryVectorDtype
+from embedding_cache import get_cache
+from encoder_backends import cache_name, query_backend
+from hybrid_search import atlas_text_search, reciprocal_rank_fusion
+from metrics import timer
+from model_registry import get_model
+from mongo_pool import get_client
+from reranker import get_reranker, rerank_depth
+
+MAX_NUM_CANDIDATES = 10000
+
+def get_collection(mongo_url, namespace: str = None):
+    database, collection = (namespace or os.getenv("ATLAS_NAMESPACE", "testdb.ag_news")).split(".", 1)
+    return get_client(mongo_url)[database][collection]
+
+def encode_queries(queries: list) -> np.ndarray:
+    # Reuse the shared model of the configured backend and encode queries unless they are cached
+    backend = query_backend()
+    return get_cache().encode(get_model("all-MiniLM-L6-v2", backend=backend), queries,
+                              cache_name("all-MiniLM-L6-v2", backend))
+
+def query_vector(vector, binary: bool = None):
+    """
+    The $vectorSearch queryVector: a BSON float32 vector, or a list of doubles when binary is off.
+    """
+    if binary is None:
+        binary = os.getenv("ATLAS_BINARY_QUERY", "true").lower() == "true"
+    vector = np.asarray(vector, dtype=np.float32)
+    return Binary.from_vector(vector, BinaryVectorDtype.FLOAT32) if binary else vector.tolist()
+
+def vector_search_stage(vector, top_k: int = 5, num_candidates: int = None, candidate_multiplier: int = None,
+                        index: str = None, path: str = "embedding", filters: dict = None, exact: bool = False,
+                        binary: bool = None) -> dict:
+    """
+    Builds the $vectorSearch stage. Exact (ENN) search scans every matching document and takes
+    no numCandidates; otherwise numCandidates is `num_candidates`, top_k * `candidate_multiplier`,
+    ATLAS_NUM_CANDIDATES when neither is given, or top_k * ATLAS_CANDIDATE_MULTIPLIER, capped at
+    Atlas' maximum of 10000.
+    """
+    stage = {
+        "index": index or os.getenv("ATLAS_VECTOR_INDEX", "vector_index"),
+        "path": path,
+        "queryVector": query_vector(vector, binary),
+        "limit": top_k,
+    }
+    if exact:
+        stage["exact"] = True
+    else:
+        if num_candidates is None and candidate_multiplier is None and os.getenv("ATLAS_NUM_CANDIDATES"):
+            num_candidates = int(os.getenv("ATLAS_NUM_CANDIDATES"))
+        if num_candidates is None:
+            multiplier = candidate_multiplier or int(os.getenv("ATLAS_CANDIDATE_MULTIPLIER", "20"))
+            num_candidates = top_k * multiplier
+        stage["numCandidates"] = min(MAX_NUM_CANDIDATES, max(num_candidates, top_k))
+    if filters:
+        stage["filter"] = filters
+    return {"$vectorSearch": stage}
+
+def atlas_search_many(collection, vectors, top_k: int = 5, projection: dict = None, **options) -> list:
+    """
+    Runs one $vectorSearch per query vector.
+
+    Args:
+        collection: The collection holding the vector index.
+        vectors: Query vectors, one row per query.
+        top_k (int): Results per query.
+        projection (dict): Fields returned with each hit (default: _id, text, label).
+        **options: num_candidates, candidate_multiplier, index, path, filters, exact, binary.
+
+    Returns:
+        list: One list of documents per query, each with its "score".
+    """
+    projection = dict(projection or {"_id": 1, "text": 1, "label": 1})
+    projection["score"] = {"$meta": "vectorSearchScore"}
+    results = []
+    for vector in np.atleast_2d(vectors):
+        pipeline = [vector_search_stage(vector, top_k, **options), {"$project": projection}]
+        with timer("mongo"):
+            results.append(list(collection.aggregate(pipeline)))
+    return results
+
+def run_atlas_vector_search(query_text, mongo_url, top_k=5, filters=None, hybrid=False, rerank=False,
+                            **options) -> list:
+    """
+    Runs an Atlas vector search for one query. Takes its arguments in the order of
+    sbert_vector_search.run_local_vector_search, so callers can swap the two.
+
+    Args:
+        query_text (str): The input query string to search for.
+        mongo_url (str): MongoDB connection URI.
+        top_k (int): Number of top results to return (default = 5).
+        filters (dict): Metadata filter on 'label', e.g. {"label": 1} (optional).
+        hybrid (bool): Fuse with an Atlas Search BM25 ranking by reciprocal rank fusion.
+        rerank (bool): Re-score the top RERANK_CANDIDATES hits with a cross-encoder (see reranker.py).
+        **options: namespace, num_candidates, candidate_multiplier, index, exact, binary.
+    """
+    collection = get_collection(mongo_url, options.pop("namespace", None))
+    candidates = rerank_depth(top_k) if rerank else top_k
+    depth = max(4 * candidates, 20) if hybrid else candidates
+    results = atlas_search_many(collection, encode_queries([query_text]), depth, filters=filters, **options)[0]
+    docs = {doc["_id"]: doc for doc in results}
+    ranked = [(doc["_id"], float(doc["score"])) for doc in results]
+
+    if hybrid:
+        # Fuse with the BM25 ranking; fused scores replace the vector scores
+        ranked = reciprocal_rank_fusion([list(docs), atlas_text_search(collection, query_text, depth, filters)],
+                                        limit=candidates)
+        missing = [doc_id for doc_id, _ in ranked if doc_id not in docs]
+        if missing:
+            with timer("mongo"):
+                docs.update((doc["_id"], doc) for doc in collection.find({"_id": {"$in": missing}}, {"_id": 1, "text": 1, "label": 1}))
+
+    if rerank:
+        # Cross-encoder scores replace the first-stage scores; candidates past the budget get None
+        ranked = get_reranker().rerank_many([query_text], [[(doc_id, score, docs[doc_id]["text"])
+                                                            for doc_id, score in ranked if doc_id in docs]])[0]
+
+    return [{"text": docs[doc_id]["text"], "label": docs[doc_id]["label"], "score": score}
+            for doc_id, score in ranked[:top_k] if doc_id in docs]
+
+def exact_ground_truth(collection, vectors, top_k: int = 5, filters: dict = None) -> list:
+    """
+    Top-k ids per query from a local exact scan of the collection's embeddings.
+    """
+    from embedding_index import EmbeddingIndex
+    index = EmbeddingIndex(collection, filter_fields=tuple(filters or ())).load()
+    return [[doc_id for doc_id, _ in row] for row in index.search_many(vectors, top_k, filters)]
+
+def measure_recall(collection, vectors, truth: list, top_k: int, num_candidates: int, **options) -> dict:
+    start = time.perf_counter()
+    results = atlas_search_many(collection, vectors, top_k, projection={"_id": 1}, num_candidates=num_candidates, **options)
+    seconds = time.perf_counter() - start
+    hits = sum(len(set(expected) & {doc["_id"] for doc in found}) for expected, found in zip(truth, results))
+    return {"num_candidates": num_candidates,
+            "recall": hits / max(1, sum(len(expected) for expected in truth)),
+            "ms_per_query": 1000 * seconds / max(1, len(truth))}
+
+def tune_num_candidates(collection, vectors, recall_target: float = 0.95, top_k: int = 5, truth: list = None,
+                        filters: dict = None, **options) -> dict:
+    """
+    Finds the smallest numCandidates whose recall@k against the local exact search meets
+    `recall_target`: numCandidates doubles from top_k until the target is met, then a binary
+    search narrows it down between the last miss and the first hit.
+
+    Returns:
+        dict: The chosen "num_candidates" and "candidate_multiplier", its "recall", and every trial.
+    """
+    truth = truth if truth is not None else exact_ground_truth(collection, vectors, top_k, filters)
+    trials = {}
+
+    def trial(num_candidates):
+        if num_candidates not in trials:
+            trials[num_candidates] = measure_recall(collection, vectors, truth, top_k, num_candidates,
+                                                    filters=filters, **options)
+        return trials[num_candidates]["recall"] >= recall_target
+
+    low, high = 0, top_k
+    while not trial(high):
+        if high >= MAX_NUM_CANDIDATES:
+            break
+        low, high = high, min(MAX_NUM_CANDIDATES, high * 2)
+    if trials[high]["recall"] >= recall_target:
+        while high - low > max(1, top_k // 2):
+            middle = (low + high) // 2
+            if trial(middle):
+                high = middle
+            else:
+                low = middle
+    best = trials[high]
+    return {"num_candidates": high, "candidate_multiplier": high / top_k, "recall": best["recall"],
+            "target_met": best["recall"] >= recall_target, "recall_target": recall_target, "top_k": top_k,
+            "queries": len(truth), "trials": [trials[n] for n in sorted(trials)]}
 
 if __name__ == "__main__":
     dotenv.load_dotenv()
-    parser = argparse.ArgumentParser(description="Run local vector search with sentence-transformers")
+    parser = argparse.ArgumentParser(description="Run Atlas vector search with sentence-transformers")
     parser.add_argument("--mongo_url", help="MongoDB connection URI (optional, defaults to env MONGO_URL or localhost)")
     parser.add_argument("query_text", nargs="?", default="Breaking news about sports",
                         help="Query text to search for (default: 'Breaking news about sports')")
+    parser.add_argument("--label", type=int, nargs="+", help="Only return documents with these labels")
+    parser.add_argument("--hybrid", action="store_true", help="Fuse with Atlas Search BM25 by reciprocal rank fusion")
+    parser.add_argument("--top_k", type=int, default=5, help="Number of results")
+    parser.add_argument("--num_candidates", type=int, help="Fixed numCandidates (overrides the multiplier)")
+    parser.add_argument("--candidate_multiplier", type=int, help="numCandidates per result (default: env or 20)")
+    parser.add_argument("--index", help="Vector search index (default: env ATLAS_VECTOR_INDEX or vector_index)")
+    parser.add_argument("--namespace", help="database.collection (default: env ATLAS_NAMESPACE or testdb.ag_news)")
+    parser.add_argument("--exact", action="store_true", help="Exact nearest neighbor search (ENN)")
+    parser.add_argument("--rerank", action="store_true", help="Rerank the top candidates with a cross-encoder")
+    parser.add_argument("--tune", action="store_true", help="Find the smallest numCandidates meeting --recall_target")
+    parser.add_argument("--recall_target", type=float, default=0.95, help="recall@k target for --tune")
+    parser.add_argument("--queries_file", help="Query texts for --tune, one per line (default: sampled headlines)")
+    parser.add_argument("--sample", type=int, default=100, help="Headlines sampled as --tune queries")
     args = parser.parse_args()
 
     # Resolve MongoDB connection string
     mongo_url = args.mongo_url or os.getenv("MONGO_URL", "mongodb://localhost:27017/")
+    filters = {"label": {"$in": args.label}} if args.label else None
 
-    # Execute vector search
-    headlines = run_atlas_vector_search(args.query_text, mongo_url)
-    for i, headline in enumerate(headlines, start=1):
-        print(f"{i}. {headline['text']} (score: {headline['score']:.4f})")
+    if args.tune:
+        collection = get_collection(mongo_url, args.namespace)
+        if args.queries_file:
+            with open(args.queries_file) as f:
+                queries = [line.strip() for line in f if line.strip()]
+        else:
+            queries = [doc["text"] for doc in collection.aggregate([{"$sample": {"size": args.sample}}, {"$project": {"text": 1}}])]
+        report = tune_num_candidates(collection, encode_queries(queries), args.recall_target, args.top_k,
+                                     filters=filters, index=args.index)
+        print(json.dumps(report, indent=2))
+    else:
+        # Execute vector search
+        headlines = run_atlas_vector_search(args.query_text, mongo_url, args.top_k, filters, args.hybrid, args.rerank,
+                                            namespace=args.namespace, num_candidates=args.num_candidates,
+                                            candidate_multiplier=args.candidate_multiplier, index=args.index,
+                                            exact=args.exact)
+        for i, headline in enumerate(headlines, start=1):
+            if headline["score"] is None:
+                print(f"{i}. {headline['text']} (not reranked)")
+            else:
+                print(f"{i}. {headline['text']} (score: {headline['score']:.4f})")
@@ -0,0 +1,485 @@
+"""
+benchmark.py
+@ken.chen
+
+Reproducible search benchmarks: QPS, p50/p95/p99 latency, memory and recall@k of each search path,
+written as JSON so runs from different commits can be compared.
+
+Targets:
+    exact, ivf                    EmbeddingIndex with the exact or IVF backend (see index_backends.py)
+    float16, int8, binary         EmbeddingIndex with the exact backend on compact codes (see quantization.py)
+    local                         sbert_vector_search.search_many end to end (score + hydrate), needs --mongo_url
+    rerank                        the local target plus the cross-encoder rerank stage (see reranker.py)
+    atlas                         atlas_vector_search against --mongo_url (Atlas, or a local Atlas deployment),
+                                  or a recorded stand-in with --replay
+
+Index targets run on a corpus of clustered synthetic unit vectors (--sizes, --dimension, 1k to 10M rows),
+optionally cached as a memory-mappable snapshot under --cache, or on the embeddings of a snapshot
+written by `load_data.py --snapshot`. Queries are corpus rows with added noise; recall@k is measured
+against an exact scan of the same corpus. The local, rerank and atlas targets use headlines sampled
+from the collection as queries. For local and rerank, label_precision@k is the share of the top k results
+(the query's own document excluded) that have the query headline's label, a relevance measure both stages
+share; recall@k of the rerank target is its overlap with the exact bi-encoder top k. Rerank scores are
+not cached across the timed queries; `--record` saves the live Atlas responses and latencies, and `--replay` serves
+them back without a server, so the Atlas path can be benchmarked anywhere.
+
+Usage:
+    python benchmark.py --sizes 1000 100000 --dimension 384 --targets exact ivf int8 --output bench.json
+    python benchmark.py --sizes 10000000 --cache .benchmarks --targets exact ivf --queries 100
+    python benchmark.py --snapshot snapshots/ag_news --targets exact ivf binary
+    python benchmark.py --mongo_url <MONGODB_URI> --targets local rerank atlas --record atlas.json
+    python benchmark.py --targets atlas --replay atlas.json
+    # exits with status 1 when a metric regressed by more than the tolerance
+    python benchmark.py --compare baseline.json bench.json --tolerance 0.1
+"""
+
+import argparse, dotenv, json, math, os, platform, subprocess, sys, time
+import numpy as np
+from bson import json_util
+from bson.binary import Binary
+from embedding_index import EmbeddingIndex
+from embedding_snapshot import load_snapshot, write_snapshot
+from index_backends import create_backend, top_k_rows
+
+INDEX_TARGETS = ("exact", "ivf", "float16", "int8", "binary")
+TARGETS = INDEX_TARGETS + ("local", "rerank", "atlas")
+HIGHER_IS_BETTER = ("qps",)
+LOWER_IS_BETTER = ("p50_ms", "p95_ms", "p99_ms", "index_bytes")
+SYNTHETIC_MODEL = "synthetic"
+_CHUNK = 65536
+
+# === Corpus and queries ===
+def synthetic_corpus(size: int, dimension: int = 384, clusters: int = None, spread: float = 0.5,
+                     seed: int = 0, out: np.ndarray = None) -> np.ndarray:
+    """
+    Generates `size` unit vectors scattered around `clusters` random centers (default sqrt(size)),
+    which, unlike uniform random vectors, have meaningful nearest neighbors. Rows are generated in
+    chunks, so `out` can be a memory map larger than RAM.
+    """
+    rng = np.random.default_rng(seed)
+    clusters = clusters or max(1, int(math.sqrt(size)))
+    centers = rng.standard_normal((clusters, dimension)).astype(np.float32)
+    centers /= np.linalg.norm(centers, axis=1, keepdims=True)
+    matrix = out if out is not None else np.empty((size, dimension), dtype=np.float32)
+    for start in range(0, size, _CHUNK):
+        count = min(_CHUNK, size - start)
+        rows = centers[rng.integers(clusters, size=count)]
+        rows = rows + (spread / math.sqrt(dimension)) * rng.standard_normal((count, dimension)).astype(np.float32)
+        matrix[start:start + count] = rows / np.linalg.norm(rows, axis=1, keepdims=True)
+    return matrix
+
+def load_corpus(size: int, dimension: int = 384, seed: int = 0, cache: str = None) -> np.ndarray:
+    """
+    Returns the synthetic corpus, memory-mapped from the snapshot under `cache` when it was
+    generated before (and written there otherwise).
+    """
+    if not cache:
+        return synthetic_corpus(size, dimension, seed=seed)
+    path = os.path.join(cache, f"synthetic-{size}x{dimension}-seed{seed}")
+    if not os.path.isdir(path):
+        os.makedirs(cache, exist_ok=True)
+        scratch = f"{path}.f32"
+        matrix = synthetic_corpus(size, dimension, seed=seed,
+                                  out=np.memmap(scratch, dtype="<f4", mode="w+", shape=(size, dimension)))
+        write_snapshot(path, matrix, np.arange(size), model=SYNTHETIC_MODEL, source="synthetic")
+        del matrix
+        os.remove(scratch)
+    return load_snapshot(path, model=SYNTHETIC_MODEL)[0]
+
+def noisy_queries(matrix: np.ndarray, count: int, noise: float = 0.2, seed: int = 1) -> np.ndarray:
+    """
+    Corpus rows perturbed by `noise` and renormalized, so each query has near but not identical neighbors.
+    """
+    rng = np.random.default_rng(seed)
+    rows = np.asarray(matrix[np.sort(rng.choice(len(matrix), size=min(count, len(matrix)), replace=False))],
+                      dtype=np.float32)
+    rows = rows + (noise / math.sqrt(matrix.shape[1])) * rng.standard_normal(rows.shape).astype(np.float32)
+    return rows / np.linalg.norm(rows, axis=1, keepdims=True)
+
+def exact_top_k(matrix: np.ndarray, queries: np.ndarray, k: int) -> np.ndarray:
+    """
+    Positions of the exact top-k rows per query, scanning the corpus in chunks so that the
+    score matrix stays small at any corpus size.
+    """
+    best_positions = np.empty((len(queries), 0), dtype=np.int64)
+    best_scores = np.empty((len(queries), 0), dtype=np.float32)
+    for start in range(0, len(matrix), 4 * _CHUNK):
+        positions, scores = top_k_rows(queries @ np.asarray(matrix[start:start + 4 * _CHUNK]).T, k)
+        positions = np.concatenate([best_positions, positions + start], axis=1)
+        top, best_scores = top_k_rows(np.concatenate([best_scores, scores], axis=1), k)
+        best_positions = np.take_along_axis(positions, top, axis=1)
+    return best_positions
+
+# === Measurement ===
+def percentile(values: list, fraction: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+def recall_at_k(truth: list, found: list, k: int) -> float:
+    """
+    Fraction of the exact top-k ids that the search also returned in its top-k.
+    """
+    hits = sum(len(set(expected[:k]) & set(result[:k])) for expected, result in zip(truth, found))
+    return hits / max(1, sum(len(expected[:k]) for expected in truth))
+
+def rss_bytes() -> int:
+    """
+    Resident set size of this process (peak RSS where /proc is unavailable).
+    """
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+def array_bytes(obj) -> int:
+    return int(sum(value.nbytes for value in vars(obj).values() if isinstance(value, np.ndarray)))
+
+def measure(search, queries, batch: int = 1, warmup: int = 10) -> tuple:
+    """
+    Calls `search` on consecutive batches of `queries` after `warmup` untimed queries.
+
+    Returns:
+        tuple: (one id list per query, per-call latencies in seconds, total seconds)
+    """
+    for start in range(0, min(warmup, len(queries)), batch):
+        search(queries[start:start + batch])
+    found, latencies = [], []
+    began = time.perf_counter()
+    for start in range(0, len(queries), batch):
+        call = time.perf_counter()
+        found.extend(search(queries[start:start + batch]))
+        latencies.append(time.perf_counter() - call)
+    return found, latencies, time.perf_counter() - began
+
+def summarize(target: str, found: list, latencies: list, seconds: float, truth: list, ks=(1, 5, 10),
+              batch: int = 1) -> dict:
+    milliseconds = [latency * 1000 for latency in latencies]
+    report = {
+        "target": target,
+        "queries": len(found),
+        "batch": batch,
+        "top_k": max(ks),
+        "qps": len(found) / seconds if seconds else 0.0,
+        "mean_ms": sum(milliseconds) / max(1, len(milliseconds)),
+        "p50_ms": percentile(milliseconds, 0.50),
+        "p95_ms": percentile(milliseconds, 0.95),
+        "p99_ms": percentile(milliseconds, 0.99),
+    }
+    for k in ks:
+        report[f"recall@{k}"] = recall_at_k(truth, found, k)
+    return report
+
+# === Targets ===
+def create_index(target: str, nprobe: int = 8) -> EmbeddingIndex:
+    if target not in INDEX_TARGETS:
+        raise ValueError(f"Unknown index target '{target}', expected one of {INDEX_TARGETS}")
+    if target == "ivf":
+        return EmbeddingIndex(None, backend=create_backend("ivf", nprobe=nprobe))
+    return EmbeddingIndex(None, storage="float32" if target == "exact" else target)
+
+def run_index_target(target: str, matrix: np.ndarray, queries: np.ndarray, truth: list, ks=(1, 5, 10),
+                     batch: int = 1, warmup: int = 10, nprobe: int = 8) -> dict:
+    """
+    Loads `matrix` into an EmbeddingIndex for `target` and times `search_many` on the queries.
+    """
+    index = create_index(target, nprobe)
+    start = time.perf_counter()
+    index.load_matrix(matrix, range(len(matrix)))
+    build_seconds = time.perf_counter() - start
+
+    def search(chunk):
+        return [[doc_id for doc_id, _ in row] for row in index.search_many(chunk, max(ks))]
+
+    found, latencies, seconds = measure(search, queries, batch, warmup)
+    report = summarize(target, found, latencies, seconds, truth, ks, batch)
+    report.update({"corpus": int(matrix.shape[0]), "dimension": int(matrix.shape[1]),
+                   "build_seconds": build_seconds, "index_bytes": int(index.nbytes),
+                   "backend_bytes": array_bytes(index.backend), "rss_bytes": rss_bytes()})
+    if target == "ivf":
+        report["nprobe"] = nprobe
+    return report
+
+def sample_docs(collection, count: int) -> list:
+    return list(collection.aggregate([{"$sample": {"size": count}}, {"$project": {"text": 1, "label": 1}}]))
+
+def sample_texts(collection, count: int) -> list:
+    return [doc["text"] for doc in sample_docs(collection, count)]
+
+def label_precision(labeled: list, ranked: list, k: int) -> float:
+    """
+    Share of the top k results that have their query's label, skipping the query's own document.
+
+    Args:
+        labeled (list): (document id, label) of each query headline.
+        ranked (list): Per query, results with "id" and "label".
+    """
+    matches = total = 0
+    for (doc_id, label), results in zip(labeled, ranked):
+        top = [result["label"] for result in results if result["id"] != doc_id][:k]
+        matches += sum(value == label for value in top)
+        total += len(top)
+    return matches / total if total else 0.0
+
+def run_local_target(mongo_url: str, texts: list, ks=(1, 5, 10), batch: int = 1, warmup: int = 10,
+                     rerank: bool = False, labeled: list = None) -> dict:
+    """
+    Times sbert_vector_search.search_many (resident index search and hydration, plus the
+    cross-encoder stage with `rerank`) on query texts. Recall, and label precision when the
+    (id, label) of each query is `labeled`, are measured on the same queries outside the timed loop.
+    The in-process embedding cache is cleared before the timed loop, so timed queries are encoded;
+    "embedding_cache_hit_rate" reports any hits left, e.g. from a persistent cache tier.
+    """
+    from atlas_vector_search import encode_queries
+    from embedding_cache import get_cache
+    from reranker import get_reranker, rerank_depth
+    from sbert_vector_search import get_index, search_many
+    index = get_index(mongo_url)
+    truth_positions = exact_top_k(index.embeddings, encode_queries(texts), max(ks))
+    truth = [[index.ids[p] for p in row] for row in truth_positions]
+
+    def search(chunk):
+        return search_many(chunk, mongo_url, max(ks), rerank=rerank)
+
+    # Load the models, then forget the embeddings (and rerank scores) of the warmup and recall
+    # queries so timed queries are not cache hits
+    measure(search, texts[:warmup], batch, 0)
+    get_cache().clear()
+    if rerank:
+        get_reranker().clear()
+    _, latencies, seconds = measure(search, texts, batch, 0)
+    cache_hit_rate = get_cache().stats().get("hit_rate", 0.0)
+    ranked = search_many(texts, mongo_url, max(ks) + 1, fields=("id", "label"), rerank=rerank)
+    found = [[result["id"] for result in results][:max(ks)] for results in ranked]
+    report = summarize("rerank" if rerank else "local", found, latencies, seconds, truth, ks, batch)
+    report["embedding_cache_hit_rate"] = cache_hit_rate
+    if labeled:
+        for k in ks:
+            report[f"label_precision@{k}"] = label_precision(labeled, ranked, k)
+    if rerank:
+        stats = get_reranker().stats()
+        report.update({"rerank_model": stats["model"], "rerank_candidates": rerank_depth(max(ks)),
+                       "rerank_pair_ms": stats["pair_ms"], "rerank_skipped": stats["skipped"]})
+    report.update({"corpus": len(index), "dimension": int(index.embeddings.shape[1]),
+                   "index_bytes": int(index.nbytes), "backend_bytes": array_bytes(index.backend),
+                   "rss_bytes": rss_bytes()})
+    return report
+
+def _vector_key(value) -> bytes:
+    vector = value.as_vector().data if isinstance(value, Binary) else value
+    return np.asarray(vector, dtype="<f4").tobytes()
+
+class RecordingCollection:
+    """
+    Wraps a collection and records each $vectorSearch query vector, result ids and server time.
+    """
+    def __init__(self, collection):
+        self.collection = collection
+        self.calls = []
+
+    def aggregate(self, pipeline):
+        start = time.perf_counter()
+        docs = list(self.collection.aggregate(pipeline))
+        vector = _vector_key(pipeline[0]["$vectorSearch"]["queryVector"])
+        self.calls.append({"vector": np.frombuffer(vector, dtype="<f4").tolist(), "docs": docs,
+                           "ms": 1000 * (time.perf_counter() - start)})
+        return docs
+
+class RecordedCollection:
+    """
+    Stand-in for an Atlas collection that answers $vectorSearch queries from a recording,
+    waiting the recorded server time scaled by `latency` (0 measures only the client side).
+    """
+    def __init__(self, recording: dict, latency: float = 1.0):
+        self.latency = latency
+        self.responses = {np.asarray(call["vector"], dtype="<f4").tobytes(): call for call in recording["calls"]}
+
+    def aggregate(self, pipeline):
+        call = self.responses.get(_vector_key(pipeline[0]["$vectorSearch"]["queryVector"]))
+        if call is None:
+            raise KeyError("Query vector is not in the recording")
+        if self.latency:
+            time.sleep(self.latency * call["ms"] / 1000)
+        return [dict(doc) for doc in call["docs"]]
+
+def run_atlas_target(collection, vectors: np.ndarray, truth: list, ks=(1, 5, 10), warmup: int = 10,
+                     corpus: int = None, **options) -> dict:
+    """
+    Times atlas_vector_search.atlas_search_many, one $vectorSearch per query, on `collection`
+    (a live collection, a RecordingCollection or a RecordedCollection).
+    """
+    from atlas_vector_search import atlas_search_many
+
+    def search(chunk):
+        return [[doc["_id"] for doc in docs]
+                for docs in atlas_search_many(collection, chunk, max(ks), projection={"_id": 1}, **options)]
+
+    found, latencies, seconds = measure(search, vectors, 1, warmup)
+    report = summarize("atlas", found, latencies, seconds, truth, ks)
+    report.update({"corpus": corpus, "dimension": int(vectors.shape[1]), "rss_bytes": rss_bytes(),
+                   "replayed": isinstance(collection, RecordedCollection)})
+    return report
+
+def save_recording(path: str, recorder: RecordingCollection, truth: list, corpus: int, namespace: str):
+    with open(path, "w") as f:
+        f.write(json_util.dumps({"namespace": namespace, "corpus": corpus, "truth": truth, "calls": recorder.calls}))
+
+def load_recording(path: str) -> dict:
+    with open(path) as f:
+        return json_util.loads(f.read())
+
+# === Reports ===
+def metadata(args: dict = None) -> dict:
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        commit = None
+    return {"commit": commit, "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"), "python": platform.python_version(),
+            "numpy": np.__version__, "platform": platform.platform(), "cpus": os.cpu_count(), "args": args or {}}
+
+def result_key(result: dict) -> tuple:
+    return (result["target"], result.get("corpus"), result.get("dimension"), result.get("batch"), result.get("top_k"),
+            result.get("nprobe"))
+
+def compare_reports(baseline: dict, current: dict, tolerance: float = 0.1, recall_tolerance: float = 0.01) -> list:
+    """
+    Compares the results two benchmark runs have in common (same target, corpus, dimension,
+    batch, top-k and nprobe). QPS, latency and index memory regress when they are more than
+    `tolerance` (relative) worse; recall@k regresses when it drops by more than `recall_tolerance`.
+
+    Returns:
+        list: One row per compared metric with its baseline, current value, change and a regression flag.
+    """
+    previous = {result_key(result): result for result in baseline["results"]}
+    rows = []
+    for result in current["results"]:
+        old = previous.get(result_key(result))
+        if old is None:
+            continue
+        for metric, value in result.items():
+            if metric not in old or not isinstance(value, (int, float)) or isinstance(value, bool):
+                continue
+            before = old[metric]
+            if metric.startswith(("recall@", "label_precision@")):
+                change = value - before
+                regression = change < -recall_tolerance
+            elif metric in HIGHER_IS_BETTER or metric in LOWER_IS_BETTER:
+                change = (value - before) / before if before else 0.0
+                regression = change < -tolerance if metric in HIGHER_IS_BETTER else change > tolerance
+            else:
+                continue
+            rows.append({"target": result["target"], "corpus": result.get("corpus"), "metric": metric,
+                         "baseline": before, "current": value, "change": change, "regression": regression})
+    return rows
+
+def print_comparison(rows: list):
+    for row in rows:
+        change = (f"{row['change']:+.3f}" if row["metric"].startswith(("recall@", "label_precision@"))
+                  else f"{100 * row['change']:+.1f}%")
+        flag = "  REGRESSION" if row["regression"] else ""
+        print(f"{row['target']:>8} {str(row['corpus']):>9} {row['metric']:>12}: "
+              f"{row['baseline']:.4g} -> {row['current']:.4g} ({change}){flag}")
+
+def run_benchmarks(args) -> dict:
+    ks = tuple(args.k)
+    results = []
+    index_targets = [target for target in args.targets if target in INDEX_TARGETS]
+    if index_targets:
+        if args.snapshot:
+            full = load_snapshot(args.snapshot)[0]
+            corpora = [full[:size] for size in (args.sizes or [len(full)]) if size <= len(full)]
+        else:
+            corpora = (load_corpus(size, args.dimension, args.seed, args.cache) for size in args.sizes)
+        for matrix in corpora:
+            queries = noisy_queries(matrix, args.queries, seed=args.seed + 1)
+            truth = exact_top_k(matrix, queries, max(ks)).tolist()
+            for target in index_targets:
+                report = run_index_target(target, matrix, queries, truth, ks, args.batch, args.warmup, args.nprobe)
+                print(f"{target} on {report['corpus']} x {report['dimension']}: {report['qps']:.1f} qps, "
+                      f"p99 {report['p99_ms']:.3f} ms, recall@{max(ks)} {report[f'recall@{max(ks)}']:.3f}",
+                      file=sys.stderr)
+                results.append(report)
+
+    mongo_url = args.mongo_url or os.getenv("MONGO_URL")
+    local_targets = [target for target in ("local", "rerank") if target in args.targets]
+    if local_targets:
+        from sbert_vector_search import get_index
+        docs = sample_docs(get_index(mongo_url).collection, args.queries)
+        texts, labeled = [doc["text"] for doc in docs], [(doc["_id"], doc.get("label")) for doc in docs]
+        for target in local_targets:
+            report = run_local_target(mongo_url, texts, ks, args.batch, args.warmup, target == "rerank", labeled)
+            print(f"{target}: {report['qps']:.1f} qps, p99 {report['p99_ms']:.3f} ms, "
+                  f"label_precision@{max(ks)} {report[f'label_precision@{max(ks)}']:.3f}", file=sys.stderr)
+            results.append(report)
+
+    if "atlas" in args.targets:
+        from atlas_vector_search import encode_queries, get_collection
+        if args.replay:
+            recording = load_recording(args.replay)
+            collection = RecordedCollection(recording, args.replay_latency)
+            vectors = np.asarray([call["vector"] for call in recording["calls"]], dtype=np.float32)
+            truth, corpus = recording["truth"], recording["corpus"]
+        else:
+            live = get_collection(mongo_url, args.namespace)
+            ground = EmbeddingIndex(live).load()
+            vectors = encode_queries(sample_texts(live, args.queries))
+            truth = [[ground.ids[p] for p in row] for row in exact_top_k(ground.embeddings, vectors, max(ks))]
+            corpus = len(ground)
+            collection = RecordingCollection(live) if args.record else live
+        # Replays start at the first recorded query, so nothing is spent on warmup
+        results.append(run_atlas_target(collection, vectors, truth, ks, 0 if args.replay else args.warmup, corpus,
+                                        num_candidates=args.num_candidates))
+        if args.record and not args.replay:
+            collection.calls = collection.calls[-len(vectors):]
+            save_recording(args.record, collection, truth, corpus, live.full_name)
+    return {"meta": metadata(vars(args)), "results": results}
+
+if __name__ == "__main__":
+    dotenv.load_dotenv()
+    parser = argparse.ArgumentParser(description="Benchmark the local and Atlas search paths")
+    parser.add_argument("--targets", nargs="+", choices=TARGETS, default=["exact", "ivf"], help="Search paths to run")
+    parser.add_argument("--sizes", type=int, nargs="+", help="Corpus sizes (default: 1000 10000; prefixes of --snapshot)")
+    parser.add_argument("--dimension", type=int, default=384, help="Synthetic embedding dimension")
+    parser.add_argument("--cache", help="Directory caching synthetic corpora as memory-mappable snapshots")
+    parser.add_argument("--snapshot", help="Benchmark index targets on this embedding snapshot instead")
+    parser.add_argument("--queries", type=int, default=200, help="Number of queries per run")
+    parser.add_argument("--batch", type=int, default=1, help="Queries per search call")
+    parser.add_argument("--warmup", type=int, default=10, help="Untimed queries before each run")
+    parser.add_argument("--k", type=int, nargs="+", default=[1, 5, 10], help="k values for recall@k")
+    parser.add_argument("--nprobe", type=int, default=8, help="IVF lists scanned per query")
+    parser.add_argument("--seed", type=int, default=0, help="Seed for the corpus and queries")
+    parser.add_argument("--mongo_url", help="MongoDB connection URI for the local and atlas targets")
+    parser.add_argument("--namespace", help="database.collection for the atlas target (default: env ATLAS_NAMESPACE)")
+    parser.add_argument("--num_candidates", type=int, help="numCandidates for the atlas target")
+    parser.add_argument("--record", help="Save the live Atlas responses to this file")
+    parser.add_argument("--replay", help="Serve the atlas target from a recording instead of a server")
+    parser.add_argument("--replay_latency", type=float, default=1.0, help="Scale of the recorded server time to wait")
+    parser.add_argument("--output", help="Write the JSON report to this file (default: stdout)")
+    parser.add_argument("--compare", nargs=2, metavar=("BASELINE", "CURRENT"), help="Compare two JSON reports")
+    parser.add_argument("--tolerance", type=float, default=0.1, help="Relative QPS/latency/memory change allowed")
+    parser.add_argument("--recall_tolerance", type=float, default=0.01, help="Absolute recall@k drop allowed")
+    args = parser.parse_args()
+
+    if args.compare:
+        with open(args.compare[0]) as f:
+            baseline = json.load(f)
+        with open(args.compare[1]) as f:
+            current = json.load(f)
+        rows = compare_reports(baseline, current, args.tolerance, args.recall_tolerance)
+        print_comparison(rows)
+        regressions = sum(row["regression"] for row in rows)
+        print(f"{len(rows)} metrics compared, {regressions} regressions")
+        sys.exit(1 if regressions else 0)
+
+    if args.sizes is None and not args.snapshot:
+        args.sizes = [1000, 10000]
+    output = json.dumps(run_benchmarks(args), indent=2, default=str)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output)
+    else:
+        print(output)
@@ -0,0 +1,188 @@
+"""
+embedding_cache.py
+@ken.chen
+
+Content-addressed cache of text embeddings keyed by (model name, normalized text hash), so the
+same headlines and queries are not re-encoded. Lookups go through an in-process LRU tier first
+and an optional persistent tier second: a local SQLite file or a MongoDB side collection.
+
+Usage:
+    from embedding_cache import get_cache
+    embeddings = get_cache().encode(model, texts, "all-MiniLM-L6-v2")
+    print(get_cache().stats())
+
+Environment:
+    EMBEDDING_CACHE_SIZE: entries kept in the in-process LRU tier (default: 10000, 0 disables the cache)
+    EMBEDDING_CACHE_PATH: SQLite file for the persistent tier (optional)
+    EMBEDDING_CACHE_MONGO: set to "true" to persist into testdb.embedding_cache at MONGO_URL instead
+"""
+
+import hashlib, os, sqlite3, threading, unicodedata
+from collections import OrderedDict
+import numpy as np
+from bson.binary import Binary
+from pymongo import ReplaceOne
+from metrics import inc, timer
+from mongo_pool import get_client
+
+def normalize_text(text: str) -> str:
+    return " ".join(unicodedata.normalize("NFC", text).split())
+
+def cache_key(model_name: str, text: str) -> str:
+    return hashlib.sha256(f"{model_name}\0{normalize_text(text)}".encode()).hexdigest()
+
+class SQLiteStore:
+    def __init__(self, path: str):
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._lock = threading.Lock()
+        with self._lock, self._conn:
+            self._conn.execute("CREATE TABLE IF NOT EXISTS embeddings (key TEXT PRIMARY KEY, vector BLOB NOT NULL)")
+
+    def get_many(self, keys: list) -> dict:
+        found = {}
+        with self._lock:
+            for start in range(0, len(keys), 500):
+                chunk = keys[start:start + 500]
+                rows = self._conn.execute(
+                    f"SELECT key, vector FROM embeddings WHERE key IN ({','.join('?' * len(chunk))})", chunk)
+                found.update((key, np.frombuffer(vector, dtype="<f4")) for key, vector in rows)
+        return found
+
+    def put_many(self, items: dict):
+        with self._lock, self._conn:
+            self._conn.executemany("INSERT OR REPLACE INTO embeddings (key, vector) VALUES (?, ?)",
+                                   [(key, np.asarray(vector, dtype="<f4").tobytes()) for key, vector in items.items()])
+
+class MongoStore:
+    def __init__(self, collection):
+        self.collection = collection
+
+    def get_many(self, keys: list) -> dict:
+        return {doc["_id"]: np.frombuffer(doc["vector"], dtype="<f4")
+                for doc in self.collection.find({"_id": {"$in": keys}}, {"vector": 1})}
+
+    def put_many(self, items: dict):
+        self.collection.bulk_write([
+            ReplaceOne({"_id": key}, {"_id": key, "vector": Binary(np.asarray(vector, dtype="<f4").tobytes())}, upsert=True)
+            for key, vector in items.items()
+        ], ordered=False)
+
+class EmbeddingCache:
+    def __init__(self, capacity: int = 10000, store=None):
+        """
+        Args:
+            capacity (int): Entries kept in the in-process LRU tier.
+            store: Optional persistent tier exposing get_many(keys) and put_many({key: vector}).
+        """
+        self.capacity = capacity
+        self.store = store
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.memory_hits = 0
+        self.store_hits = 0
+        self.misses = 0
+
+    def get_many(self, keys: list) -> dict:
+        found = {}
+        with self._lock:
+            for key in keys:
+                if key in self._entries:
+                    self._entries.move_to_end(key)
+                    found[key] = self._entries[key]
+            self.memory_hits += len(found)
+        missing = [key for key in dict.fromkeys(keys) if key not in found]
+        if missing and self.store is not None:
+            stored = self.store.get_many(missing)
+            self._remember(stored)
+            with self._lock:
+                self.store_hits += len(stored)
+            found.update(stored)
+        return found
+
+    def put_many(self, items: dict):
+        self._remember(items)
+        if items and self.store is not None:
+            self.store.put_many(items)
+
+    def _remember(self, items: dict):
+        with self._lock:
+            for key, vector in items.items():
+                self._entries[key] = vector
+                self._entries.move_to_end(key)
+            while len(self._entries) > self.capacity:
+                self._entries.popitem(last=False)
+
+    def encode(self, model, texts: list, model_name: str, **kwargs) -> np.ndarray:
+        """
+        Returns embeddings for `texts`, encoding only the texts missing from the cache in one
+        `model.encode` call. Extra keyword arguments are passed to `model.encode`.
+        """
+        texts = list(texts)
+        keys = [cache_key(model_name, text) for text in texts]
+        found = self.get_many(keys)
+        missing = list(dict.fromkeys(key for key in keys if key not in found))
+        with self._lock:
+            self.misses += len(missing)
+        inc("mcp_embedding_cache_total", len(found), result="hit")
+        inc("mcp_embedding_cache_total", len(missing), result="miss")
+        if missing:
+            first_text = {}
+            for key, text in zip(keys, texts):
+                first_text.setdefault(key, text)
+            with timer("encode"):
+                encoded = np.atleast_2d(np.asarray(model.encode([first_text[key] for key in missing], **kwargs),
+                                                   dtype=np.float32))
+            fresh = dict(zip(missing, encoded))
+            self.put_many(fresh)
+            found.update(fresh)
+        return np.stack([found[key] for key in keys]) if keys else np.empty((0, 0), dtype=np.float32)
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.memory_hits + self.store_hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "memory_hits": self.memory_hits,
+                "store_hits": self.store_hits,
+                "misses": self.misses,
+                "hit_rate": (self.memory_hits + self.store_hits) / lookups if lookups else 0.0,
+            }
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.memory_hits = self.store_hits = self.misses = 0
+
+class _NoCache:
+    """
+    Stand-in used when EMBEDDING_CACHE_SIZE is 0: always encodes.
+    """
+    def encode(self, model, texts: list, model_name: str, **kwargs) -> np.ndarray:
+        with timer("encode"):
+            return np.atleast_2d(np.asarray(model.encode(list(texts), **kwargs), dtype=np.float32))
+
+    def stats(self) -> dict:
+        return {}
+
+    def clear(self):
+        pass
+
+_cache = None
+_cache_lock = threading.Lock()
+
+def get_cache():
+    """
+    Returns the process-wide cache configured from the environment.
+    """
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            capacity = int(os.getenv("EMBEDDING_CACHE_SIZE", "10000"))
+            store = None
+            if os.getenv("EMBEDDING_CACHE_PATH"):
+                store = SQLiteStore(os.getenv("EMBEDDING_CACHE_PATH"))
+            elif os.getenv("EMBEDDING_CACHE_MONGO", "false").lower() == "true":
+                client = get_client(os.getenv("MONGO_URL", "mongodb://localhost:27017/"))
+                store = MongoStore(client["testdb"]["embedding_cache"])
+            _cache = EmbeddingCache(capacity, store) if capacity > 0 else _NoCache()
+        return _cache
@@ -0,0 +1,530 @@
+"""
+embedding_index.py
+@ken.chen
+
+Keeps the embeddings of a MongoDB collection resident in memory as a contiguous float32
+matrix with a parallel id array. The index is loaded once and kept current through a
+MongoDB change stream, or by polling on `_id`/`updated_at` when the server has no change
+streams (standalone mongod); when a poll leaves the index with a different number of rows than
+the collection holds, deleted documents are found by comparing the resident ids with the
+collection's `_id` index. Searches only touch the matrix; text and label are fetched
+afterwards for the top-k ids.
+
+With `storage` set to "float16", "int8" or "binary" (see quantization.py) the matrix holds the
+compact codes instead and queries are scored on them directly; `rescore` re-ranks a shortlist
+of `rescore * top_k` rows with the best precision stored in MongoDB: `rescore_field`, or by
+default `<field>_full` (load_data.py --keep_full) and else `field` when it is stored as float32.
+
+Metadata fields listed in `filter_fields` (e.g. "label") get per-value posting lists, so a
+filtered search such as {"label": 1} or {"label": {"$in": [1, 2]}} only scores the matching
+rows. Filters use the same MQL shape as the Atlas $vectorSearch `filter`.
+
+Usage:
+    from embedding_index import EmbeddingIndex
+    index = EmbeddingIndex(collection).load()
+    index.start()                          # background refresh
+    hits = index.search(query_embedding, top_k=5)
+    batch = index.search_many(query_embeddings, top_k=5)
+    sports = index.search_many(query_embeddings, top_k=5, filters={"label": 1})   # with filter_fields=("label",)
+    docs = index.hydrate([doc_id for doc_id, _ in hits])
+"""
+
+import threading
+import numpy as np
+from bson.min_key import MinKey
+from pymongo.errors import OperationFailure, PyMongoError
+from embedding_snapshot import load_snapshot, snapshot_last_updated
+from index_backends import ExactBackend, IndexBackend, top_k_rows
+from metrics import timer
+from quantization import Codec, from_bson, stored_format
+
+class EmbeddingIndex:
+    def __init__(self, collection, field: str = "embedding", updated_field: str = "updated_at",
+                 poll_interval: float = 5.0, backend: IndexBackend = None, storage: str = "float32",
+                 rescore: int = 0, rescore_field: str = None, filter_fields: tuple = ()):
+        """
+        Args:
+            collection: pymongo collection holding the documents and their embeddings.
+            backend (IndexBackend): Search backend (default: exact scan, see index_backends.py).
+            field (str): Name of the embedding field.
+            updated_field (str): Timestamp field used to pick up updates when polling.
+            poll_interval (float): Seconds between polls when change streams are unavailable.
+            storage (str): Resident format: "float32", "float16", "int8" or "binary".
+            rescore (int): Shortlist multiplier for full-precision rescoring of compact formats (0 disables).
+            rescore_field (str): Field holding the rescoring vectors (default: `<field>_full`, or
+                `field` for documents without it when `field` is stored as float32).
+            filter_fields (tuple): Metadata fields indexed with posting lists for filtered search.
+        """
+        self.collection = collection
+        self.field = field
+        self.updated_field = updated_field
+        self.poll_interval = poll_interval
+        self.backend = backend or ExactBackend()
+        self.codec = Codec(storage)
+        if self.codec.format != "float32" and not isinstance(self.backend, ExactBackend):
+            raise ValueError(f"Storage format '{storage}' is only supported with the exact backend")
+        self.rescore = rescore
+        self.rescore_field = rescore_field
+        self.filter_fields = tuple(filter_fields)
+        self._postings = {name: {} for name in self.filter_fields}   # field -> value -> set of positions
+        self._values = {name: {} for name in self.filter_fields}     # field -> position -> value
+        self._posting_arrays = {}
+        self._dimension = 0
+        self._matrix = np.empty((0, 0), dtype=self.codec.dtype)
+        self._scales = np.empty(0, dtype=np.float32)
+        self._ids = np.empty(0, dtype=object)
+        self._positions = {}
+        self._size = 0
+        self._last_id = None
+        self._last_updated = None
+        self._resume_token = None
+        self._lock = threading.RLock()
+        self._stop = threading.Event()
+        self._thread = None
+        self.mode = None
+
+    def __len__(self):
+        return self._size
+
+    @property
+    def embeddings(self) -> np.ndarray:
+        """
+        The resident embeddings as float32 (decoded from the compact codes when quantized).
+        """
+        if self.codec.format == "float32":
+            return self._matrix[:self._size]
+        return self.codec.decode(self._matrix[:self._size], self._scales[:self._size], self._dimension)
+
+    @property
+    def codes(self) -> np.ndarray:
+        return self._matrix[:self._size]
+
+    @property
+    def nbytes(self) -> int:
+        return self.codec.nbytes(self._matrix[:self._size], self._scales[:self._size] if self._scales.size else None)
+
+    def _projection(self) -> dict:
+        projection = {"_id": 1, self.field: 1, f"{self.field}_scale": 1, self.updated_field: 1}
+        projection.update({name: 1 for name in self.filter_fields})
+        return projection
+
+    # === Metadata posting lists ===
+    def _reset_postings(self):
+        self._postings = {name: {} for name in self.filter_fields}
+        self._values = {name: {} for name in self.filter_fields}
+        self._posting_arrays = {}
+
+    def _index_metadata(self, position: int, metadata: dict):
+        for name in self.filter_fields:
+            value = metadata.get(name)
+            values = self._values[name]
+            if position in values:
+                if values[position] == value:
+                    continue
+                self._unindex_field(name, position)
+            values[position] = value
+            self._postings[name].setdefault(value, set()).add(position)
+            self._posting_arrays.pop((name, value), None)
+
+    def _unindex_field(self, name: str, position: int):
+        value = self._values[name].pop(position)
+        self._postings[name][value].discard(position)
+        self._posting_arrays.pop((name, value), None)
+
+    def _move_metadata(self, source: int, target: int):
+        for name in self.filter_fields:
+            if target in self._values[name]:
+                self._unindex_field(name, target)
+            if source in self._values[name]:
+                value = self._values[name][source]
+                self._unindex_field(name, source)
+                self._index_metadata(target, {name: value})
+
+    def _posting_array(self, name: str, value) -> np.ndarray:
+        key = (name, value)
+        if key not in self._posting_arrays:
+            self._posting_arrays[key] = np.fromiter(sorted(self._postings[name].get(value, ())), dtype=np.int64)
+        return self._posting_arrays[key]
+
+    def filter_positions(self, filters: dict) -> np.ndarray:
+        """
+        Rows matching every condition of `filters`: {field: value}, {field: {"$eq": value}}
+        or {field: {"$in": [values]}} on fields listed in `filter_fields`.
+        """
+        matched = None
+        for name, condition in filters.items():
+            if name not in self._postings:
+                raise ValueError(f"Field '{name}' is not indexed for filtering, expected one of {self.filter_fields}")
+            if isinstance(condition, dict):
+                unsupported = set(condition) - {"$eq", "$in"}
+                if unsupported:
+                    raise ValueError(f"Unsupported filter operators {sorted(unsupported)} on '{name}'")
+                values = condition["$in"] if "$in" in condition else [condition["$eq"]]
+            else:
+                values = [condition]
+            arrays = [self._posting_array(name, value) for value in values]
+            positions = np.unique(np.concatenate(arrays)) if arrays else np.empty(0, dtype=np.int64)
+            matched = positions if matched is None else np.intersect1d(matched, positions, assume_unique=True)
+        return matched if matched is not None else np.arange(self._size)
+
+    def _set_matrix(self, matrix: np.ndarray):
+        self._dimension = matrix.shape[1]
+        if self.codec.format == "float32":
+            self._matrix = matrix
+            self._scales = np.empty(0, dtype=np.float32)
+            return
+        codes, scales = self.codec.encode(matrix)
+        self._matrix = codes
+        self._scales = scales if scales is not None else np.empty(0, dtype=np.float32)
+
+    @property
+    def ids(self) -> np.ndarray:
+        return self._ids[:self._size]
+
+    def load(self):
+        """
+        (Re)loads every embedding from the collection, replacing the resident matrix.
+        """
+        ids, vectors, last_updated = [], [], None
+        metadata = []
+        for doc in self.collection.find({}, self._projection()):
+            if doc.get(self.field) is None:
+                continue
+            ids.append(doc["_id"])
+            vectors.append(from_bson(doc, self.field))
+            metadata.append(doc)
+            updated = doc.get(self.updated_field)
+            if updated is not None and (last_updated is None or updated > last_updated):
+                last_updated = updated
+
+        matrix = np.ascontiguousarray(np.asarray(vectors, dtype=np.float32))
+        if matrix.ndim != 2:
+            matrix = matrix.reshape(0, 0)
+        id_array = np.empty(len(ids), dtype=object)
+        id_array[:] = ids
+        with self._lock:
+            self._set_matrix(matrix)
+            self._ids = id_array
+            self._size = len(ids)
+            self._positions = {doc_id: i for i, doc_id in enumerate(ids)}
+            self._last_id = max(ids, default=None, key=_sort_key)
+            self._last_updated = last_updated
+            self._reset_postings()
+            for position, doc in enumerate(metadata):
+                self._index_metadata(position, doc)
+            self.backend.build(self._matrix)
+        return self
+
+    def load_matrix(self, matrix: np.ndarray, ids):
+        """
+        Replaces the resident matrix with `matrix` (one row per id) without reading MongoDB.
+        A read-only or memory-mapped matrix is used in place until the first change.
+        """
+        id_array = np.empty(len(ids), dtype=object)
+        id_array[:] = ids if isinstance(ids, np.ndarray) else list(ids)
+        with self._lock:
+            self._set_matrix(matrix)
+            self._ids = id_array
+            self._size = len(id_array)
+            self._positions = {doc_id: i for i, doc_id in enumerate(id_array)}
+            self._last_id = max(id_array, default=None, key=_sort_key)
+            self._last_updated = None
+            self._reset_postings()
+            self.backend.build(self._matrix)
+        return self
+
+    def load_snapshot(self, path: str, model: str = None):
+        """
+        Maps an on-disk snapshot (see embedding_snapshot.py) instead of reading embeddings
+        from MongoDB, then catches up on documents inserted, or updated after the snapshot's
+        `last_updated`, since the snapshot was written.
+        The mapped matrix is shared read-only and is copied into memory on the first change;
+        compact storage formats encode it into memory at load.
+        """
+        matrix, ids, header = load_snapshot(path, model=model)
+        self.load_matrix(matrix, ids)
+        self._last_updated = snapshot_last_updated(header)
+        if self.filter_fields:
+            # Snapshots hold only embeddings; read the filter fields in one pass
+            projection = {name: 1 for name in self.filter_fields}
+            for doc in self.collection.find({}, projection):
+                position = self._positions.get(doc["_id"])
+                if position is not None:
+                    self._index_metadata(position, doc)
+        self.refresh()
+        return self
+
+    def _ensure_writable(self):
+        if not self._matrix.flags.writeable:
+            self._matrix = np.array(self._matrix, dtype=self.codec.dtype)
+
+    def upsert(self, doc_id, embedding, metadata: dict = None):
+        vector = np.asarray(embedding, dtype=np.float32)
+        codes, scales = self.codec.encode(vector)
+        with self._lock:
+            if self._matrix.shape[1] == 0:
+                self._dimension = vector.shape[0]
+                self._matrix = np.empty((0, codes.shape[1]), dtype=self.codec.dtype)
+            self._ensure_writable()
+            if doc_id in self._positions:
+                self._write_row(self._positions[doc_id], codes[0], scales)
+                if metadata is not None:
+                    self._index_metadata(self._positions[doc_id], metadata)
+                self.backend.on_upsert(self._positions[doc_id])
+                return
+            if self._size == self._matrix.shape[0]:
+                self._grow(max(16, self._size * 2))
+            self._write_row(self._size, codes[0], scales)
+            self._ids[self._size] = doc_id
+            self._positions[doc_id] = self._size
+            self._index_metadata(self._size, metadata or {})
+            self.backend.on_upsert(self._size)
+            self._size += 1
+            if self._last_id is None or _sort_key(doc_id) > _sort_key(self._last_id):
+                self._last_id = doc_id
+
+    def _write_row(self, position: int, codes: np.ndarray, scales: np.ndarray = None):
+        self._matrix[position] = codes
+        if scales is not None:
+            self._scales[position] = scales[0]
+
+    def remove(self, doc_id) -> bool:
+        with self._lock:
+            position = self._positions.pop(doc_id, None)
+            if position is None:
+                return False
+            # Keep the matrix dense by moving the last row into the freed slot
+            last = self._size - 1
+            if position != last:
+                self._ensure_writable()
+                self._matrix[position] = self._matrix[last]
+                if self._scales.size:
+                    self._scales[position] = self._scales[last]
+                self._ids[position] = self._ids[last]
+                self._positions[self._ids[position]] = position
+                self._move_metadata(last, position)
+                self.backend.on_move(last, position)
+            else:
+                for name in self.filter_fields:
+                    if last in self._values[name]:
+                        self._unindex_field(name, last)
+            self._ids[last] = None
+            self._size -= 1
+            return True
+
+    def _grow(self, capacity: int):
+        matrix = np.empty((capacity, self._matrix.shape[1]), dtype=self.codec.dtype)
+        matrix[:self._size] = self._matrix[:self._size]
+        ids = np.empty(capacity, dtype=object)
+        ids[:self._size] = self._ids[:self._size]
+        self._matrix, self._ids = matrix, ids
+        if self.codec.format == "int8":
+            scales = np.ones(capacity, dtype=np.float32)
+            scales[:self._size] = self._scales[:self._size]
+            self._scales = scales
+
+    def search(self, query_embedding, top_k: int = 5, filters: dict = None) -> list:
+        """
+        Scores the query against the resident matrix with a dot product.
+
+        Returns:
+            list: (document id, score) tuples ordered by descending score.
+        """
+        query = np.asarray(query_embedding, dtype=np.float32).reshape(1, -1)
+        return self.search_many(query, top_k, filters)[0]
+
+    def search_many(self, query_embeddings, top_k: int = 5, filters: dict = None) -> list:
+        """
+        Scores a batch of queries with one matrix-matrix product. With `filters`, only the rows
+        in the matching posting lists are scored, exactly, whatever the backend.
+
+        Returns:
+            list: One list of (document id, score) tuples per query, ordered by descending score.
+        """
+        queries = np.atleast_2d(np.asarray(query_embeddings, dtype=np.float32))
+        with self._lock, timer("score"):
+            candidates = self.filter_positions(filters) if filters else None
+            if self._size == 0 or (candidates is not None and len(candidates) == 0):
+                return [[] for _ in range(len(queries))]
+            shortlist = top_k * self.rescore if self.codec.format != "float32" and self.rescore else top_k
+            if candidates is None and self.codec.format == "float32":
+                positions, scores = self.backend.search(self._matrix[:self._size], queries, top_k)
+            else:
+                rows = self._matrix[:self._size] if candidates is None else self._matrix[candidates]
+                scales = None
+                if self._scales.size:
+                    scales = self._scales[:self._size] if candidates is None else self._scales[candidates]
+                scores = self.codec.score(queries, rows, scales, self._dimension)
+                positions, scores = top_k_rows(scores, shortlist)
+                if candidates is not None:
+                    positions = candidates[positions]
+            ids = self._ids[np.maximum(positions, 0)]
+        if self.codec.format != "float32" and self.rescore:
+            return self._rescore(queries, ids, top_k)
+        # Approximate backends pad with -1 when fewer than top_k candidates were scanned
+        return [[(doc_id, float(score)) for doc_id, position, score in zip(row_ids, row_positions, row_scores)
+                 if position >= 0]
+                for row_ids, row_positions, row_scores in zip(ids, positions, scores)]
+
+    def _rescore(self, queries: np.ndarray, shortlists: np.ndarray, top_k: int) -> list:
+        """
+        Re-ranks each query's shortlist with the vectors stored in `rescore_field`, fetched
+        for every shortlist at once in one round trip.
+        """
+        wanted = list(dict.fromkeys(doc_id for row in shortlists for doc_id in row))
+        fields = [self.rescore_field] if self.rescore_field else [f"{self.field}_full", self.field]
+        projection = {"_id": 1, **{name: 1 for field in fields for name in (field, f"{field}_scale")}}
+        with timer("mongo"):
+            docs = list(self.collection.find({"_id": {"$in": wanted}}, projection))
+        vectors = {}
+        for doc in docs:
+            field = next((field for field in fields if doc.get(field) is not None), None)
+            if field is None:
+                continue
+            if not self.rescore_field and field == self.field and stored_format(doc[field]) not in ("array", "float32"):
+                # Rescoring with the compact codes themselves would not change the ranking
+                raise ValueError(f"No full-precision vectors to rescore with: '{self.field}' is stored as "
+                                 f"{stored_format(doc[field])}; load with --keep_full or set rescore_field")
+            vectors[doc["_id"]] = from_bson(doc, field)
+        results = []
+        for query, row in zip(queries, shortlists):
+            row = [doc_id for doc_id in row if doc_id in vectors]
+            if not row:
+                results.append([])
+                continue
+            exact = np.stack([vectors[doc_id] for doc_id in row]) @ query
+            top, top_scores = top_k_rows(exact[None, :], top_k)
+            results.append([(row[i], float(score)) for i, score in zip(top[0], top_scores[0])])
+        return results
+
+    def hydrate(self, ids: list, projection: dict = None) -> list:
+        """
+        Fetches the given documents in one round trip and returns them in the order of `ids`.
+        """
+        projection = projection or {"_id": 1, "text": 1, "label": 1}
+        with timer("mongo"):
+            by_id = {doc["_id"]: doc for doc in self.collection.find({"_id": {"$in": list(ids)}}, projection)}
+        return [by_id[doc_id] for doc_id in ids if doc_id in by_id]
+
+    # === Incremental refresh ===
+    def refresh(self) -> int:
+        """
+        Polls for documents inserted (`_id` greater than the last seen) or updated
+        (`updated_at` newer than the last seen) since the previous load or refresh, and
+        removes rows whose documents were deleted. Returns the number of rows changed.
+
+        Deletions are looked for only when the collection's (estimated) count differs from the
+        rows resident after applying the changes, so an unchanged collection costs no id scan.
+        A delete followed by an insert still shows: the insert is applied first. Documents stored
+        without an embedding keep the counts apart and make every poll sweep.
+        """
+        clauses = []
+        if self._last_id is not None:
+            clauses.append({"_id": {"$gt": self._last_id}})
+        if self._last_updated is not None:
+            clauses.append({self.updated_field: {"$gt": self._last_updated}})
+        if not clauses:
+            self.load()
+            return self._size
+
+        changed = 0
+        query = clauses[0] if len(clauses) == 1 else {"$or": clauses}
+        for doc in self.collection.find(query, self._projection()):
+            self._apply_document(doc)
+            changed += 1
+        if self.collection.estimated_document_count() != len(self._positions):
+            changed += self._remove_deleted()
+        return changed
+
+    def _remove_deleted(self) -> int:
+        # The range on _id lets the server answer from the _id index alone (a covered query)
+        existing = {doc["_id"] for doc in self.collection.find({"_id": {"$gte": MinKey()}}, {"_id": 1})}
+        with self._lock:
+            deleted = [doc_id for doc_id in self._positions if doc_id not in existing]
+        for doc_id in deleted:
+            self.remove(doc_id)
+        return len(deleted)
+
+    def _apply_document(self, doc: dict):
+        if doc.get(self.field) is None:
+            self.remove(doc["_id"])
+        else:
+            self.upsert(doc["_id"], from_bson(doc, self.field), doc)
+        updated = doc.get(self.updated_field)
+        if updated is not None and (self._last_updated is None or updated > self._last_updated):
+            self._last_updated = updated
+
+    def start(self, mode: str = "watch"):
+        """
+        Starts a background refresh thread.
+
+        Args:
+            mode (str): "watch" follows a change stream and falls back to polling when the
+                server has none; "poll" always polls every `poll_interval` seconds.
+        """
+        if self._thread and self._thread.is_alive():
+            return self
+        self._stop.clear()
+        self.mode = mode
+        target = self._poll_loop if mode == "poll" else self._watch_loop
+        self._thread = threading.Thread(target=target, name="embedding-index-refresh", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout=self.poll_interval + 1)
+            self._thread = None
+
+    def _poll_loop(self):
+        self.mode = "poll"
+        while not self._stop.wait(self.poll_interval):
+            try:
+                self.refresh()
+            except PyMongoError as e:
+                print(f"Embedding index refresh failed: {e}")
+
+    def _watch_loop(self):
+        pipeline = [{"$project": {"operationType": 1, "documentKey": 1,
+                                  "fullDocument._id": 1, f"fullDocument.{self.field}": 1,
+                                  f"fullDocument.{self.field}_scale": 1, f"fullDocument.{self.updated_field}": 1,
+                                  **{f"fullDocument.{name}": 1 for name in self.filter_fields}}}]
+        while not self._stop.is_set():
+            try:
+                with self.collection.watch(pipeline, full_document="updateLookup",
+                                           resume_after=self._resume_token) as stream:
+                    self.mode = "watch"
+                    while stream.alive and not self._stop.is_set():
+                        change = stream.try_next()
+                        if change is None:
+                            self._stop.wait(0.1)
+                            continue
+                        self._resume_token = stream.resume_token
+                        self._apply_change(change)
+                # An invalidated stream closes itself; loop around to open a fresh one
+            except OperationFailure as e:
+                # Standalone servers have no change streams; poll instead
+                print(f"Change streams unavailable ({e}), falling back to polling")
+                return self._poll_loop()
+            except PyMongoError as e:
+                print(f"Embedding index change stream interrupted: {e}")
+                self._stop.wait(self.poll_interval)
+
+    def _apply_change(self, change: dict):
+        operation = change.get("operationType")
+        if operation in ("insert", "update", "replace"):
+            doc = change.get("fullDocument")
+            if doc is None:
+                self.remove(change["documentKey"]["_id"])
+            else:
+                self._apply_document(doc)
+        elif operation == "delete":
+            self.remove(change["documentKey"]["_id"])
+        elif operation in ("drop", "rename", "dropDatabase", "invalidate"):
+            self._resume_token = None
+            self.load()
+
+def _sort_key(value):
+    # BSON compares ints and ObjectIds within their own type; order by type name first
+    return (type(value).__name__, value)
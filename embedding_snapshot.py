@@ -0,0 +1,155 @@
+"""
+embedding_snapshot.py
+@ken.chen
+
+Reads and writes versioned binary snapshots of a collection's embeddings so that search
+processes can memory-map them instead of decoding BSON arrays at startup. Processes that
+map the same snapshot share one page-cache copy.
+
+A snapshot is a directory with three files:
+    header.json       format version, model name, dimension, count, normalization, id format, checksum,
+                      and the `updated_at` high-water mark the snapshot is current up to
+    embeddings.f32    raw little-endian float32 matrix, row-major, count x dimension
+    ids.npy | ids.json   document ids (int64 array, or extended JSON for non-integer ids)
+
+Usage:
+    from embedding_snapshot import write_snapshot, load_snapshot
+    write_snapshot("snapshots/ag_news", matrix, ids, model="all-MiniLM-L6-v2", last_updated=loaded_at)
+    matrix, ids, header = load_snapshot("snapshots/ag_news")   # zero-copy np.memmap
+
+    python embedding_snapshot.py snapshots/ag_news --verify
+"""
+
+import argparse, hashlib, json, os
+import numpy as np
+from bson import json_util
+
+FORMAT_VERSION = 1
+HEADER_FILE = "header.json"
+MATRIX_FILE = "embeddings.f32"
+
+def _checksum(matrix: np.ndarray, id_bytes: bytes) -> str:
+    digest = hashlib.sha256()
+    for start in range(0, len(matrix), 65536):
+        digest.update(np.ascontiguousarray(matrix[start:start + 65536], dtype="<f4").tobytes())
+    digest.update(id_bytes)
+    return digest.hexdigest()
+
+def _id_bytes(ids) -> tuple:
+    if all(isinstance(i, (int, np.integer)) and not isinstance(i, bool) for i in ids):
+        array = np.asarray(ids, dtype="<i8")
+        return "int64", array, array.tobytes()
+    text = json_util.dumps(list(ids))
+    return "extended_json", text, text.encode()
+
+def write_snapshot(path: str, matrix, ids, model: str, normalized: bool = True, source: str = None,
+                   last_updated=None) -> dict:
+    """
+    Writes a snapshot atomically: files are written to a temporary directory that is then
+    renamed over `path`, so readers never map a half-written snapshot. `last_updated` is the
+    newest `updated_at` the snapshot reflects (or when its documents were written); an index
+    loading the snapshot picks up later updates from there.
+
+    Returns:
+        dict: The snapshot header.
+    """
+    matrix = np.ascontiguousarray(matrix, dtype="<f4")
+    if matrix.ndim != 2 or len(matrix) != len(ids):
+        raise ValueError(f"Expected a 2-D matrix with one row per id, got {matrix.shape} for {len(ids)} ids")
+    id_format, id_data, id_bytes = _id_bytes(ids)
+    header = {
+        "format_version": FORMAT_VERSION,
+        "model": model,
+        "dimension": int(matrix.shape[1]),
+        "count": int(matrix.shape[0]),
+        "dtype": "float32",
+        "normalized": normalized,
+        "id_format": id_format,
+        "source": source,
+        "last_updated": json.loads(json_util.dumps(last_updated)) if last_updated is not None else None,
+        "checksum": "sha256:" + _checksum(matrix, id_bytes),
+    }
+
+    tmp = f"{path.rstrip(os.sep)}.tmp-{os.getpid()}"
+    os.makedirs(tmp, exist_ok=True)
+    matrix.tofile(os.path.join(tmp, MATRIX_FILE))
+    if id_format == "int64":
+        np.save(os.path.join(tmp, "ids.npy"), id_data)
+    else:
+        with open(os.path.join(tmp, "ids.json"), "w") as f:
+            f.write(id_data)
+    with open(os.path.join(tmp, HEADER_FILE), "w") as f:
+        json.dump(header, f, indent=2)
+
+    if os.path.isdir(path):
+        old = f"{path.rstrip(os.sep)}.old-{os.getpid()}"
+        os.rename(path, old)
+        os.rename(tmp, path)
+        for name in os.listdir(old):
+            os.remove(os.path.join(old, name))
+        os.rmdir(old)
+    else:
+        os.rename(tmp, path)
+    return header
+
+def read_header(path: str) -> dict:
+    with open(os.path.join(path, HEADER_FILE)) as f:
+        header = json.load(f)
+    if header.get("format_version") != FORMAT_VERSION:
+        raise ValueError(f"Unsupported snapshot format version {header.get('format_version')} in {path}")
+    return header
+
+def snapshot_last_updated(header: dict):
+    """
+    The `updated_at` high-water mark recorded in a snapshot header, or None.
+    """
+    value = header.get("last_updated")
+    return json_util.loads(json.dumps(value)) if value is not None else None
+
+def load_snapshot(path: str, model: str = None, verify: bool = False) -> tuple:
+    """
+    Maps a snapshot read-only without copying it into process memory.
+
+    Args:
+        path (str): Snapshot directory.
+        model (str): If given, the snapshot must have been written with this model.
+        verify (bool): Recompute the content checksum (reads the whole file).
+
+    Returns:
+        tuple: (matrix as np.memmap, ids as np.ndarray, header dict)
+    """
+    header = read_header(path)
+    if model and header["model"] != model:
+        raise ValueError(f"Snapshot {path} was written with model '{header['model']}', expected '{model}'")
+
+    shape = (header["count"], header["dimension"])
+    if header["count"] == 0:
+        matrix = np.empty(shape, dtype="<f4")
+    else:
+        matrix = np.memmap(os.path.join(path, MATRIX_FILE), dtype="<f4", mode="r", shape=shape)
+
+    if header["id_format"] == "int64":
+        ids = np.load(os.path.join(path, "ids.npy"), mmap_mode="r")
+        id_bytes = np.asarray(ids, dtype="<i8").tobytes() if verify else b""
+        ids = np.asarray(ids).astype(object)
+    else:
+        with open(os.path.join(path, "ids.json")) as f:
+            text = f.read()
+        id_bytes = text.encode()
+        ids = np.empty(header["count"], dtype=object)
+        ids[:] = json_util.loads(text)
+
+    if verify and "sha256:" + _checksum(matrix, id_bytes) != header["checksum"]:
+        raise ValueError(f"Snapshot {path} failed checksum verification")
+    return matrix, ids, header
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Inspect and verify an embedding snapshot")
+    parser.add_argument("path", help="Snapshot directory")
+    parser.add_argument("--verify", action="store_true", help="Recompute the content checksum")
+    args = parser.parse_args()
+
+    matrix, ids, header = load_snapshot(args.path, verify=args.verify)
+    print(json.dumps(header, indent=2))
+    if args.verify:
+        print("Checksum OK")
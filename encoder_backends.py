@@ -0,0 +1,222 @@
+"""
+encoder_backends.py
+@ken.chen
+
+CPU inference backends for the sentence-transformers query encoder. The stock backend, "torch",
+is SentenceTransformer.encode. The others cut per-query latency on CPU-only hosts:
+
+    fast    the same float32 weights, encoded through a fast path: one fast-tokenizer call per batch
+            and the model's forward pass under torch.inference_mode, without the length sorting,
+            per-batch bookkeeping and conversions of SentenceTransformer.encode
+    int8    the fast path over a copy whose Linear layers are dynamically quantized to int8
+            (int8 weights, activations quantized per batch)
+    onnx    the fast path over sentence-transformers' ONNX Runtime backend; needs
+            `pip install sentence-transformers[onnx]`
+
+ENCODER_BACKEND selects the backend used for query encoding in both search modules and the
+semantic router. The model registry keeps each backend apart from the stock model, and its
+embeddings apart in the embedding cache, while load_data.py keeps storing reference embeddings
+from the stock model. Before switching, check how closely a backend agrees with the stored
+embeddings and how much faster it is:
+
+    python encoder_backends.py --backend int8 --sample 1000 --min_cosine 0.98
+
+The check encodes sampled headlines, reports the cosine similarity of each to its stored
+embedding (preferring `embedding_full` when present), and times single-query encoding against
+the stock backend. It exits with status 1 when the 1st percentile of the cosines is below
+--min_cosine.
+
+Environment:
+    ENCODER_BACKEND: torch (default), fast, int8 or onnx
+    ENCODER_THREADS: intra-op threads for the optimized backends: the ONNX Runtime session's
+        intra-op threads, or for fast and int8 torch's, set once when the encoder loads. Torch
+        threads are process-wide, so they also apply to the stock model and the cross-encoder
+        (default: library default)
+    ENCODER_INTEROP_THREADS: inter-op threads of the ONNX Runtime session (default: library default)
+    ENCODER_MAX_SEQ_LENGTH: tokens kept per query by the optimized backends (default: the model's limit)
+"""
+
+import argparse, dotenv, os, time, warnings
+import numpy as np
+import torch
+from sentence_transformers import SentenceTransformer
+
+BACKENDS = ("torch", "fast", "int8", "onnx")
+
+def query_backend() -> str:
+    backend = os.getenv("ENCODER_BACKEND", "torch")
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown encoder backend '{backend}', expected one of {BACKENDS}")
+    return backend
+
+def cache_name(model_name: str, backend: str = "torch") -> str:
+    """
+    Embedding cache namespace of a model under a backend, so their embeddings are never mixed.
+    """
+    return model_name if backend == "torch" else f"{model_name}@{backend}"
+
+def encoder_device(backend: str, device: str = None) -> str:
+    """
+    Device `backend` actually runs on: int8 and onnx always run on the CPU.
+    """
+    return "cpu" if backend in ("int8", "onnx") else device
+
+class FastEncoder:
+    """
+    Wraps a SentenceTransformer and encodes straight through its forward pass. Other attributes
+    are those of the wrapped model.
+    """
+    def __init__(self, model: SentenceTransformer, backend: str = "fast", max_seq_length: int = None):
+        self.model = model.eval()
+        self.backend = backend
+        if max_seq_length:
+            model.max_seq_length = max_seq_length
+        self._tokenize = getattr(model, "preprocess", None) or model.tokenize
+
+    def encode(self, texts, batch_size: int = 32, normalize_embeddings: bool = False,
+               show_progress_bar: bool = None, convert_to_numpy: bool = True, **kwargs) -> np.ndarray:
+        """
+        Encodes like SentenceTransformer.encode into a float32 matrix. Raises TypeError for
+        options the fast path does not implement (e.g. convert_to_tensor or precision).
+        """
+        if kwargs or not convert_to_numpy:
+            unsupported = sorted(kwargs) + ([] if convert_to_numpy else ["convert_to_numpy=False"])
+            raise TypeError(f"FastEncoder.encode does not support {unsupported}")
+        texts = [texts] if isinstance(texts, str) else list(texts)
+        chunks = []
+        with torch.inference_mode():
+            for start in range(0, len(texts), batch_size):
+                features = self._tokenize(texts[start:start + batch_size])
+                features = {name: value.to(self.model.device) if torch.is_tensor(value) else value
+                            for name, value in features.items()}
+                chunks.append(self.model(features)["sentence_embedding"].float().cpu().numpy())
+        if not chunks:
+            return np.empty((0, 0), dtype=np.float32)
+        embeddings = np.concatenate(chunks)
+        if normalize_embeddings:
+            embeddings /= np.maximum(np.linalg.norm(embeddings, axis=1, keepdims=True), 1e-12)
+        return embeddings
+
+    def __getattr__(self, name):
+        # Only called for missing attributes; "model" itself is missing before __init__ sets it
+        if name == "model":
+            raise AttributeError(name)
+        return getattr(self.model, name)
+
+def quantize_int8(model: SentenceTransformer) -> SentenceTransformer:
+    """
+    Replaces the Linear layers of a CPU model with dynamically quantized int8 ones, in place.
+    """
+    from torch.ao.quantization import quantize_dynamic
+    with warnings.catch_warnings():
+        # Eager-mode quantization is deprecated in favour of torchao, which this repo does not depend on
+        warnings.simplefilter("ignore")
+        return quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8, inplace=True)
+
+def _load_onnx(name: str) -> SentenceTransformer:
+    try:
+        import onnxruntime
+    except ImportError as e:
+        raise ImportError("The onnx encoder backend needs ONNX Runtime: pip install sentence-transformers[onnx]") from e
+    options = onnxruntime.SessionOptions()
+    if os.getenv("ENCODER_THREADS"):
+        options.intra_op_num_threads = int(os.getenv("ENCODER_THREADS"))
+    if os.getenv("ENCODER_INTEROP_THREADS"):
+        options.inter_op_num_threads = int(os.getenv("ENCODER_INTEROP_THREADS"))
+    return SentenceTransformer(name, device="cpu", backend="onnx",
+                               model_kwargs={"provider": "CPUExecutionProvider", "session_options": options})
+
+def load_encoder(name: str, device: str = None, backend: str = "torch"):
+    """
+    Loads model `name` for `backend`. The torch backend returns the SentenceTransformer itself;
+    the others return a FastEncoder. int8 and onnx always run on the CPU.
+    """
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown encoder backend '{backend}', expected one of {BACKENDS}")
+    if backend == "torch":
+        return SentenceTransformer(name, device=device)
+    if backend == "onnx":
+        # ONNX Runtime threads are set on the session itself
+        model = _load_onnx(name)
+    else:
+        if os.getenv("ENCODER_THREADS"):
+            # Process-wide: torch has no per-model thread setting
+            torch.set_num_threads(int(os.getenv("ENCODER_THREADS")))
+        model = SentenceTransformer(name, device=encoder_device(backend, device))
+        if backend == "int8":
+            quantize_int8(model)
+    max_seq_length = int(os.getenv("ENCODER_MAX_SEQ_LENGTH", "0"))
+    return FastEncoder(model, backend, max_seq_length or None)
+
+# === Validation ===
+def agreement(encoded: np.ndarray, reference: np.ndarray) -> dict:
+    """
+    Cosine similarity of each encoded vector to its reference vector.
+    """
+    encoded = np.asarray(encoded, dtype=np.float32)
+    reference = np.asarray(reference, dtype=np.float32)
+    norms = np.linalg.norm(encoded, axis=1) * np.linalg.norm(reference, axis=1)
+    cosines = np.einsum("ij,ij->i", encoded, reference) / np.maximum(norms, 1e-12)
+    return {"count": int(len(cosines)), "mean_cosine": float(cosines.mean()), "min_cosine": float(cosines.min()),
+            "p01_cosine": float(np.percentile(cosines, 1)), "p50_cosine": float(np.percentile(cosines, 50))}
+
+def encode_latency(encoder, texts: list, warmup: int = 5) -> dict:
+    """
+    Times single-query encoding, as the search path does it.
+    """
+    for text in texts[:warmup]:
+        encoder.encode([text])
+    milliseconds = []
+    for text in texts:
+        start = time.perf_counter()
+        encoder.encode([text])
+        milliseconds.append(1000 * (time.perf_counter() - start))
+    return {"p50_ms": float(np.percentile(milliseconds, 50)), "p99_ms": float(np.percentile(milliseconds, 99)),
+            "mean_ms": float(np.mean(milliseconds))}
+
+def validate(docs: list, backend: str, model_name: str = "all-MiniLM-L6-v2", queries: int = 200) -> dict:
+    """
+    Compares `backend` with the embeddings stored in `docs` (documents with "text" and
+    "embedding_full" or "embedding") and with the stock backend's single-query latency.
+    """
+    from quantization import from_bson, stored_format
+    if not docs:
+        raise ValueError("No documents to compare with; is the collection loaded?")
+    field = "embedding_full" if "embedding_full" in docs[0] else "embedding"
+    if stored_format(docs[0][field]) == "binary":
+        raise ValueError("Binary embeddings cannot be compared by cosine; load with --keep_full")
+    texts = [doc["text"] for doc in docs]
+    reference = np.stack([from_bson(doc, field) for doc in docs])
+    encoder = load_encoder(model_name, "cpu", backend)
+    report = {"backend": backend, "model": model_name, "field": field, "threads": torch.get_num_threads(),
+              **agreement(encoder.encode(texts, batch_size=32), reference)}
+    stock = load_encoder(model_name, "cpu", "torch")
+    report["latency"] = {"torch": encode_latency(stock, texts[:queries]), backend: encode_latency(encoder, texts[:queries])}
+    report["speedup"] = report["latency"]["torch"]["p50_ms"] / report["latency"][backend]["p50_ms"]
+    return report
+
+if __name__ == "__main__":
+    import json
+    from mongo_pool import get_client
+    dotenv.load_dotenv()
+
+    parser = argparse.ArgumentParser(description="Check an encoder backend against the stored embeddings")
+    parser.add_argument("--backend", choices=BACKENDS, default="int8", help="Encoder backend to check")
+    parser.add_argument("--mongo_url", help="MongoDB connection URI (optional, defaults to env MONGO_URL or localhost)")
+    parser.add_argument("--namespace", default="testdb.ag_news", help="database.collection with stored embeddings")
+    parser.add_argument("--model", default="all-MiniLM-L6-v2", help="Model the embeddings were stored with")
+    parser.add_argument("--sample", type=int, default=1000, help="Documents to compare")
+    parser.add_argument("--queries", type=int, default=200, help="Single-query encodes to time per backend")
+    parser.add_argument("--min_cosine", type=float, default=0.98, help="Lowest 1st-percentile cosine accepted")
+    args = parser.parse_args()
+
+    mongo_url = args.mongo_url or os.getenv("MONGO_URL", "mongodb://localhost:27017/")
+    database, collection = args.namespace.split(".", 1)
+    docs = list(get_client(mongo_url)[database][collection].aggregate([
+        {"$sample": {"size": args.sample}}, {"$project": {"text": 1, "embedding": 1, "embedding_full": 1}}]))
+    report = validate(docs, args.backend, args.model, args.queries)
+    print(json.dumps(report, indent=2))
+    if report["p01_cosine"] < args.min_cosine:
+        print(f"FAIL: 1st percentile cosine {report['p01_cosine']:.4f} is below {args.min_cosine}")
+        raise SystemExit(1)
+    print(f"OK: {args.backend} agrees with the stored embeddings and encodes {report['speedup']:.2f}x as fast")
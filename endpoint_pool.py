@@ -0,0 +1,242 @@
+"""
+endpoint_pool.py
+@ken.chen
+
+Pool of OpenAI/Azure OpenAI endpoints (deployments) behind one OpenAIClient, for traffic that
+exceeds a single deployment's quota. Each endpoint has a weight, its own RateLimitScheduler
+(rate_limiter.py) and a circuit breaker. Requests go to the healthy endpoint with the fewest
+outstanding requests, or the lowest recent latency, relative to its weight. When an endpoint fails
+with a retryable error after its own retries, the request fails over to the next endpoint.
+
+Usage:
+    pool = EndpointPool([Endpoint("east", "gpt-4o", east_client), Endpoint("west", "gpt-4o", west_client, weight=2)])
+    response = pool.call(lambda endpoint: endpoint.client.chat.completions.create(model=endpoint.model, ...), tokens)
+    for chunk in pool.stream(lambda endpoint: endpoint.client.chat.completions.create(stream=True, ...), tokens):
+        ...
+    print(pool.stats())
+
+Environment:
+    OPENAI_ROUTING: "least_outstanding" (default) or "latency"
+    OPENAI_CIRCUIT_FAILURES: consecutive failures that open an endpoint's circuit (default: 5)
+    OPENAI_CIRCUIT_COOLDOWN: seconds an open circuit rejects requests before a trial request (default: 30)
+"""
+
+import random, threading, time
+from collections import deque
+from rate_limiter import RateLimitScheduler, is_retryable
+
+STRATEGIES = ("least_outstanding", "latency")
+
+class Endpoint:
+    def __init__(self, name: str, model: str, client, async_client_factory=None, weight: float = 1.0,
+                 scheduler: RateLimitScheduler = None, failure_threshold: int = 5, cooldown: float = 30.0,
+                 kind: str = "openai"):
+        """
+        Args:
+            name (str): Label used in stats and errors.
+            model (str): Model name, or the deployment name for Azure OpenAI.
+            client: Synchronous OpenAI/AzureOpenAI client.
+            async_client_factory: Callable building the asyncio client on first use.
+            weight (float): Relative share of traffic.
+            scheduler (RateLimitScheduler): Quota and retry policy for this deployment.
+            failure_threshold (int): Consecutive failures that open the circuit.
+            cooldown (float): Seconds the open circuit rejects requests before one trial request.
+            kind (str): "openai" or "azure".
+        """
+        self.name = name
+        self.model = model
+        self.client = client
+        self.kind = kind
+        self.weight = weight
+        self.scheduler = scheduler or RateLimitScheduler()
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self._async_client_factory = async_client_factory
+        self._async_client = None
+        self.outstanding = 0
+        self.requests = 0
+        self.errors = 0
+        self.consecutive_failures = 0
+        self.latency_ewma = None
+        self.latencies = deque(maxlen=200)
+        self.state = "closed"
+        self._opened_until = 0.0
+        self._lock = threading.Lock()
+
+    @property
+    def async_client(self):
+        if self._async_client is None:
+            self._async_client = self._async_client_factory()
+        return self._async_client
+
+    def available(self) -> bool:
+        """
+        True when the circuit lets a request through: closed, or open past its cooldown with
+        no trial request already in flight (half-open).
+        """
+        with self._lock:
+            if self.state == "closed":
+                return True
+            if self.state == "open" and time.monotonic() >= self._opened_until:
+                return self.outstanding == 0
+            return False
+
+    def start(self):
+        with self._lock:
+            self.outstanding += 1
+            self.requests += 1
+            if self.state == "open" and time.monotonic() >= self._opened_until:
+                self.state = "half_open"
+
+    def finish(self, seconds: float, failed: bool):
+        with self._lock:
+            self.outstanding -= 1
+            self.latencies.append(seconds)
+            if failed:
+                self.errors += 1
+                self.consecutive_failures += 1
+                if self.state == "half_open" or self.consecutive_failures >= self.failure_threshold:
+                    self.state = "open"
+                    self._opened_until = time.monotonic() + self.cooldown
+            else:
+                self.consecutive_failures = 0
+                self.state = "closed"
+                self.latency_ewma = seconds if self.latency_ewma is None else 0.8 * self.latency_ewma + 0.2 * seconds
+
+    def score(self, strategy: str) -> float:
+        if strategy == "latency":
+            # Endpoints without a measurement yet are tried first
+            return (self.latency_ewma or 0.0) * (self.outstanding + 1) / self.weight
+        return (self.outstanding + 1) / self.weight
+
+    def stats(self) -> dict:
+        with self._lock:
+            ordered = sorted(self.latencies)
+            def percentile(fraction):
+                return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))] * 1000 if ordered else 0.0
+            return {
+                "kind": self.kind,
+                "model": self.model,
+                "weight": self.weight,
+                "state": self.state,
+                "outstanding": self.outstanding,
+                "requests": self.requests,
+                "errors": self.errors,
+                "error_rate": self.errors / self.requests if self.requests else 0.0,
+                "latency_ewma_ms": (self.latency_ewma or 0.0) * 1000,
+                "p50_ms": percentile(0.50),
+                "p95_ms": percentile(0.95),
+                "scheduler": self.scheduler.stats(),
+            }
+
+class EndpointPool:
+    def __init__(self, endpoints: list, strategy: str = "least_outstanding"):
+        if not endpoints:
+            raise ValueError("EndpointPool needs at least one endpoint")
+        if strategy not in STRATEGIES:
+            raise ValueError(f"Unknown routing strategy '{strategy}', expected one of {STRATEGIES}")
+        self.endpoints = endpoints
+        self.strategy = strategy
+        self._lock = threading.Lock()
+
+    def acquire(self, exclude=()):
+        """
+        Picks the best available endpoint not in `exclude` and marks a request outstanding on it.
+        Ties are broken at random in proportion to weight. Returns None when none is available.
+        """
+        with self._lock:
+            candidates = [endpoint for endpoint in self.endpoints if endpoint not in exclude and endpoint.available()]
+            if not candidates:
+                return None
+            scores = [endpoint.score(self.strategy) for endpoint in candidates]
+            best = min(scores)
+            tied = [endpoint for endpoint, score in zip(candidates, scores) if score == best]
+            endpoint = random.choices(tied, weights=[e.weight for e in tied])[0]
+            endpoint.start()
+            return endpoint
+
+    def call(self, fn, tokens: int):
+        """
+        Runs `fn(endpoint)` on the chosen endpoint through its scheduler, failing over to the
+        next endpoint on retryable errors. Only retryable errors (429, 5xx, timeouts, connection
+        errors) count against the endpoint's error rate and circuit; non-retryable ones (e.g. a 400
+        for an oversized prompt) are recorded as completed requests, since the endpoint answered,
+        and raised at once.
+        """
+        tried, error = [], None
+        while True:
+            endpoint = self.acquire(tried)
+            if endpoint is None:
+                raise error or RuntimeError("No healthy endpoint available")
+            tried.append(endpoint)
+            start = time.perf_counter()
+            try:
+                result = endpoint.scheduler.call(lambda: fn(endpoint), tokens)
+            except Exception as e:
+                endpoint.finish(time.perf_counter() - start, failed=is_retryable(e))
+                if not is_retryable(e):
+                    raise
+                error = e
+                continue
+            endpoint.finish(time.perf_counter() - start, failed=False)
+            return result
+
+    async def call_async(self, fn, tokens: int):
+        """
+        Same as `call`, for a `fn(endpoint)` returning an awaitable.
+        """
+        tried, error = [], None
+        while True:
+            endpoint = self.acquire(tried)
+            if endpoint is None:
+                raise error or RuntimeError("No healthy endpoint available")
+            tried.append(endpoint)
+            start = time.perf_counter()
+            try:
+                result = await endpoint.scheduler.call_async(lambda: fn(endpoint), tokens)
+            except Exception as e:
+                endpoint.finish(time.perf_counter() - start, failed=is_retryable(e))
+                if not is_retryable(e):
+                    raise
+                error = e
+                continue
+            endpoint.finish(time.perf_counter() - start, failed=False)
+            return result
+
+    def stream(self, fn, tokens: int):
+        """
+        Same as `call`, for a `fn(endpoint)` opening a stream of chunks. Failover happens only
+        before the first chunk; the request stays outstanding on its endpoint, and its latency
+        runs, until the stream is exhausted or closed.
+        """
+        tried, error = [], None
+        while True:
+            endpoint = self.acquire(tried)
+            if endpoint is None:
+                raise error or RuntimeError("No healthy endpoint available")
+            tried.append(endpoint)
+            start = time.perf_counter()
+            chunks = endpoint.scheduler.stream(lambda: fn(endpoint), tokens)
+            try:
+                first = next(chunks, None)
+            except Exception as e:
+                endpoint.finish(time.perf_counter() - start, failed=is_retryable(e))
+                if not is_retryable(e):
+                    raise
+                error = e
+                continue
+            break
+        failed = False
+        try:
+            if first is not None:
+                yield first
+                yield from chunks
+        except Exception as e:
+            failed = is_retryable(e)
+            raise
+        finally:
+            chunks.close()
+            endpoint.finish(time.perf_counter() - start, failed=failed)
+
+    def stats(self) -> dict:
+        return {endpoint.name: endpoint.stats() for endpoint in self.endpoints}
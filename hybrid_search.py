@@ -0,0 +1,113 @@
+"""
+hybrid_search.py
+@ken.chen
+
+Hybrid retrieval: fuses a full-text ranking with the vector ranking using reciprocal rank
+fusion (RRF), score(d) = sum over rankings of 1 / (k + rank(d)). RRF needs only ranks, so the
+text score (MongoDB $text, or BM25 from Atlas Search) and the vector score never have to be
+put on the same scale.
+
+    local   MongoDB $text query; needs a text index on "text", which load_data.py creates (or run
+            `python hybrid_search.py --namespace db.collection` once for a collection loaded earlier)
+    atlas   Atlas Search $search text operator (BM25) on the ATLAS_TEXT_INDEX search index
+
+Metadata filters use the MQL shape of the $vectorSearch `filter`, {"label": 1} or
+{"label": {"$in": [1, 2]}}, and are translated to Atlas Search `equals`/`in` clauses.
+
+Usage:
+    fused = reciprocal_rank_fusion([vector_ids, text_search(collection, "Atlanta Braves", 20)], limit=5)
+
+    python hybrid_search.py --mongo_url <MONGODB_URI> --namespace testdb.ag_news   # create the text index
+
+Environment:
+    ATLAS_TEXT_INDEX: Atlas Search index on "text" used in hybrid mode (default: text_index)
+"""
+
+import argparse, dotenv, os
+from pymongo import TEXT
+from pymongo.errors import OperationFailure
+from metrics import timer
+
+RRF_K = 60
+
+def reciprocal_rank_fusion(rankings: list, k: int = RRF_K, limit: int = None) -> list:
+    """
+    Fuses ranked lists of document ids.
+
+    Returns:
+        list: (document id, fused score) tuples ordered by descending score.
+    """
+    scores = {}
+    for ranking in rankings:
+        for rank, doc_id in enumerate(ranking, start=1):
+            scores[doc_id] = scores.get(doc_id, 0.0) + 1.0 / (k + rank)
+    fused = sorted(scores.items(), key=lambda item: -item[1])
+    return fused[:limit] if limit else fused
+
+def create_text_index(collection, path: str = "text") -> str:
+    """
+    Creates the text index $text needs. Run at load or setup time: searches never create it,
+    so they work with read-only users.
+    """
+    return collection.create_index([(path, TEXT)])
+
+def text_search(collection, query: str, limit: int, filters: dict = None) -> list:
+    """
+    Ranks documents by MongoDB text score, restricted by `filters`.
+
+    Returns:
+        list: Document ids, best match first.
+    """
+    cursor = collection.find({"$text": {"$search": query}, **(filters or {})},
+                             {"_id": 1, "score": {"$meta": "textScore"}})
+    try:
+        with timer("mongo"):
+            return [doc["_id"] for doc in cursor.sort([("score", {"$meta": "textScore"})]).limit(limit)]
+    except OperationFailure as e:
+        if e.code != 27:   # IndexNotFound
+            raise
+        raise RuntimeError(f"No text index on {collection.full_name}; create it with "
+                           f"`python hybrid_search.py --namespace {collection.full_name}`") from e
+
+def atlas_filter_clauses(filters: dict) -> list:
+    """
+    Translates {field: value} and {field: {"$eq"|"$in": ...}} filters into Atlas Search clauses.
+    """
+    clauses = []
+    for name, condition in (filters or {}).items():
+        if isinstance(condition, dict) and "$in" in condition:
+            clauses.append({"in": {"path": name, "value": list(condition["$in"])}})
+        else:
+            value = condition["$eq"] if isinstance(condition, dict) else condition
+            clauses.append({"equals": {"path": name, "value": value}})
+    return clauses
+
+def atlas_text_search(collection, query: str, limit: int, filters: dict = None, index: str = None,
+                      path: str = "text") -> list:
+    """
+    Ranks documents by Atlas Search BM25 score, restricted by `filters`.
+
+    Returns:
+        list: Document ids, best match first.
+    """
+    search = {"index": index or os.getenv("ATLAS_TEXT_INDEX", "text_index"),
+              "compound": {"must": [{"text": {"query": query, "path": path}}]}}
+    clauses = atlas_filter_clauses(filters)
+    if clauses:
+        search["compound"]["filter"] = clauses
+    with timer("mongo"):
+        return [doc["_id"] for doc in collection.aggregate([{"$search": search}, {"$limit": limit}, {"$project": {"_id": 1}}])]
+
+if __name__ == "__main__":
+    from mongo_pool import get_client
+    dotenv.load_dotenv()
+
+    parser = argparse.ArgumentParser(description="Create the text index local hybrid search needs")
+    parser.add_argument("--mongo_url", help="MongoDB connection URI (optional, defaults to env MONGO_URL or localhost)")
+    parser.add_argument("--namespace", default="testdb.ag_news", help="database.collection to index")
+    args = parser.parse_args()
+
+    mongo_url = args.mongo_url or os.getenv("MONGO_URL", "mongodb://localhost:27017/")
+    database, collection = args.namespace.split(".", 1)
+    name = create_text_index(get_client(mongo_url)[database][collection])
+    print(f"Text index '{name}' is ready on '{args.namespace}'")
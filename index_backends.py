@@ -0,0 +1,317 @@
+"""
+index_backends.py
+@ken.chen
+
+Pluggable search backends for the resident embedding index. Backends score rows of the
+index's float32 matrix by position and return the top-k positions per query.
+
+    exact   brute-force dot product over every row (the original local search)
+    ivf     IVF-flat: spherical k-means partitions the corpus into `nlist` lists and each query
+            scans only the `nprobe` closest lists; raise `nprobe` (or `num_candidates`, sized like
+            Atlas `numCandidates`) to trade latency for recall. Rows changed since the last
+            build are scanned exactly; once they exceed `rebuild_fraction` of the corpus the
+            lists are retrained in a background thread while searches keep using the old ones.
+
+Usage:
+    from index_backends import create_backend
+    index = EmbeddingIndex(collection, backend=create_backend("ivf", nprobe=8)).load()
+
+    # recall@k of the IVF backend against the exact scan on the stored corpus
+    python index_backends.py --mongo_url <MONGODB_URI> --nprobe 4 8 16 --k 5 10
+    python index_backends.py --num_candidates 200 400 800
+"""
+
+import argparse, dotenv, math, os, threading, time
+from abc import ABC, abstractmethod
+import numpy as np
+
+def top_k_rows(scores: np.ndarray, k: int):
+    """
+    Returns (positions, scores) of the k highest scores per row, ordered by descending score.
+    """
+    k = min(k, scores.shape[1])
+    if k == 0:
+        empty = np.empty((scores.shape[0], 0))
+        return empty.astype(np.int64), empty.astype(np.float32)
+    top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    top_scores = np.take_along_axis(scores, top, axis=1)
+    order = np.argsort(-top_scores, axis=1, kind="stable")
+    return np.take_along_axis(top, order, axis=1), np.take_along_axis(top_scores, order, axis=1)
+
+class IndexBackend(ABC):
+    """
+    Base class for index backends. `build` is called after a full load; the `on_*` hooks
+    are called as the index mutates rows in place so backends can track changes.
+    """
+    name = "base"
+
+    def build(self, matrix: np.ndarray):
+        pass
+
+    def on_upsert(self, position: int):
+        pass
+
+    def on_move(self, source: int, target: int):
+        pass
+
+    @abstractmethod
+    def search(self, matrix: np.ndarray, queries: np.ndarray, top_k: int):
+        """
+        Returns (positions, scores) of the top_k rows of `matrix` per query, padded with -1
+        positions when fewer rows were scanned.
+        """
+
+class ExactBackend(IndexBackend):
+    name = "exact"
+
+    def search(self, matrix: np.ndarray, queries: np.ndarray, top_k: int):
+        scores = queries @ matrix.T  # Shape: (Q, N)
+        return top_k_rows(scores, top_k)
+
+class IVFFlatBackend(IndexBackend):
+    name = "ivf"
+
+    def __init__(self, nlist: int = None, nprobe: int = 8, num_candidates: int = None,
+                 train_size: int = 50000, iterations: int = 10, rebuild_fraction: float = 0.1, seed: int = 42):
+        """
+        Args:
+            nlist (int): Number of inverted lists (default: 4 * sqrt(N)).
+            nprobe (int): Number of lists scanned per query.
+            num_candidates (int): If set, overrides nprobe with enough lists to cover roughly
+                this many candidates, mirroring Atlas `numCandidates`.
+            train_size (int): Rows sampled to train the centroids.
+            iterations (int): k-means iterations.
+            rebuild_fraction (float): Retrain in the background once this fraction of rows changed
+                since the last build.
+        """
+        self.nlist = nlist
+        self.nprobe = nprobe
+        self.num_candidates = num_candidates
+        self.train_size = train_size
+        self.iterations = iterations
+        self.rebuild_fraction = rebuild_fraction
+        self.seed = seed
+        self.centroids = None
+        self._offsets = None
+        self._positions = None
+        self._assignment = np.empty(0, dtype=np.int32)
+        self._pending = set()
+        self._built_size = 0
+        self._touched = None   # rows changed while a rebuild trains, or None
+        self._rebuild = None   # background rebuild thread
+        self._lock = threading.Lock()
+        self.builds = 0
+
+    def build(self, matrix: np.ndarray):
+        """
+        Trains the lists on `matrix` in the calling thread, after a background rebuild in
+        progress (which would otherwise install older lists afterwards) has finished.
+        """
+        self.wait()
+        with self._lock:
+            self._touched = set()
+        self._install(len(matrix), self._train(matrix))
+
+    def _train(self, matrix: np.ndarray):
+        n = matrix.shape[0]
+        if n == 0:
+            return None
+        nlist = min(self.nlist or max(1, int(4 * math.sqrt(n))), n)
+        rng = np.random.default_rng(self.seed)
+        sample = np.asarray(matrix[np.sort(rng.choice(n, size=min(n, max(self.train_size, nlist)), replace=False))])
+        centroids = sample[rng.choice(len(sample), size=nlist, replace=False)].copy()
+        for _ in range(self.iterations):
+            assignment = np.argmax(sample @ centroids.T, axis=1)
+            order = np.argsort(assignment, kind="stable")
+            filled, starts = np.unique(assignment[order], return_index=True)
+            # Lists that received no rows keep their previous centroid
+            centroids[filled] = np.add.reduceat(sample[order], starts, axis=0)
+            norms = np.linalg.norm(centroids, axis=1, keepdims=True)
+            centroids = centroids / np.maximum(norms, 1e-12)
+        centroids = centroids.astype(np.float32)
+
+        assignment = _assign(matrix, centroids)
+        counts = np.bincount(assignment, minlength=nlist)
+        offsets = np.concatenate([[0], np.cumsum(counts)])
+        positions = np.argsort(assignment, kind="stable").astype(np.int64)
+        full = np.full(max(n, 16), -1, dtype=np.int32)
+        full[:n] = assignment
+        return centroids, offsets, positions, full
+
+    def _install(self, size: int, trained):
+        with self._lock:
+            # Rows changed while training are scanned exactly until the next build
+            touched, self._touched = self._touched or set(), None
+            self._pending = {position for position in self._pending if position in touched}
+            self._built_size = size
+            if trained is None:
+                self.centroids = None
+                return
+            self.centroids, self._offsets, self._positions, assignment = trained
+            for position in touched:
+                if position < len(assignment):
+                    assignment[position] = -1
+            self._assignment = assignment
+            self.builds += 1
+
+    def _start_rebuild(self, matrix: np.ndarray):
+        with self._lock:
+            if self._rebuild is not None:
+                return
+            self._touched = set()
+            self._rebuild = threading.Thread(target=self._run_rebuild, args=(matrix,), name="ivf-rebuild", daemon=True)
+            self._rebuild.start()
+
+    def _run_rebuild(self, matrix: np.ndarray):
+        # `matrix` is the view searched when the rebuild started; rows written since are in
+        # `_touched`, and a grown matrix leaves this view on the old buffer
+        try:
+            self._install(len(matrix), self._train(matrix))
+        except Exception as e:
+            print(f"IVF rebuild failed: {e}")
+            with self._lock:
+                self._touched = None
+        finally:
+            with self._lock:
+                self._rebuild = None
+
+    def wait(self, timeout: float = None):
+        """
+        Waits for a background rebuild in progress to finish.
+        """
+        thread = self._rebuild
+        if thread is not None:
+            thread.join(timeout)
+
+    def on_upsert(self, position: int):
+        # Changed rows are scored exactly until the next rebuild
+        with self._lock:
+            if position < len(self._assignment):
+                self._assignment[position] = -1
+            self._pending.add(position)
+            if self._touched is not None:
+                self._touched.add(position)
+
+    def on_move(self, source: int, target: int):
+        self.on_upsert(target)
+        with self._lock:
+            self._pending.discard(source)
+            if source < len(self._assignment):
+                self._assignment[source] = -1
+            if self._touched is not None:
+                self._touched.add(source)
+
+    def lists_to_probe(self) -> int:
+        if self.centroids is None:
+            return 0
+        nlist = len(self.centroids)
+        if self.num_candidates:
+            average = max(1.0, self._built_size / nlist)
+            return min(nlist, max(1, math.ceil(self.num_candidates / average)))
+        return min(nlist, self.nprobe)
+
+    def search(self, matrix: np.ndarray, queries: np.ndarray, top_k: int):
+        size = matrix.shape[0]
+        with self._lock:
+            stale = len(self._pending) > self.rebuild_fraction * max(self._built_size, 1)
+            centroids, offsets, list_positions, assignment = self.centroids, self._offsets, self._positions, self._assignment
+            pending = np.fromiter((p for p in self._pending if p < size), dtype=np.int64)
+            nprobe = self.lists_to_probe()
+        if stale and size:
+            self._start_rebuild(matrix)
+        if centroids is None:
+            # Nothing trained yet: scan every row until the first build is installed
+            return ExactBackend().search(matrix, queries, top_k)
+
+        probes = top_k_rows(queries @ centroids.T, nprobe)[0]
+        positions = np.full((len(queries), top_k), -1, dtype=np.int64)
+        scores = np.full((len(queries), top_k), -np.inf, dtype=np.float32)
+        for q, lists in enumerate(probes):
+            candidates = np.concatenate([list_positions[offsets[l]:offsets[l + 1]] for l in lists])
+            # Drop rows that were removed or moved since the build, then add rows changed since
+            candidates = candidates[candidates < size]
+            candidates = candidates[np.isin(assignment[candidates], lists)]
+            candidates = np.concatenate([candidates, pending])
+            if len(candidates) == 0:
+                continue
+            top, top_scores = top_k_rows((matrix[candidates] @ queries[q])[None, :], top_k)
+            positions[q, :top.shape[1]] = candidates[top[0]]
+            scores[q, :top.shape[1]] = top_scores[0]
+        return positions, scores
+
+def _assign(rows: np.ndarray, centroids: np.ndarray) -> np.ndarray:
+    assignment = np.empty(len(rows), dtype=np.int32)
+    for start in range(0, len(rows), 65536):
+        chunk = rows[start:start + 65536]
+        assignment[start:start + len(chunk)] = np.argmax(chunk @ centroids.T, axis=1)
+    return assignment
+
+BACKENDS = {
+    ExactBackend.name: ExactBackend,
+    IVFFlatBackend.name: IVFFlatBackend,
+}
+
+def create_backend(name: str = "exact", **kwargs) -> IndexBackend:
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown index backend '{name}', expected one of {sorted(BACKENDS)}")
+    return BACKENDS[name](**kwargs)
+
+def recall_at_k(exact_positions: np.ndarray, approx_positions: np.ndarray, k: int) -> float:
+    """
+    Fraction of the exact top-k that the approximate search also returned in its top-k.
+    """
+    hits = 0
+    for exact, approx in zip(exact_positions[:, :k], approx_positions[:, :k]):
+        hits += len(set(exact.tolist()) & set(approx.tolist()))
+    return hits / max(1, exact_positions[:, :k].size)
+
+def recall_report(matrix: np.ndarray, queries: np.ndarray, backend: IndexBackend, ks=(1, 5, 10)) -> dict:
+    """
+    Compares a backend against the exact scan on the same matrix and queries.
+    """
+    max_k = max(ks)
+    start = time.perf_counter()
+    exact_positions, _ = ExactBackend().search(matrix, queries, max_k)
+    exact_seconds = time.perf_counter() - start
+
+    backend.build(matrix)
+    start = time.perf_counter()
+    approx_positions, _ = backend.search(matrix, queries, max_k)
+    approx_seconds = time.perf_counter() - start
+
+    report = {
+        "backend": backend.name,
+        "corpus": int(matrix.shape[0]),
+        "queries": int(len(queries)),
+        "exact_ms_per_query": 1000 * exact_seconds / max(1, len(queries)),
+        "backend_ms_per_query": 1000 * approx_seconds / max(1, len(queries)),
+    }
+    for k in ks:
+        report[f"recall@{k}"] = recall_at_k(exact_positions, approx_positions, k)
+    return report
+
+if __name__ == "__main__":
+    dotenv.load_dotenv()
+    parser = argparse.ArgumentParser(description="Report recall@k of the IVF backend against the exact scan")
+    parser.add_argument("--mongo_url", help="MongoDB connection URI (optional, defaults to env MONGO_URL or localhost)")
+    parser.add_argument("--nlist", type=int, help="Number of IVF lists (default: 4 * sqrt(N))")
+    parser.add_argument("--nprobe", type=int, nargs="+", default=[1, 4, 8, 16], help="nprobe values to report")
+    parser.add_argument("--num_candidates", type=int, nargs="+", help="numCandidates values to report instead of nprobe")
+    parser.add_argument("--k", type=int, nargs="+", default=[1, 5, 10], help="k values for recall@k")
+    parser.add_argument("--queries", type=int, default=200, help="Number of corpus rows used as queries")
+    args = parser.parse_args()
+
+    from mongo_pool import get_client
+    from embedding_index import EmbeddingIndex
+    mongo_url = args.mongo_url or os.getenv("MONGO_URL", "mongodb://localhost:27017/")
+    matrix = EmbeddingIndex(get_client(mongo_url)["testdb"]["ag_news"]).load().embeddings
+    rng = np.random.default_rng(0)
+    queries = matrix[rng.choice(len(matrix), size=min(args.queries, len(matrix)), replace=False)]
+
+    settings = [{"num_candidates": value} for value in args.num_candidates or []] or [{"nprobe": value} for value in args.nprobe]
+    for setting in settings:
+        report = recall_report(matrix, queries, IVFFlatBackend(nlist=args.nlist, **setting), args.k)
+        recalls = ", ".join(f"recall@{k}={report[f'recall@{k}']:.3f}" for k in args.k)
+        name, value = next(iter(setting.items()))
+        print(f"{name}={value}: {recalls} ({report['backend_ms_per_query']:.3f} ms/query "
+              f"vs exact {report['exact_ms_per_query']:.3f} ms/query)")
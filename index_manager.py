@@ -0,0 +1,266 @@
+"""
+index_manager.py
+@ken.chen
+
+Serves many corpora from one process: keeps one resident EmbeddingIndex per namespace
+(MongoDB URL, database, collection, model), loaded lazily on its first query. Once the indexes
+together hold more than the memory budget, the least recently queried ones are stopped and
+dropped until the total fits again; an evicted index simply reloads on its next query. A forked
+worker starts with no indexes, together with mongo_pool discarding the parent's clients.
+
+Requests are routed to a namespace by tenant. TENANTS maps tenant ids to namespaces; the
+tenant comes from the X-Tenant-ID header (or "tenant" in the request body) and the user from
+X-User-ID (or "user_id"). The namespace of the current request is carried in a context
+variable, so tool functions running on worker threads search the right index.
+
+A tenant whose namespace names an "api_key_env" (or "api_key") only serves requests that present
+that key as "Authorization: Bearer <key>" or "X-API-Key"; others get a 401. Tenants without a key
+trust the X-Tenant-ID header, so any caller can read their corpus: serve those only behind a
+proxy that authenticates callers and sets the header itself.
+
+Usage:
+    from index_manager import IndexManager, tenant_namespace, use_namespace
+    manager = IndexManager(load_index)         # see sbert_vector_search.load_index
+    namespace = tenant_namespace("acme")      # {"database": "acme", "collection": "articles", ...}
+    index = manager.get(namespace)
+    with use_namespace(namespace):
+        ...                                    # current_namespace() is "acme"'s namespace here
+
+Environment:
+    INDEX_MEMORY_BUDGET_MB: combined size of the resident indexes before LRU eviction (default: 2048, 0 disables)
+    TENANTS: JSON object mapping tenant ids to namespaces, e.g.
+        {"news": {"database": "testdb", "collection": "ag_news"},
+         "acme": {"database": "acme", "collection": "articles", "model": "all-MiniLM-L6-v2",
+                  "mongo_url": "mongodb://acme-host:27017/", "snapshot": "snapshots/acme", "filter_fields": ["label"],
+                  "api_key_env": "ACME_API_KEY"}}
+        Parsed once; servers read it at startup and refuse to start when it is malformed.
+    DEFAULT_TENANT: tenant of requests that name none (default: "default", the testdb.ag_news corpus)
+"""
+
+import contextvars, hmac, json, os, re, threading, time, weakref
+from collections import OrderedDict
+from contextlib import contextmanager
+import numpy as np
+from embedding_index import EmbeddingIndex
+from model_registry import DEFAULT_MODEL
+from mongo_pool import after_fork
+
+DEFAULT_NAMESPACE = {"database": "testdb", "collection": "ag_news", "model": DEFAULT_MODEL}
+
+_namespace = contextvars.ContextVar("namespace", default=None)
+_managers = weakref.WeakSet()
+_tenants = (None, None)   # (TENANTS value, parsed tenants)
+
+def namespace_key(namespace: dict = None) -> tuple:
+    """
+    The identity of a resident index: (MongoDB URL, database, collection, model).
+    """
+    namespace = {**DEFAULT_NAMESPACE, **(namespace or {})}
+    mongo_url = namespace.get("mongo_url") or os.getenv("MONGO_URL", "mongodb://localhost:27017/")
+    return mongo_url, namespace["database"], namespace["collection"], namespace["model"]
+
+def resident_bytes(index: EmbeddingIndex) -> int:
+    """
+    Memory held by an index: its matrix or codes, the backend's arrays and the id array.
+    """
+    backend = sum(value.nbytes for value in vars(index.backend).values() if isinstance(value, np.ndarray))
+    return int(index.nbytes + backend + 8 * len(index))
+
+class IndexManager:
+    def __init__(self, loader, memory_budget: int = None):
+        """
+        Args:
+            loader: Callable building a loaded EmbeddingIndex from a namespace dict.
+            memory_budget (int): Bytes the resident indexes may hold together (default:
+                INDEX_MEMORY_BUDGET_MB); 0 disables eviction.
+        """
+        if memory_budget is None:
+            memory_budget = int(float(os.getenv("INDEX_MEMORY_BUDGET_MB", "2048")) * 1024 * 1024)
+        self.memory_budget = memory_budget
+        self.loader = loader
+        self._indexes = OrderedDict()   # key -> entry dict, least recently queried first
+        self._lock = threading.Lock()
+        self._key_locks = {}
+        self.loads = 0
+        self.evictions = 0
+        _managers.add(self)
+
+    def get(self, namespace: dict = None) -> EmbeddingIndex:
+        """
+        Returns the resident index of `namespace`, loading it on first use, and marks it as
+        the most recently queried.
+        """
+        key = namespace_key(namespace)
+        with self._lock:
+            entry = self._indexes.get(key)
+            if entry is not None:
+                self._touch(key, entry)
+                evicted = self._evict(keep=key)
+            else:
+                key_lock = self._key_locks.setdefault(key, threading.Lock())
+        if entry is not None:
+            self._stop(evicted)
+            return entry["index"]
+
+        # Load outside the manager lock so other namespaces keep serving meanwhile
+        with key_lock:
+            with self._lock:
+                entry = self._indexes.get(key)
+                if entry is not None:
+                    self._touch(key, entry)
+                    return entry["index"]
+            start = time.perf_counter()
+            index = self.loader({**DEFAULT_NAMESPACE, **(namespace or {})})
+            entry = {"index": index, "bytes": resident_bytes(index), "loaded_at": time.time(),
+                     "load_seconds": time.perf_counter() - start, "last_query": time.time(), "queries": 1}
+            with self._lock:
+                self._indexes[key] = entry
+                self.loads += 1
+                evicted = self._evict(keep=key)
+        self._stop(evicted)
+        return index
+
+    @staticmethod
+    def _stop(evicted: list):
+        for old_key, old in evicted:
+            old["index"].stop()
+            print(f"Evicted index {old_key[1]}.{old_key[2]} ({old_key[3]}, {old['bytes']} bytes)")
+
+    def _touch(self, key, entry: dict):
+        entry["last_query"] = time.time()
+        entry["queries"] += 1
+        self._indexes.move_to_end(key)
+
+    def _measure(self):
+        # Refreshes grow indexes in the background, so sizes are re-read rather than kept from load time
+        for entry in self._indexes.values():
+            entry["bytes"] = resident_bytes(entry["index"])
+
+    def _evict(self, keep) -> list:
+        # Called with the lock held; the index queried now stays even if it alone exceeds the budget
+        evicted = []
+        if not self.memory_budget:
+            return evicted
+        self._measure()
+        total = sum(entry["bytes"] for entry in self._indexes.values())
+        for key in list(self._indexes):
+            if total <= self.memory_budget:
+                break
+            if key == keep:
+                continue
+            entry = self._indexes.pop(key)
+            self._key_locks.pop(key, None)
+            total -= entry["bytes"]
+            self.evictions += 1
+            evicted.append((key, entry))
+        return evicted
+
+    def evict(self, namespace: dict = None) -> bool:
+        with self._lock:
+            key = namespace_key(namespace)
+            entry = self._indexes.pop(key, None)
+            self._key_locks.pop(key, None)
+        if entry is not None:
+            entry["index"].stop()
+        return entry is not None
+
+    def clear(self):
+        with self._lock:
+            entries = list(self._indexes.values())
+            self._indexes.clear()
+            self._key_locks.clear()
+        for entry in entries:
+            entry["index"].stop()
+
+    def forget(self):
+        """
+        Drops every index without stopping it, for a forked child: the indexes hold the
+        parent's MongoDB clients and cursors, and their refresh threads did not survive the fork.
+        """
+        self._lock = threading.Lock()
+        self._indexes = OrderedDict()
+        self._key_locks = {}
+
+    def resident(self) -> list:
+        with self._lock:
+            return list(self._indexes)
+
+    def stats(self) -> dict:
+        with self._lock:
+            self._measure()
+            indexes = [{"mongo_url": re.sub(r"//[^/@]*@", "//", key[0]), "database": key[1], "collection": key[2], "model": key[3],
+                        "documents": len(entry["index"]), "bytes": entry["bytes"], "queries": entry["queries"],
+                        "load_seconds": entry["load_seconds"], "last_query": entry["last_query"]}
+                       for key, entry in self._indexes.items()]
+            return {"memory_budget": self.memory_budget, "resident_bytes": sum(item["bytes"] for item in indexes),
+                    "loads": self.loads, "evictions": self.evictions, "indexes": indexes}
+
+@after_fork
+def _forget_all():
+    for manager in list(_managers):
+        manager.forget()
+
+# === Tenants ===
+def tenants() -> dict:
+    """
+    Tenant id -> namespace from TENANTS, parsed once per value. Raises ValueError when TENANTS is malformed.
+    """
+    global _tenants
+    source, parsed = _tenants
+    if parsed is None or source != os.getenv("TENANTS"):
+        source = os.getenv("TENANTS")
+        try:
+            configured = json.loads(source or "{}")
+        except json.JSONDecodeError as e:
+            raise ValueError(f"TENANTS is not valid JSON: {e}") from e
+        if not isinstance(configured, dict) or not all(isinstance(value, dict) for value in configured.values()):
+            raise ValueError("TENANTS must be a JSON object mapping tenant ids to namespace objects")
+        parsed = {"default": dict(DEFAULT_NAMESPACE), **configured}
+        _tenants = (source, parsed)
+    return parsed
+
+def tenant_namespace(tenant_id: str = None) -> dict:
+    """
+    Returns the namespace of a tenant (default: DEFAULT_TENANT). Raises LookupError for unknown tenants.
+    """
+    tenant_id = tenant_id or os.getenv("DEFAULT_TENANT", "default")
+    namespace = tenants().get(tenant_id)
+    if namespace is None:
+        raise LookupError(f"Unknown tenant '{tenant_id}'")
+    return {**DEFAULT_NAMESPACE, **namespace, "tenant": tenant_id}
+
+def authorize(namespace: dict, headers):
+    """
+    Checks the request's API key against the tenant's "api_key_env" (or "api_key"). Raises
+    PermissionError when the tenant has a key and the request does not present it.
+    """
+    expected = os.getenv(namespace["api_key_env"], "") if namespace.get("api_key_env") else namespace.get("api_key")
+    if namespace.get("api_key_env") and not expected:
+        raise PermissionError(f"Tenant '{namespace.get('tenant')}' has no API key configured")
+    if not expected:
+        return
+    presented = headers.get("X-API-Key") or ""
+    authorization = headers.get("Authorization") or ""
+    if authorization.startswith("Bearer "):
+        presented = authorization[len("Bearer "):]
+    if not hmac.compare_digest(presented.encode(), expected.encode()):
+        raise PermissionError(f"Invalid API key for tenant '{namespace.get('tenant')}'")
+
+def request_identity(headers, data: dict) -> tuple:
+    """
+    Returns (tenant id, user id) of a request from its headers or JSON body.
+    """
+    tenant_id = headers.get("X-Tenant-ID") or data.get("tenant") or os.getenv("DEFAULT_TENANT", "default")
+    user_id = headers.get("X-User-ID") or data.get("user_id") or "anonymous"
+    return tenant_id, user_id
+
+def current_namespace() -> dict:
+    return _namespace.get() or tenant_namespace()
+
+@contextmanager
+def use_namespace(namespace: dict):
+    token = _namespace.set(namespace)
+    try:
+        yield namespace
+    finally:
+        _namespace.reset(token)
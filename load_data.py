@@ -8,41 +8,226 @@ and stores them in a MongoDB collection along with the original text and label.
 Usage:
     python load_data.py
     python load_data.py --mongo_url mongodb://host:port --limit 500
+    python load_data.py --snapshot snapshots/ag_news
+    python load_data.py --stream --limit 120000 --chunk_size 2000 --batch_size 64
+    python load_data.py --stream --limit 120000 --resume
+    python load_data.py --stream --limit 120000 --workers 8 --torch_threads 1
+    python load_data.py --storage int8 --keep_full
+    python load_data.py --namespace acme.articles --model all-MiniLM-L6-v2 --snapshot snapshots/acme
 
 Defaults:
     mongo_url: from MONGO_URL env variable or localhost
     limit: 1000 documents
+    snapshot: none; when set, also writes a memory-mappable embedding snapshot (see embedding_snapshot.py)
+    workers: 1; with more, embeddings are generated by a pool of processes (see parallel_encoder.py)
+    torch_threads: 1 per worker process with --workers, torch's own default otherwise
+    storage: array (BSON doubles); float32, float16, int8 or binary store BSON BinData (see quantization.py)
+    keep_full: off; when set, also stores a float32 copy in 'embedding_full' for rescoring compact formats
+    namespace: testdb.ag_news; the database.collection to load, e.g. a tenant's corpus (see index_manager.py)
+    model: all-MiniLM-L6-v2; the tenant's namespace must name the same model
+
+Streaming mode (--stream) keeps memory flat: the dataset is read in chunks, each chunk is encoded
+while the previous one is written with an unordered bulk insert, and everything goes into a staging
+collection that replaces the target collection with one atomic rename at the end, so readers never see a
+half-loaded collection. Progress is checkpointed per chunk and --resume continues an interrupted load.
+Note that Atlas Search indexes belong to the replaced collection and must be recreated after the swap.
+
+Both modes create the text index local hybrid search needs (see hybrid_search.py).
 """
 
-import argparse, dotenv, os
+import argparse, dotenv, itertools, os, queue, threading, time
+from contextlib import contextmanager
+from datetime import datetime, timezone
+import numpy as np
 from datasets import load_dataset
-from pymongo import MongoClient
-from sentence_transformers import SentenceTransformer
+from pymongo.errors import BulkWriteError
+from embedding_cache import get_cache
+from embedding_snapshot import write_snapshot
+from hybrid_search import create_text_index
+from model_registry import get_model
+from mongo_pool import get_client
+from parallel_encoder import ParallelEncoder
+from quantization import FORMATS, to_bson
+
+@contextmanager
+def open_encoder(workers: int = 1, torch_threads: int = None, model_name: str = "all-MiniLM-L6-v2"):
+    """
+    Yields the shared model for single-process encoding, or a ParallelEncoder pool
+    when more than one worker is requested. Both expose `encode(texts, batch_size=...)`.
+    The pool is shut down on exit, also when encoding fails. `torch_threads` sets the torch
+    threads of each worker, or of this (loader) process when encoding in-process.
+    """
+    if workers and workers > 1:
+        with ParallelEncoder(workers=workers, torch_threads=torch_threads or 1, model_name=model_name) as encoder:
+            yield encoder
+        return
+    if torch_threads:
+        import torch
+        torch.set_num_threads(torch_threads)
+    yield get_model(model_name)
+
+def print_worker_report(encoder):
+    if isinstance(encoder, ParallelEncoder):
+        for pid, stats in encoder.report().items():
+            print(f"Worker {pid}: {stats['docs']} docs, {stats['docs_per_sec']:.1f} docs/sec")
+
+def embedding_fields(vector, storage: str = "array", keep_full: bool = False) -> dict:
+    """
+    Returns the document fields for one embedding in the chosen storage format.
+    """
+    fields = to_bson(vector, storage)
+    if keep_full:
+        fields.update(to_bson(vector, "float32", "embedding_full"))
+    return fields
 
-def load_and_store_vector_data(mongo_url: str, limit: int = 1000):
+def load_and_store_vector_data(mongo_url: str, limit: int = 1000, snapshot: str = None,
+                               workers: int = 1, torch_threads: int = None, storage: str = "array",
+                               keep_full: bool = False, namespace: str = "testdb.ag_news",
+                               model_name: str = "all-MiniLM-L6-v2"):
     # Load dataset
     dataset = load_dataset("ag_news", split=f"train[:{limit}]")
     docs = [{"_id": i, "text": item["text"], "label": item["label"]} for i, item in enumerate(dataset)]
 
     # Connect to MongoDB
-    client = MongoClient(mongo_url)
-    db = client["testdb"]
-    collection = db["ag_news"]
+    database, collection_name = namespace.split(".", 1)
+    client = get_client(mongo_url)
+    db = client[database]
+    collection = db[collection_name]
 
     # Clear old data
     collection.delete_many({})
+    # Documents updated after this point carry a newer updated_at than the snapshot records
+    written_at = datetime.now(timezone.utc)
 
     # Generate embeddings
-    model = SentenceTransformer("all-MiniLM-L6-v2")
     texts = [doc["text"] for doc in docs]
-    embeddings = model.encode(texts).tolist()
+    with open_encoder(workers, torch_threads, model_name) as encoder:
+        matrix = get_cache().encode(encoder, texts, model_name)
+        print_worker_report(encoder)
+    print(f"Embedding cache: {get_cache().stats()}")
 
-    for i, embedding in enumerate(embeddings):
-        docs[i]["embedding"] = embedding
+    for i, embedding in enumerate(matrix):
+        docs[i].update(embedding_fields(embedding, storage, keep_full))
 
     # Insert into MongoDB
     collection.insert_many(docs)
-    print(f"Inserted {len(docs)} documents with embeddings into 'ag_news' collection.")
+    print(f"Inserted {len(docs)} documents with embeddings into '{namespace}' collection.")
+
+    # Hybrid search reads with $text and never creates the index itself
+    create_text_index(collection)
+
+    # Write a binary snapshot that search processes can memory-map at startup
+    if snapshot:
+        normalized = bool(np.allclose(np.linalg.norm(matrix, axis=1), 1.0, atol=1e-3))
+        header = write_snapshot(snapshot, matrix, [doc["_id"] for doc in docs], model=model_name,
+                                normalized=normalized, source=namespace, last_updated=written_at)
+        print(f"Wrote snapshot of {header['count']} x {header['dimension']} embeddings to '{snapshot}'.")
+
+def stream_and_store_vector_data(mongo_url: str, limit: int = 1000, chunk_size: int = 1000,
+                                 batch_size: int = 32, resume: bool = False, dataset=None,
+                                 workers: int = 1, torch_threads: int = None, storage: str = "array",
+                                 keep_full: bool = False, namespace: str = "testdb.ag_news",
+                                 model_name: str = "all-MiniLM-L6-v2") -> int:
+    """
+    Streams the dataset into MongoDB chunk by chunk with bounded memory.
+
+    Args:
+        mongo_url (str): MongoDB connection URI.
+        limit (int): Number of samples to load from the dataset.
+        chunk_size (int): Documents encoded and written per chunk.
+        batch_size (int): Encoder batch size.
+        resume (bool): Continue from the last checkpoint of an interrupted load instead of starting over.
+        dataset: Optional iterable of {"text", "label"} items (default: AG News train split, streamed).
+        workers (int): Encoder processes; more than one shards each chunk across a process pool.
+        torch_threads (int): Torch intra-op threads per encoder process (default: 1 per worker, or torch's
+            default when encoding in-process).
+        storage (str): Embedding storage format (see quantization.py).
+        keep_full (bool): Also store a float32 copy in 'embedding_full' for rescoring.
+        namespace (str): database.collection to load into.
+        model_name (str): Sentence-transformers model to embed with.
+
+    Returns:
+        int: Number of documents in the collection after the swap.
+    """
+    database, collection_name = namespace.split(".", 1)
+    client = get_client(mongo_url)
+    db = client[database]
+    staging = db[f"{collection_name}_staging"]
+    checkpoints = db["ingest_checkpoints"]
+    checkpoint_id = namespace
+
+    offset = 0
+    if resume:
+        checkpoint = checkpoints.find_one({"_id": checkpoint_id})
+        offset = checkpoint["next_offset"] if checkpoint else 0
+        print(f"Resuming load into '{staging.name}' at offset {offset}")
+    else:
+        staging.drop()
+        checkpoints.delete_one({"_id": checkpoint_id})
+
+    if dataset is None:
+        dataset = load_dataset("ag_news", split="train", streaming=True).take(limit)
+    items = itertools.islice(dataset, offset, limit)
+
+    # One chunk in the queue, one being written and one being encoded bounds memory at three chunks
+    writes = queue.Queue(maxsize=1)
+    errors = []
+
+    def writer():
+        while True:
+            task = writes.get()
+            if task is None:
+                return
+            docs, next_offset = task
+            if errors:
+                continue
+            try:
+                try:
+                    staging.insert_many(docs, ordered=False)
+                except BulkWriteError as e:
+                    # Documents written before an interruption are already there on resume
+                    if any(error["code"] != 11000 for error in e.details.get("writeErrors", [])):
+                        raise
+                checkpoints.update_one({"_id": checkpoint_id}, {"$set": {"next_offset": next_offset}}, upsert=True)
+            except Exception as e:
+                errors.append(e)
+
+    thread = threading.Thread(target=writer, name="ingest-writer", daemon=True)
+    thread.start()
+
+    with open_encoder(workers, torch_threads, model_name) as encoder:
+        start = time.perf_counter()
+        loaded = 0
+        try:
+            while not errors:
+                chunk = list(itertools.islice(items, chunk_size))
+                if not chunk:
+                    break
+                texts = [item["text"] for item in chunk]
+                embeddings = get_cache().encode(encoder, texts, model_name, batch_size=batch_size)
+                docs = [{"_id": offset + loaded + i, "text": item["text"], "label": item["label"],
+                         **embedding_fields(embedding, storage, keep_full)}
+                        for i, (item, embedding) in enumerate(zip(chunk, embeddings))]
+                loaded += len(docs)
+                writes.put((docs, offset + loaded))
+                print(f"Encoded {offset + loaded} documents ({loaded / (time.perf_counter() - start):.1f} docs/sec)")
+        finally:
+            writes.put(None)
+            thread.join()
+            print_worker_report(encoder)
+            print(f"Embedding cache: {get_cache().stats()}")
+    if errors:
+        raise errors[0]
+
+    # Index before the swap so hybrid search finds the text index as soon as the collection appears
+    create_text_index(staging)
+
+    # Swap the fully loaded staging collection in with a single atomic rename
+    staging.rename(collection_name, dropTarget=True)
+    checkpoints.delete_one({"_id": checkpoint_id})
+    count = db[collection_name].estimated_document_count()
+    print(f"Swapped in {count} documents with embeddings as '{namespace}' collection.")
+    return count
 
 if __name__ == "__main__":
     dotenv.load_dotenv()
@@ -50,7 +235,29 @@ if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Load and store vector data into MongoDB")
     parser.add_argument("--mongo_url", help="MongoDB URI (optional, defaults to env MONGO_URL or localhost)")
     parser.add_argument("--limit", type=int, default=1000, help="Number of samples to load from the dataset")
+    parser.add_argument("--snapshot", help="Directory to write a memory-mappable embedding snapshot to (optional)")
+    parser.add_argument("--stream", action="store_true", help="Stream the dataset in chunks through a staging collection")
+    parser.add_argument("--chunk_size", type=int, default=1000, help="Documents per chunk in streaming mode")
+    parser.add_argument("--batch_size", type=int, default=32, help="Encoder batch size in streaming mode")
+    parser.add_argument("--resume", action="store_true", help="Resume an interrupted streaming load")
+    parser.add_argument("--workers", type=int, default=1, help="Number of encoder processes")
+    parser.add_argument("--torch_threads", type=int, help="Torch threads per encoder process (default: 1 per worker, torch's default in-process)")
+    parser.add_argument("--storage", choices=FORMATS, default="array", help="Embedding storage format")
+    parser.add_argument("--keep_full", action="store_true", help="Also store float32 embeddings for rescoring")
+    parser.add_argument("--namespace", default="testdb.ag_news", help="database.collection to load into")
+    parser.add_argument("--model", default="all-MiniLM-L6-v2", help="Sentence-transformers model to embed with")
     args = parser.parse_args()
+    if args.stream and args.snapshot:
+        parser.error("--snapshot is not supported with --stream")
 
     mongo_url = args.mongo_url or os.getenv("MONGO_URL", "mongodb://localhost:27017/")
-    load_and_store_vector_data(mongo_url, args.limit)
+    if args.stream:
+        stream_and_store_vector_data(mongo_url, args.limit, args.chunk_size, args.batch_size, args.resume,
+                                     workers=args.workers, torch_threads=args.torch_threads,
+                                     storage=args.storage, keep_full=args.keep_full,
+                                     namespace=args.namespace, model_name=args.model)
+    else:
+        load_and_store_vector_data(mongo_url, args.limit, args.snapshot,
+                                   workers=args.workers, torch_threads=args.torch_threads,
+                                   storage=args.storage, keep_full=args.keep_full,
+                                   namespace=args.namespace, model_name=args.model)
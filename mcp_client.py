@@ -5,31 +5,243 @@ mcp_client.py
 Implements the client component for the MCP (Multi-Component Pipeline) demo.
 Sends requests to the MCP server and displays the responses.
 
+Requests go through a pooled keep-alive session with timeouts and jittered exponential backoff
+on 429 and 503 responses, timeouts and connection errors; other errors (e.g. a 500 from a failed
+tool call) would fail the same way again and are returned at once. Load mode sends queries read from a file (or stdin)
+with configurable parallelism and reports throughput and a latency histogram.
+
 Usage:
     python mcp_client.py "Your question here"
     # or just
     python mcp_client.py
     # and enter your question interactively
+    # stream routing, hits and the summary as they arrive (mcp_news_server.py)
+    python mcp_client.py --stream "Atlanta Braves"
+    # drive a server with queries from a file (or - for stdin), 16 at a time
+    python mcp_client.py --base_url http://localhost:5000 --load queries.txt --concurrency 16
+
+Environment:
+    MCP_URL: server base URL (default: http://localhost:5000)
 """
 
-import requests, sys
+import argparse, json, os, random, sys, threading, time
+from concurrent.futures import ThreadPoolExecutor
+import requests
+from requests.adapters import HTTPAdapter
+
+# Overloaded or throttled: a later attempt can succeed
+RETRY_STATUSES = {429, 503}
+
+class McpClient:
+    def __init__(self, base_url: str = None, timeout: tuple = (3.05, 60), retries: int = 3,
+                 backoff: float = 0.5, max_backoff: float = 8.0, pool_size: int = 32):
+        """
+        Args:
+            base_url (str): Server base URL (default: env MCP_URL or http://localhost:5000).
+            timeout (tuple): (connect, read) timeouts in seconds.
+            retries (int): Retries after the first attempt on 429/503, timeouts and connection errors.
+            backoff (float): Base delay in seconds for exponential backoff with full jitter.
+            max_backoff (float): Upper bound for a single backoff delay.
+            pool_size (int): Keep-alive connections kept per host.
+        """
+        self.base_url = (base_url or os.getenv("MCP_URL", "http://localhost:5000")).rstrip("/")
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    def _delay(self, attempt: int, response=None) -> float:
+        retry_after = response.headers.get("Retry-After") if response is not None else None
+        if retry_after:
+            try:
+                return min(float(retry_after), self.max_backoff)
+            except ValueError:
+                pass
+        return random.uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt))
+
+    def post(self, path: str, payload: dict, **kwargs) -> requests.Response:
+        """
+        POSTs with retries; the last response (or error) is returned (or raised) when retries run out.
+        """
+        url = f"{self.base_url}{path}"
+        for attempt in range(self.retries + 1):
+            try:
+                response = self.session.post(url, json=payload, timeout=self.timeout, **kwargs)
+            except (requests.ConnectionError, requests.Timeout):
+                if attempt == self.retries:
+                    raise
+                time.sleep(self._delay(attempt))
+                continue
+            if response.status_code not in RETRY_STATUSES or attempt == self.retries:
+                return response
+            response.close()
+            time.sleep(self._delay(attempt, response))
+
+    def send_request(self, user_input: str) -> dict:
+        return self.post("/mcp", {"input": user_input}).json()
+
+    def stream_request(self, user_input: str):
+        """
+        Posts to the Server-Sent Events endpoint and yields (event, data) pairs as they arrive.
+        """
+        with self.post("/mcp/stream", {"input": user_input}, stream=True,
+                       headers={"Accept": "text/event-stream"}) as response:
+            if response.headers.get("Content-Type", "").startswith("application/json"):
+                yield "error", response.json()
+                return
+            event, data = "message", []
+            for line in response.iter_lines(decode_unicode=True):
+                if line:
+                    field, _, value = line.partition(":")
+                    if field == "event":
+                        event = value.strip()
+                    elif field == "data":
+                        data.append(value.lstrip())
+                elif data:
+                    yield event, json.loads("\n".join(data))
+                    event, data = "message", []
+
+    def run_load(self, queries: list, concurrency: int = 8) -> dict:
+        """
+        Sends every query with `concurrency` requests in flight and returns a report with
+        throughput, latency percentiles and a latency histogram.
+        """
+        latencies, errors = [], 0
+        lock = threading.Lock()
+
+        def send(query):
+            nonlocal errors
+            start = time.perf_counter()
+            try:
+                ok = self.post("/mcp", {"input": query}).status_code == 200
+            except requests.RequestException:
+                ok = False
+            elapsed = time.perf_counter() - start
+            with lock:
+                latencies.append(elapsed)
+                errors += 0 if ok else 1
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            list(pool.map(send, queries))
+        return load_report(latencies, errors, time.perf_counter() - start, concurrency)
+
+    def close(self):
+        self.session.close()
+
+HISTOGRAM_BOUNDS_MS = [5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000]
+
+def percentile(values: list, fraction: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+def load_report(latencies: list, errors: int, seconds: float, concurrency: int) -> dict:
+    milliseconds = [latency * 1000 for latency in latencies]
+    histogram = {}
+    for bound in HISTOGRAM_BOUNDS_MS + [float("inf")]:
+        label = f"<={bound}ms" if bound != float("inf") else f">{HISTOGRAM_BOUNDS_MS[-1]}ms"
+        histogram[label] = 0
+    for value in milliseconds:
+        for bound in HISTOGRAM_BOUNDS_MS:
+            if value <= bound:
+                histogram[f"<={bound}ms"] += 1
+                break
+        else:
+            histogram[f">{HISTOGRAM_BOUNDS_MS[-1]}ms"] += 1
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "concurrency": concurrency,
+        "seconds": seconds,
+        "throughput_rps": len(latencies) / seconds if seconds else 0.0,
+        "p50_ms": percentile(milliseconds, 0.50),
+        "p90_ms": percentile(milliseconds, 0.90),
+        "p99_ms": percentile(milliseconds, 0.99),
+        "max_ms": max(milliseconds, default=0.0),
+        "histogram": histogram,
+    }
+
+def print_report(report: dict):
+    print(f"{report['requests']} requests, {report['errors']} errors, concurrency {report['concurrency']}, "
+          f"{report['seconds']:.2f}s, {report['throughput_rps']:.1f} req/s")
+    print(f"latency p50 {report['p50_ms']:.1f}ms  p90 {report['p90_ms']:.1f}ms  "
+          f"p99 {report['p99_ms']:.1f}ms  max {report['max_ms']:.1f}ms")
+    peak = max(report["histogram"].values(), default=0) or 1
+    for label, count in report["histogram"].items():
+        print(f"{label:>10} {count:6d} {'#' * round(40 * count / peak)}")
+
+_default_client = None
+
+def default_client() -> McpClient:
+    global _default_client
+    if _default_client is None:
+        _default_client = McpClient()
+    return _default_client
 
 def send_request(user_input):
-    url = "http://localhost:5000/mcp"
-    payload = {"input": user_input}
-    response = requests.post(url, json=payload)
-    return response.json()
+    return default_client().send_request(user_input)
 
-if __name__ == "__main__":
-    if len(sys.argv) < 2:
-        user_query = input("Ask something: ")
+def stream_request(user_input):
+    return default_client().stream_request(user_input)
+
+def render_event(event, data):
+    if event == "routing":
+        print(f"[{data['source']}] {data['tool']}({data['arguments']})", flush=True)
+    elif event == "hit":
+        # A hit carries only the requested fields, and no score when the rerank budget skipped it
+        details = ", ".join(f"{field}: {'n/a' if value is None else format(value, '.4f')}" if field == "score"
+                            else f"{field}: {value}"
+                            for field, value in data.items() if field not in ("tool", "rank", "text"))
+        if "text" in data:
+            print(f"{data['rank']}. {data['text']} ({details})", flush=True)
+        else:
+            print(f"{data['rank']}. {details}", flush=True)
     else:
-        user_query = " ".join(sys.argv[1:])
-    
-    data = send_request(user_query)
+        print(data, flush=True)
 
-    if "data" in data:
-        for i, headline in enumerate(data["data"], start=1):
-            print(i, headline)
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Send a question to the MCP server")
+    parser.add_argument("words", nargs="*", help="Question to ask (prompted for when omitted)")
+    parser.add_argument("--query", help="Question to ask")
+    parser.add_argument("--base_url", help="Server base URL (default: env MCP_URL or http://localhost:5000)")
+    parser.add_argument("--stream", action="store_true", help="Render streamed events as they arrive")
+    parser.add_argument("--load", help="File with one query per line (- for stdin) to send in load mode")
+    parser.add_argument("--concurrency", type=int, default=8, help="Requests in flight in load mode")
+    parser.add_argument("--timeout", type=float, default=60, help="Read timeout in seconds")
+    parser.add_argument("--retries", type=int, default=3, help="Retries on 429/503, timeouts and connection errors")
+    parser.add_argument("--json", action="store_true", help="Print the load report as JSON")
+    args = parser.parse_args()
+
+    client = McpClient(args.base_url, timeout=(3.05, args.timeout), retries=args.retries,
+                       pool_size=max(32, args.concurrency))
+
+    if args.load:
+        source = sys.stdin if args.load == "-" else open(args.load)
+        with source:
+            queries = [line.strip() for line in source if line.strip()]
+        report = client.run_load(queries, args.concurrency)
+        if args.json:
+            print(json.dumps(report, indent=2))
+        else:
+            print_report(report)
+        sys.exit(0)
+
+    user_query = args.query or " ".join(args.words) or input("Ask something: ")
+
+    if args.stream:
+        for event, data in client.stream_request(user_query):
+            render_event(event, data)
     else:
-        print(data)
+        data = client.send_request(user_query)
+
+        if "data" in data:
+            for i, headline in enumerate(data["data"], start=1):
+                print(i, headline)
+        else:
+            print(data)
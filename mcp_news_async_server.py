@@ -0,0 +1,149 @@
+"""
+mcp_news_async_server.py
+@ken.chen
+
+asyncio (aiohttp) variant of mcp_news_server.py serving the same /mcp contract. OpenAI calls go
+through AsyncOpenAI/AsyncAzureOpenAI and documents are hydrated with PyMongo's AsyncMongoClient,
+so a slow completion no longer ties up a worker; CPU-bound encoding and scoring run on a bounded
+thread pool. One process can hold hundreds of LLM calls in flight.
+
+Usage:
+    python mcp_news_async_server.py
+
+Requests are served from their tenant's corpus (X-Tenant-ID / X-User-ID headers, see
+index_manager.py); unknown tenants get a 404, and requests without the API key of a tenant that
+has one get a 401. "fields", "limit" and "offset" in the body select the headline fields and the
+page of results, and "rerank" a cross-encoder stage (see news_tools.py).
+
+GET /metrics serves the stage latency histograms and counters of metrics.py, and requests with
+"timings": true (or MCP_TIMINGS=true) get a per-stage breakdown under "timings".
+
+Environment:
+    PORT: port to listen on (default: 5000)
+    ASYNC_CPU_WORKERS: threads for encoding and scoring (default: CPU count)
+    HYBRID_SEARCH: set to "true" to fuse vector and text rankings, as in mcp_news_server.py (default: false)
+"""
+
+import asyncio, os
+from functools import partial
+from concurrent.futures import ThreadPoolExecutor
+from aiohttp import web
+from dotenv import load_dotenv
+from openai_client import OpenAIClient
+from model_registry import warm_up
+from metrics import in_context, inc, render, timer, timings_requested, trace
+from mongo_pool import close_all, close_all_async, get_async_client
+from index_manager import (authorize, current_namespace, namespace_key, request_identity, tenant_namespace, tenants,
+                           use_namespace)
+from news_tools import category_filter, current_page, dumps, exemplars, format_results, page_options, tools, use_page
+from tool_dispatcher import ToolDispatcher, build_response
+from reranker import rerank_depth
+from sbert_vector_search import (headline_projection, hit_ids, manager, rank_many, rerank_hits, reset_indexes,
+                                 to_headlines)
+from tool_router import create_router
+
+load_dotenv()
+tenants()   # refuse to start on a malformed TENANTS
+agent = OpenAIClient()
+router = create_router(agent, tools, exemplars)
+executor_key = web.AppKey("executor", ThreadPoolExecutor)
+dispatcher_key = web.AppKey("dispatcher", ToolDispatcher)
+
+# === Tool Functions ===
+async def find_headline_report(executor, headline, category=None) -> list:
+    mongo_url = os.getenv("MONGO_URL", "mongodb://localhost:27017/")
+    namespace, page = current_namespace(), current_page()
+    offset, limit, fields = page["offset"], page["offset"] + page["limit"], page["fields"]
+    hybrid = os.getenv("HYBRID_SEARCH", "false").lower() == "true"
+    loop = asyncio.get_running_loop()
+    hits = await loop.run_in_executor(executor, in_context(rank_many), [headline], mongo_url,
+                                      rerank_depth(limit) if page["rerank"] else limit, category_filter(category),
+                                      hybrid, namespace)
+    if page["rerank"]:
+        # Every candidate is hydrated with its text for the cross-encoder
+        projection = headline_projection(("text",) + fields)
+    else:
+        hits = [row[offset:] for row in hits]
+        projection = headline_projection(fields)
+    if projection is None:
+        return to_headlines(hits, None, fields)[0]
+    namespace_url, database, collection_name, _ = namespace_key({"mongo_url": mongo_url, **namespace})
+    collection = get_async_client(namespace_url)[database][collection_name]
+    with timer("mongo"):
+        docs = await collection.find({"_id": {"$in": hit_ids(hits)}}, projection).to_list(None)
+    if page["rerank"]:
+        hits = await loop.run_in_executor(executor, in_context(rerank_hits), [headline], hits, docs)
+        hits = [row[offset:limit] for row in hits]
+    return to_headlines(hits, docs, fields)[0]
+
+async def handle_mcp(request: web.Request) -> web.Response:
+    try:
+        data = await request.json()
+    except ValueError:
+        data = {}
+    user_input = data.get("input")
+    tenant_id, user_id = request_identity(request.headers, data)
+    if not user_input:
+        return web.json_response({"error": "Missing input"}, status=400)
+    try:
+        namespace = tenant_namespace(tenant_id)
+        authorize(namespace, request.headers)
+        page = page_options(data)
+    except PermissionError as e:
+        return web.json_response({"error": str(e)}, status=401)
+    except LookupError as e:
+        return web.json_response({"error": str(e)}, status=404)
+    except ValueError as e:
+        return web.json_response({"error": str(e)}, status=400)
+
+    with trace() as request_trace, use_namespace(namespace), use_page(page):
+        try:
+            messages = [{"role": "user", "content": f"user_id is '{user_id}' and user_input is '{user_input}'"}]
+            executor = request.app[executor_key]
+            calls, source = await router.route_async(user_input, messages, executor)
+            if not calls:
+                raise ValueError("No tool call in response")
+            print(f"Tool calls: {calls}")
+
+            # Await every requested tool concurrently
+            results = await request.app[dispatcher_key].dispatch_async(calls)
+            body, status = build_response(format_results(results))
+
+        except Exception as e:
+            body, status = {"error": str(e)}, 500
+        if timings_requested(data):
+            body["timings"] = request_trace.as_dict()
+        inc("mcp_requests_total", endpoint="/mcp", status=status)
+        with timer("serialize"):
+            return web.Response(body=dumps(body), status=status, content_type="application/json")
+
+async def handle_stats(request: web.Request) -> web.Response:
+    return web.json_response({"router": router.stats(), "endpoints": agent.endpoint_stats(), "indexes": manager.stats()})
+
+async def handle_metrics(request: web.Request) -> web.Response:
+    return web.Response(text=render(), content_type="text/plain")
+
+async def on_cleanup(app: web.Application):
+    await close_all_async()
+    reset_indexes()
+    close_all()
+    app[executor_key].shutdown(wait=False)
+    app[dispatcher_key].shutdown()
+
+def create_app() -> web.Application:
+    app = web.Application()
+    app[executor_key] = ThreadPoolExecutor(max_workers=int(os.getenv("ASYNC_CPU_WORKERS", str(os.cpu_count() or 4))),
+                                           thread_name_prefix="cpu")
+    # Tool functions are bound to this app's executor; the schema still drives the registry
+    app[dispatcher_key] = ToolDispatcher(tools, {"find_headline_report": partial(find_headline_report, app[executor_key])})
+    app.router.add_post("/mcp", handle_mcp)
+    app.router.add_get("/mcp/stats", handle_stats)
+    app.router.add_get("/metrics", handle_metrics)
+    app.on_cleanup.append(on_cleanup)
+    return app
+
+if __name__ == '__main__':
+    # Load the embedding model once before serving so the first request doesn't pay for it
+    for model_name, seconds in warm_up(*os.getenv("WARM_UP_MODELS", "all-MiniLM-L6-v2").split(",")).items():
+        print(f"Warmed up {model_name} in {seconds:.2f}s")
+    web.run_app(create_app(), port=int(os.getenv("PORT", "5000")))
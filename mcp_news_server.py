@@ -7,73 +7,209 @@ Receives client requests, performs news-related processing or search, and return
 
 Usage:
     python mcp_news_server.py
+
+Endpoints:
+    POST /mcp          JSON response once all tools have finished
+    POST /mcp/stream   Server-Sent Events: "routing" per tool call, "hit" per search result, "error" per
+                       tool call that times out, then "summary"
+    GET  /mcp/stats    routing decisions by source, per-endpoint LLM latency and errors, resident indexes
+    GET  /metrics      stage latency histograms, token and cache counters (Prometheus text format, see metrics.py)
+
+Each request is served from its tenant's corpus: the X-Tenant-ID header (or "tenant" in the body)
+selects a namespace from TENANTS and X-User-ID (or "user_id") identifies the user; see
+index_manager.py. Unknown tenants get a 404, and requests without the API key of a tenant that
+has one get a 401.
+
+Requests may pick the fields of each headline and page through results with "fields", "limit"
+and "offset" (see news_tools.py); only the requested page is hydrated, with only those fields.
+"rerank": true adds a cross-encoder rerank stage over the top candidates (see reranker.py).
+
+Requests with "timings": true (or every request with MCP_TIMINGS=true) get a per-stage timing
+breakdown under "timings" in the response, or in the summary event when streaming.
 """
 
-import os
-from flask import Flask, request, jsonify
+import os, time
+from concurrent.futures import FIRST_COMPLETED, wait
+from flask import Flask, Response, request, jsonify, stream_with_context
 from openai_client import OpenAIClient
+from model_registry import warm_up
+from metrics import inc, render, timer, timings_requested, trace
+from request_coalescer import RequestCoalescer
+from mongo_pool import close_all
+from index_manager import (authorize, current_namespace, namespace_key, request_identity, tenant_namespace, tenants,
+                           use_namespace)
+from sbert_vector_search import manager, reset_indexes, search_many
+from tool_router import create_router
+from news_tools import (category_filter, current_page, dumps, exemplars, format_results, page_options, sse_event,
+                        tools, use_page)
+from tool_dispatcher import ToolDispatcher, build_response
 from dotenv import load_dotenv
-import json
 
 app = Flask(__name__)
 load_dotenv()
+tenants()   # refuse to start on a malformed TENANTS
 agent = OpenAIClient()
 
-tools = [
-    {
-        "type": "function",
-        "function": {
-            "name": "find_headline_report",
-            "description": "Find a report related to a user's input",
-            "parameters": {
-                "type": "object",
-                "properties": {
-                    "headline": {
-                        "type": "string",
-                        "description": "The news headline or topic to search for"
-                    }
-                },
-                "required": ["headline"]
-            }
-        }
-    }
-]
+router = create_router(agent, tools, exemplars)
 
-# === Tool Functions ===
-def find_headline_report(headline) -> list:
+def search_batch(items: list) -> list:
+    """
+    Answers coalesced (headline, category, namespace, page) requests with one batched search per
+    category, namespace and page.
+    """
     mongo_url = os.getenv("MONGO_URL", "mongodb://localhost:27017/")
-    from sbert_vector_search import run_local_vector_search
-    results = run_local_vector_search(query_text=headline, mongo_url=mongo_url, top_k=5)
+    hybrid = os.getenv("HYBRID_SEARCH", "false").lower() == "true"
+    groups = {}
+    for i, (headline, category, namespace, page) in enumerate(items):
+        key = (category, namespace_key(namespace), page["fields"], page["offset"], page["limit"], page["rerank"])
+        groups.setdefault(key, []).append(i)
+    results = [None] * len(items)
+    for (category, _, fields, offset, limit, rerank), positions in groups.items():
+        found = search_many([items[i][0] for i in positions], mongo_url, top_k=limit,
+                            filters=category_filter(category), hybrid=hybrid, namespace=items[positions[0]][2],
+                            fields=fields, offset=offset, rerank=rerank)
+        for i, headlines in zip(positions, found):
+            results[i] = headlines
     return results
 
+# Concurrent tool calls within the window share one batched encode and one matrix product
+coalescer = RequestCoalescer(
+    search_batch,
+    window_ms=float(os.getenv("COALESCE_WINDOW_MS", "5")),
+    max_batch=int(os.getenv("COALESCE_MAX_BATCH", "32")),
+)
+
+# === Tool Functions ===
+def find_headline_report(headline, category=None) -> list:
+    category_filter(category)  # reject unknown categories before queuing
+    # The batch runs on the coalescer's thread, so the request's namespace and page travel with the item
+    return coalescer.submit((headline, category, current_namespace(), current_page()))
+
+# Every tool in the schema maps to the function of the same name above
+dispatcher = ToolDispatcher(tools, globals())
+
 @app.route('/mcp', methods=['POST'])
 def handle_mcp():
     data = request.get_json()
     user_input = data.get("input")
-    user_id = 'ken.chen' # Example user ID, replace with actual logic to get user ID
+    tenant_id, user_id = request_identity(request.headers, data)
     if not user_input:
         return jsonify({"error": "Missing input"}), 400
+    try:
+        namespace = tenant_namespace(tenant_id)
+        authorize(namespace, request.headers)
+        page = page_options(data)
+    except PermissionError as e:
+        return jsonify({"error": str(e)}), 401
+    except LookupError as e:
+        return jsonify({"error": str(e)}), 404
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    with trace() as request_trace, use_namespace(namespace), use_page(page):
+        try:
+            messages = [{"role": "user", "content": f"user_id is '{user_id}' and user_input is '{user_input}'"}]
+            calls, source = router.route(user_input, messages)
+            if not calls:
+                raise ValueError("No tool call in response")
+            print(f"Tool calls: {calls}")
+
+            # Run every requested tool concurrently; concurrent searches share a coalesced batch
+            body, status = build_response(format_results(dispatcher.dispatch(calls)))
 
+        except Exception as e:
+            body, status = {"error": str(e)}, 500
+        if timings_requested(data):
+            body["timings"] = request_trace.as_dict()
+        inc("mcp_requests_total", endpoint="/mcp", status=status)
+        with timer("serialize"):
+            response = Response(dumps(body), status=status, mimetype="application/json")
+        return response
+
+@app.route('/mcp/stream', methods=['POST'])
+def handle_mcp_stream():
+    data = request.get_json()
+    user_input = data.get("input")
+    tenant_id, user_id = request_identity(request.headers, data)
+    if not user_input:
+        return jsonify({"error": "Missing input"}), 400
     try:
-        messages = [{"role": "user", "content": f"user_id is '{user_id}' and user_input is '{user_input}'"}]
-        response = agent.get_response(messages, tools)
-        tool_call = response.choices[0].message.tool_calls[0]
-        print(f"Tool call: {tool_call}")
-        name = tool_call.function.name
-        args = json.loads(tool_call.function.arguments)
-        headlines = []
-
-        # Route to function
-        if name == "find_headline_report":
-            headlines = find_headline_report(**args)
-            result = name
-        else:
-            result = "Unknown tool"
-
-        return jsonify({"tool": name, "arguments": args, "result": result, "data": headlines}), 200
-
-    except Exception as e:
-        return jsonify({"error": str(e)}), 500
+        namespace = tenant_namespace(tenant_id)
+        authorize(namespace, request.headers)
+        page = page_options(data)
+    except PermissionError as e:
+        return jsonify({"error": str(e)}), 401
+    except LookupError as e:
+        return jsonify({"error": str(e)}), 404
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    def events():
+        with trace() as request_trace, use_namespace(namespace), use_page(page):
+            yield from traced_events(request_trace)
+
+    def traced_events(request_trace):
+        try:
+            messages = [{"role": "user", "content": f"user_id is '{user_id}' and user_input is '{user_input}'"}]
+            calls, pending = [], {}
+            # Start each tool as soon as the streamed completion has finished its arguments
+            for call, source in router.route_stream(user_input, messages):
+                yield sse_event("routing", {"tool": call["name"], "arguments": call["arguments"], "source": source})
+                future = dispatcher.submit(call)
+                calls.append((call, future))
+                if future is not None:
+                    pending[future] = (call, dispatcher.deadline(call))
+            if not calls:
+                raise ValueError("No tool call in response")
+
+            # Emit hits in completion order, an error for each call that runs out of time, then
+            # the summary in call order
+            results = {}
+            while pending:
+                timeout = max(0.0, min(deadline for _, deadline in pending.values()) - time.monotonic())
+                done, _ = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+                expired = [future for future, (_, deadline) in pending.items()
+                           if future not in done and deadline <= time.monotonic()]
+                for future in list(done) + expired:
+                    call, deadline = pending.pop(future)
+                    item = format_results([dispatcher.collect(call, future, deadline)])[0]
+                    results[future] = item
+                    if future in done:
+                        for rank, hit in enumerate(item.get("data", []), start=page["offset"] + 1):
+                            yield sse_event("hit", {"tool": item["tool"], "rank": rank, **hit})
+                    else:
+                        yield sse_event("error", {key: item[key] for key in ("tool", "arguments", "error", "status")})
+            ordered = [results[future] if future is not None else format_results([dispatcher.collect(call, None)])[0]
+                       for call, future in calls]
+            body, status = build_response(ordered)
+            if timings_requested(data):
+                body["timings"] = request_trace.as_dict()
+            inc("mcp_requests_total", endpoint="/mcp/stream", status=status)
+            with timer("serialize"):
+                summary = sse_event("summary" if status == 200 else "error", body)
+            yield summary
+        except Exception as e:
+            inc("mcp_requests_total", endpoint="/mcp/stream", status=500)
+            yield sse_event("error", {"error": str(e)})
+
+    return Response(stream_with_context(events()), mimetype="text/event-stream",
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+@app.route('/mcp/stats', methods=['GET'])
+def handle_stats():
+    return jsonify({"router": router.stats(), "endpoints": agent.endpoint_stats(), "indexes": manager.stats()})
+
+@app.route('/metrics', methods=['GET'])
+def handle_metrics():
+    return Response(render(), mimetype="text/plain; version=0.0.4")
 
 if __name__ == '__main__':
-    app.run(port=5000, debug=True)
+    # Load the embedding model once before serving so the first request doesn't pay for it
+    for model_name, seconds in warm_up(*os.getenv("WARM_UP_MODELS", "all-MiniLM-L6-v2").split(",")).items():
+        print(f"Warmed up {model_name} in {seconds:.2f}s")
+    try:
+        app.run(port=5000, debug=True)
+    finally:
+        # Stop index refresh threads before closing the shared MongoDB clients they use
+        reset_indexes()
+        close_all()
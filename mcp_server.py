@@ -7,12 +7,21 @@ Handles incoming client requests, processes them, and returns results.
 
 Usage:
     python mcp_server.py
+
+Endpoints:
+    POST /mcp          JSON response once all tools have finished
+    GET  /metrics      stage latency histograms, token and routing counters (Prometheus text format, see metrics.py)
+
+Requests with "timings": true (or every request with MCP_TIMINGS=true) get a per-stage timing
+breakdown under "timings" in the response.
 """
 
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, jsonify
+from metrics import inc, render, timings_requested, trace
 from openai_client import OpenAIClient
 from dotenv import load_dotenv
-import json
+from tool_dispatcher import ToolDispatcher, build_response
+from tool_router import create_router
 
 app = Flask(__name__)
 load_dotenv()
@@ -89,6 +98,21 @@ tools = [
     }
 ]
 
+# Example inputs and argument patterns for the local semantic router (enabled with SEMANTIC_ROUTER=true)
+exemplars = {
+    "find_report": ["Find the report on quarterly sales", "Get me the report about security audits"],
+    "find_course": ["Search courses about Python", "Are there any courses on MongoDB?"],
+    "find_engineers_by_skill": ["Find engineers skilled in Kubernetes", "Who knows Java?"],
+    "find_engineer_by_name": ["Find engineer Alice Wang", "Who is Bob Smith?"],
+}
+extractors = {
+    "find_report": r"report (?:on|about|for|called|titled|named)\s+(?P<title>.+?)\??$",
+    "find_course": r"courses? (?:on|about|for|titled|named)\s+(?P<title>.+?)\??$",
+    "find_engineers_by_skill": r"(?:skilled in|who knows|experts? (?:in|on)|engineers? (?:with|who know))\s+(?P<skill>.+?)\??$",
+    "find_engineer_by_name": r"(?:engineer|who is)\s+(?P<name>.+?)\??$",
+}
+router = create_router(agent, tools, exemplars, extractors)
+
 # === Tool Functions ===
 def find_report(title):
     return f"Found a report for {title}"
@@ -102,38 +126,38 @@ def find_engineers_by_skill(skill):
 def find_engineer_by_name(name):
     return f"Found engineer info for '{name}': Region: AMER, Skills: MongoDB, Python"
 
+# Every tool in the schema maps to the function of the same name above
+dispatcher = ToolDispatcher(tools, globals())
+
 @app.route('/mcp', methods=['POST'])
 def handle_mcp():
     data = request.get_json()
     user_input = data.get("input")
-    user_id = 'ken.chen' # Example user ID, replace with actual logic to get user ID
+    user_id = request.headers.get("X-User-ID") or data.get("user_id") or "anonymous"
     if not user_input:
         return jsonify({"error": "Missing input"}), 400
 
-    try:
-        messages = [{"role": "user", "content": f"user_id is '{user_id}' and user_input is '{user_input}'"}]
-        response = agent.get_response(messages, tools)
-        tool_call = response.choices[0].message.tool_calls[0]
-        print(f"Tool call: {tool_call}")
-        name = tool_call.function.name
-        args = json.loads(tool_call.function.arguments)
-
-        # Route to function
-        if name == "find_report":
-            result = find_report(**args)
-        elif name == "find_course":
-            result = find_course(**args)
-        elif name == "find_engineers_by_skill":
-            result = find_engineers_by_skill(**args)
-        elif name == "find_engineer_by_name":
-            result = find_engineer_by_name(**args)
-        else:
-            result = "Unknown tool"
-
-        return jsonify({"tool": name, "arguments": args, "result": result})
-
-    except Exception as e:
-        return jsonify({"error": str(e)}), 500
+    with trace() as request_trace:
+        try:
+            messages = [{"role": "user", "content": f"user_id is '{user_id}' and user_input is '{user_input}'"}]
+            calls, source = router.route(user_input, messages)
+            if not calls:
+                raise ValueError("No tool call in response")
+            print(f"Tool calls: {calls}")
+
+            # Run every requested tool concurrently
+            body, status = build_response(dispatcher.dispatch(calls))
+
+        except Exception as e:
+            body, status = {"error": str(e)}, 500
+        if timings_requested(data):
+            body["timings"] = request_trace.as_dict()
+        inc("mcp_requests_total", endpoint="/mcp", status=status)
+        return jsonify(body), status
+
+@app.route('/metrics', methods=['GET'])
+def handle_metrics():
+    return Response(render(), mimetype="text/plain; version=0.0.4")
 
 if __name__ == '__main__':
     app.run(port=5000, debug=True)
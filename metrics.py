@@ -0,0 +1,232 @@
+"""
+metrics.py
+@ken.chen
+
+Lightweight process-wide metrics and per-request tracing for the MCP servers, with no client
+library dependency. Request stages are timed with `timer(stage)`; each observation lands in the
+`mcp_stage_seconds` histogram and, while a request trace is active, in that request's timing
+breakdown. Counters (`inc`) carry token usage and cache hits the same way.
+
+    llm          OpenAIClient completions (including streamed ones, until the stream ends)
+    model_load   SentenceTransformer weight loading in the model registry
+    encode       model.encode for texts missing from the embedding cache
+    mongo        MongoDB round trips (hydration, rescoring fetches, text and Atlas searches)
+    score        scoring and top-k selection on the resident index
+    rerank       cross-encoder reranking of first-stage candidates (see reranker.py)
+    tool         each tool call, end to end
+    serialize    response body serialization
+
+`render()` formats everything in the Prometheus text exposition format for `GET /metrics`.
+Traces follow the request across threads when work is submitted through `in_context`; stages
+run for a coalesced batch are added to the trace of every request in the batch.
+
+Usage:
+    from metrics import timer, trace, render
+    with trace() as request_trace:
+        with timer("encode"):
+            ...
+    request_trace.as_dict()    # {"total_ms": 12.3, "stages_ms": {"encode": 11.9}, "counters": {}}
+
+Environment:
+    MCP_TIMINGS: set to "true" to add the timing breakdown to every response; otherwise a request
+        asks for it with "timings": true in its JSON body
+"""
+
+import bisect, contextvars, functools, os, threading, time
+from contextlib import contextmanager
+
+STAGE_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+HELP = {
+    "mcp_stage_seconds": ("histogram", "Time spent in each request stage"),
+    "mcp_llm_requests_total": ("counter", "LLM completions by outcome"),
+    "mcp_llm_tokens_total": ("counter", "LLM tokens used, by kind"),
+    "mcp_embedding_cache_total": ("counter", "Embedding cache lookups by result"),
+    "mcp_route_decisions_total": ("counter", "Tool routing decisions by source"),
+    "mcp_rerank_pairs_total": ("counter", "Reranked (query, candidate) pairs by result"),
+    "mcp_requests_total": ("counter", "MCP requests by endpoint and status"),
+}
+
+_trace = contextvars.ContextVar("mcp_trace", default=None)
+
+class Histogram:
+    def __init__(self, buckets: tuple = STAGE_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+class Registry:
+    """
+    Thread-safe histograms and counters keyed by metric name and label set.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._histograms = {}
+        self._counters = {}
+
+    def observe(self, name: str, value: float, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = Histogram()
+            histogram.observe(value)
+
+    def inc(self, name: str, amount: float = 1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + amount
+
+    def snapshot(self) -> dict:
+        """
+        Counter values and histogram count/sum per metric, keyed like the exposition format.
+        """
+        with self._lock:
+            result = {_series(name, labels): value for (name, labels), value in self._counters.items()}
+            for (name, labels), histogram in self._histograms.items():
+                result[_series(f"{name}_count", labels)] = histogram.count
+                result[_series(f"{name}_sum", labels)] = histogram.sum
+        return result
+
+    def render(self) -> str:
+        """
+        Formats every metric in the Prometheus text exposition format (version 0.0.4).
+        """
+        with self._lock:
+            histograms = {key: (list(h.counts), h.sum, h.count, h.buckets) for key, h in self._histograms.items()}
+            counters = dict(self._counters)
+        lines, described = [], set()
+
+        def describe(name, kind):
+            if name not in described:
+                described.add(name)
+                lines.append(f"# HELP {name} {HELP.get(name, (kind, name))[1]}")
+                lines.append(f"# TYPE {name} {kind}")
+
+        for (name, labels), (counts, total, count, buckets) in sorted(histograms.items()):
+            describe(name, "histogram")
+            cumulative = 0
+            for bound, bucket in zip(buckets + (float("inf"),), counts):
+                cumulative += bucket
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                lines.append(f"{_series(name + '_bucket', labels + (('le', le),))} {cumulative}")
+            lines.append(f"{_series(name + '_sum', labels)} {total}")
+            lines.append(f"{_series(name + '_count', labels)} {count}")
+        for (name, labels), value in sorted(counters.items()):
+            describe(name, "counter")
+            lines.append(f"{_series(name, labels)} {value}")
+        return "\n".join(lines) + "\n"
+
+    def reset(self):
+        with self._lock:
+            self._histograms.clear()
+            self._counters.clear()
+
+def _series(name: str, labels: tuple) -> str:
+    if not labels:
+        return name
+    escaped = (str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, value in labels)
+    return name + "{" + ",".join(f'{key}="{value}"' for (key, _), value in zip(labels, escaped)) + "}"
+
+class Trace:
+    """
+    Per-request timing breakdown: seconds per stage and counter totals, safe to update from
+    the threads a request fans out to.
+    """
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.stages = {}
+        self.counters = {}
+        self._lock = threading.Lock()
+
+    def add(self, stage: str, seconds: float):
+        with self._lock:
+            self.stages[stage] = self.stages.get(stage, 0.0) + seconds
+
+    def count(self, name: str, amount: float = 1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + amount
+
+    def merge(self, other: "Trace"):
+        with other._lock:
+            stages, counters = dict(other.stages), dict(other.counters)
+        for stage, seconds in stages.items():
+            self.add(stage, seconds)
+        for name, amount in counters.items():
+            self.count(name, amount)
+
+    def as_dict(self) -> dict:
+        with self._lock:
+            return {"total_ms": round(1000 * (time.perf_counter() - self.started), 3),
+                    "stages_ms": {stage: round(1000 * seconds, 3) for stage, seconds in self.stages.items()},
+                    "counters": dict(self.counters)}
+
+registry = Registry()
+
+def current_trace() -> Trace:
+    return _trace.get()
+
+@contextmanager
+def trace():
+    """
+    Starts a request trace for the current context and yields it.
+    """
+    request_trace = Trace()
+    token = _trace.set(request_trace)
+    try:
+        yield request_trace
+    finally:
+        _trace.reset(token)
+
+def observe(stage: str, seconds: float):
+    registry.observe("mcp_stage_seconds", seconds, stage=stage)
+    request_trace = _trace.get()
+    if request_trace is not None:
+        request_trace.add(stage, seconds)
+
+@contextmanager
+def timer(stage: str):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(stage, time.perf_counter() - start)
+
+def inc(name: str, amount: float = 1, **labels):
+    """
+    Increments a counter; the active trace counts it as e.g. "llm_tokens_prompt".
+    """
+    if not amount:
+        return
+    registry.inc(name, amount, **labels)
+    request_trace = _trace.get()
+    if request_trace is not None:
+        short = name.removeprefix("mcp_").removesuffix("_total")
+        request_trace.count("_".join([short, *(str(value) for _, value in sorted(labels.items()))]), amount)
+
+def in_context(fn):
+    """
+    Binds `fn` to a copy of the current context, so a thread pool running it keeps the caller's trace.
+    """
+    return functools.partial(contextvars.copy_context().run, fn)
+
+def record_usage(response):
+    """
+    Counts the prompt and completion tokens of an OpenAI response.
+    """
+    usage = getattr(response, "usage", None)
+    for kind in ("prompt", "completion"):
+        amount = getattr(usage, f"{kind}_tokens", None)
+        if isinstance(amount, int):
+            inc("mcp_llm_tokens_total", amount, kind=kind)
+
+def timings_requested(data: dict) -> bool:
+    return bool(data.get("timings")) or os.getenv("MCP_TIMINGS", "false").lower() == "true"
+
+def render() -> str:
+    return registry.render()
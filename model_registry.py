@@ -0,0 +1,158 @@
+"""
+model_registry.py
+@ken.chen
+
+Keeps a process-wide, thread-safe registry of SentenceTransformer models (and the
+CrossEncoder rerankers of reranker.py) keyed by (model name, device). Models load lazily on first use and are reused by every caller,
+so servers stop paying the weight-loading cost on each request. Query encoders of the optimized
+backends of encoder_backends.py are kept apart from the stock model under (model name, device, backend),
+and cross-encoders under (model name, device, max_length). Cross-encoders live in a registry of their
+own with a separate cap, so reranking never evicts a query encoder (or the other way round) and
+neither reloads its weights on every request.
+
+Usage:
+    from model_registry import get_model, warm_up
+    warm_up()                        # preload the default model at server start
+    model = get_model()              # all-MiniLM-L6-v2 on cuda if available, else cpu
+    encoder = get_model(backend="int8")   # FastEncoder over an int8-quantized copy
+    reranker = get_cross_encoder("cross-encoder/ms-marco-MiniLM-L-6-v2", max_length=128)
+
+    python model_registry.py all-MiniLM-L6-v2 --device cpu
+
+Environment:
+    MODEL_REGISTRY_MAX_MODELS: maximum number of resident encoder models (default: 2)
+    MODEL_REGISTRY_MAX_RERANKERS: maximum number of resident cross-encoders (default: 2)
+    ENCODER_BACKEND: backend warm_up loads for query encoding (see encoder_backends.py, default: torch)
+"""
+
+import argparse, os, threading, time
+from collections import OrderedDict
+from functools import partial
+from sentence_transformers import CrossEncoder, SentenceTransformer
+import torch
+from encoder_backends import BACKENDS, encoder_device, load_encoder, query_backend
+from metrics import timer
+
+DEFAULT_MODEL = "all-MiniLM-L6-v2"
+
+def default_device() -> str:
+    return "cuda" if torch.cuda.is_available() else "cpu"
+
+class ModelRegistry:
+    """
+    Caches loaded models and evicts the least recently used one once more than
+    `max_models` are resident, so memory stays bounded when several models are configured.
+    """
+    def __init__(self, max_models: int = None):
+        self.max_models = max_models or int(os.getenv("MODEL_REGISTRY_MAX_MODELS", "2"))
+        self._models = OrderedDict()
+        self._lock = threading.Lock()
+        self._key_locks = {}
+
+    def get(self, name: str = DEFAULT_MODEL, device: str = None, loader=None, variant: str = None) -> SentenceTransformer:
+        """
+        Returns the resident model, loading it with `loader(name, device=...)` (default:
+        SentenceTransformer) on first use. Loads of the same name and device through different
+        loaders are told apart by `variant`.
+        """
+        key = (name, device or default_device()) + ((variant,) if variant else ())
+        with self._lock:
+            if key in self._models:
+                self._models.move_to_end(key)
+                return self._models[key]
+            key_lock = self._key_locks.setdefault(key, threading.Lock())
+
+        # Load outside the registry lock so other models stay available meanwhile
+        with key_lock:
+            with self._lock:
+                if key in self._models:
+                    self._models.move_to_end(key)
+                    return self._models[key]
+            with timer("model_load"):
+                model = (loader or SentenceTransformer)(key[0], device=key[1])
+            with self._lock:
+                self._models[key] = model
+                while len(self._models) > self.max_models:
+                    evicted, _ = self._models.popitem(last=False)
+                    self._key_locks.pop(evicted, None)
+                    print(f"Evicted model {evicted[0]} ({', '.join(evicted[1:])}) from registry")
+        return model
+
+    def warm_up(self, names: list = None, device: str = None, backend: str = "torch") -> dict:
+        """
+        Loads the given models (default: all-MiniLM-L6-v2) for `backend` and returns the load
+        time in seconds for each one.
+        """
+        timings = {}
+        for name in names or [DEFAULT_MODEL]:
+            start = time.perf_counter()
+            if backend == "torch":
+                self.get(name, device)
+            else:
+                self.get(name, encoder_device(backend, device), partial(load_encoder, backend=backend), variant=backend)
+            timings[name] = time.perf_counter() - start
+        return timings
+
+    def evict(self, name: str, device: str = None) -> bool:
+        """
+        Unloads a model from the registry, every backend included. Without a device, every device copy is removed.
+        """
+        with self._lock:
+            keys = [key for key in self._models if key[0] == name and (device is None or key[1] == device)]
+            for key in keys:
+                del self._models[key]
+                self._key_locks.pop(key, None)
+        if keys and torch.cuda.is_available():
+            torch.cuda.empty_cache()
+        return bool(keys)
+
+    def clear(self):
+        with self._lock:
+            self._models.clear()
+            self._key_locks.clear()
+        if torch.cuda.is_available():
+            torch.cuda.empty_cache()
+
+    def loaded(self) -> list:
+        with self._lock:
+            return list(self._models.keys())
+
+_registry = ModelRegistry()
+_rerankers = ModelRegistry(int(os.getenv("MODEL_REGISTRY_MAX_RERANKERS", "2")))
+
+def get_registry() -> ModelRegistry:
+    return _registry
+
+def get_model(name: str = DEFAULT_MODEL, device: str = None, backend: str = "torch") -> SentenceTransformer:
+    """
+    Returns the shared encoder of `name` for `backend` (see encoder_backends.BACKENDS). Optimized
+    backends return a FastEncoder, which encodes like a SentenceTransformer.
+    """
+    if backend == "torch":
+        return _registry.get(name, device)
+    return _registry.get(name, encoder_device(backend, device), partial(load_encoder, backend=backend), variant=backend)
+
+def get_cross_encoder(name: str, device: str = None, max_length: int = None) -> CrossEncoder:
+    """
+    Returns a shared CrossEncoder; pairs longer than `max_length` tokens are truncated. Each
+    max_length gets its own copy, since it is fixed when the model loads.
+    """
+    return _rerankers.get(name, device, partial(CrossEncoder, max_length=max_length),
+                          variant=f"max_length={max_length}")
+
+def warm_up(*names, device: str = None, backend: str = None) -> dict:
+    return _registry.warm_up(list(names) or None, device, backend or query_backend())
+
+def evict_model(name: str, device: str = None) -> bool:
+    evicted = _registry.evict(name, device)
+    return _rerankers.evict(name, device) or evicted
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Preload sentence-transformers models and report load times")
+    parser.add_argument("models", nargs="*", default=[DEFAULT_MODEL], help="Model names to load")
+    parser.add_argument("--device", help="Device to load models on (default: cuda if available, else cpu)")
+    parser.add_argument("--backend", choices=BACKENDS, help="Encoder backend (default: env ENCODER_BACKEND or torch)")
+    args = parser.parse_args()
+
+    for name, seconds in warm_up(*args.models, device=args.device, backend=args.backend).items():
+        print(f"Loaded {name} in {seconds:.2f}s")
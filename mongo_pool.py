@@ -0,0 +1,122 @@
+"""
+mongo_pool.py
+@ken.chen
+
+Hands out one process-wide MongoClient per connection URI so callers share a connection pool
+instead of opening (and leaking) a new one, with TLS handshakes and topology discovery, on
+every call. Clients are discarded in forked children, which must not reuse the parent's
+sockets, and closed at interpreter exit. Caches of objects bound to the parent's clients (such
+as resident indexes and their cursors) register with `after_fork` to be dropped at the same time.
+
+Usage:
+    from mongo_pool import get_client
+    collection = get_client(mongo_url)["testdb"]["ag_news"]
+
+    # asyncio servers
+    from mongo_pool import get_async_client
+    collection = get_async_client(mongo_url)["testdb"]["ag_news"]
+
+Environment:
+    MONGO_MAX_POOL_SIZE: connections per server (default: 100)
+    MONGO_MIN_POOL_SIZE: idle connections kept open (default: 0)
+    MONGO_CONNECT_TIMEOUT_MS: connect timeout (default: 5000)
+    MONGO_SERVER_SELECTION_TIMEOUT_MS: server selection timeout (default: 10000)
+    MONGO_SOCKET_TIMEOUT_MS: socket read timeout (default: none)
+"""
+
+import atexit, os, threading
+from pymongo import AsyncMongoClient, MongoClient
+
+_clients = {}
+_async_clients = {}
+_lock = threading.Lock()
+_pid = os.getpid()
+_fork_callbacks = []
+
+def after_fork(callback):
+    """
+    Registers `callback()` to run in a forked child when the parent's clients are discarded.
+    """
+    _fork_callbacks.append(callback)
+    return callback
+
+def _forget_parent():
+    _clients.clear()
+    _async_clients.clear()
+    for callback in _fork_callbacks:
+        callback()
+
+def client_options() -> dict:
+    options = {
+        "maxPoolSize": int(os.getenv("MONGO_MAX_POOL_SIZE", "100")),
+        "minPoolSize": int(os.getenv("MONGO_MIN_POOL_SIZE", "0")),
+        "connectTimeoutMS": int(os.getenv("MONGO_CONNECT_TIMEOUT_MS", "5000")),
+        "serverSelectionTimeoutMS": int(os.getenv("MONGO_SERVER_SELECTION_TIMEOUT_MS", "10000")),
+    }
+    if os.getenv("MONGO_SOCKET_TIMEOUT_MS"):
+        options["socketTimeoutMS"] = int(os.getenv("MONGO_SOCKET_TIMEOUT_MS"))
+    return options
+
+def _check_fork():
+    global _pid
+    if _pid != os.getpid():
+        # Forked child: the parent's clients are unusable here, start over without closing them
+        _pid = os.getpid()
+        _forget_parent()
+
+def get_client(mongo_url: str, **options) -> MongoClient:
+    """
+    Returns the shared client for `mongo_url`, creating it on first use. Keyword arguments
+    override the environment-configured pool options when the client is created.
+    """
+    with _lock:
+        _check_fork()
+        client = _clients.get(mongo_url)
+        if client is None:
+            client = MongoClient(mongo_url, **{**client_options(), **options})
+            _clients[mongo_url] = client
+        return client
+
+def get_async_client(mongo_url: str, **options) -> AsyncMongoClient:
+    """
+    Returns the shared asyncio client for `mongo_url`. Async clients bind to the event loop
+    that first uses them, so they are meant for a single-loop server process.
+    """
+    with _lock:
+        _check_fork()
+        client = _async_clients.get(mongo_url)
+        if client is None:
+            client = AsyncMongoClient(mongo_url, **{**client_options(), **options})
+            _async_clients[mongo_url] = client
+        return client
+
+async def close_all_async():
+    with _lock:
+        clients = list(_async_clients.values())
+        _async_clients.clear()
+    for client in clients:
+        await client.close()
+
+def close_client(mongo_url: str):
+    with _lock:
+        client = _clients.pop(mongo_url, None)
+    if client is not None:
+        client.close()
+
+def close_all():
+    with _lock:
+        clients = list(_clients.values())
+        _clients.clear()
+    for client in clients:
+        client.close()
+
+def _after_fork_in_child():
+    global _lock, _pid
+    # The lock may have been held by another parent thread at fork time
+    _lock = threading.Lock()
+    _pid = os.getpid()
+    _forget_parent()
+
+atexit.register(close_all)
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_after_fork_in_child)
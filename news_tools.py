@@ -0,0 +1,149 @@
+"""
+news_tools.py
+@ken.chen
+
+Tool schema, semantic router exemplars and response formatting shared by the news servers
+(mcp_news_server.py and mcp_news_async_server.py).
+
+A request chooses what each search returns with optional body fields: "fields" (any of id, text,
+label, score; default text, label and score), "limit" (results per search, default 5) and "offset"
+(results to skip, for pagination). Search results carry "next_offset" when a further page may exist.
+"rerank": true re-scores the top candidates with a cross-encoder (see reranker.py).
+Responses are encoded with orjson when it is installed, and the standard json module otherwise.
+
+Environment:
+    MCP_MAX_RESULTS: upper bound on offset + limit (default: 1000)
+    RERANK_RESULTS: set to "true" to rerank every request that does not set "rerank" (default: false)
+"""
+
+import contextvars, json, os
+from contextlib import contextmanager
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# AG News labels as stored by load_data.py
+CATEGORIES = {"World": 0, "Sports": 1, "Business": 2, "Sci/Tech": 3}
+
+tools = [
+    {
+        "type": "function",
+        "function": {
+            "name": "find_headline_report",
+            "description": "Find a report related to a user's input",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "headline": {
+                        "type": "string",
+                        "description": "The news headline or topic to search for"
+                    },
+                    "category": {
+                        "type": "string",
+                        "enum": list(CATEGORIES),
+                        "description": "Only search news in this category, when the user asks for one"
+                    }
+                },
+                "required": ["headline"]
+            }
+        }
+    }
+]
+
+RESPONSE_FIELDS = ("id", "text", "label", "score")
+DEFAULT_PAGE = {"fields": ("text", "label", "score"), "offset": 0, "limit": 5, "rerank": False}
+
+_page = contextvars.ContextVar("page", default=None)
+
+# Example inputs for the local semantic router (enabled with SEMANTIC_ROUTER=true)
+exemplars = {
+    "find_headline_report": [
+        "Find news about the stock market",
+        "Any reports on the election?",
+        "Latest headlines about football",
+        "What is happening with oil prices",
+        "Show me technology news",
+    ]
+}
+
+def category_filter(category: str = None):
+    """
+    Metadata filter for a tool's `category` argument, or None to search every category.
+    """
+    if not category:
+        return None
+    if category not in CATEGORIES:
+        raise ValueError(f"Unknown category '{category}', expected one of {list(CATEGORIES)}")
+    return {"label": CATEGORIES[category]}
+
+def page_options(data: dict) -> dict:
+    """
+    Reads the "fields", "offset", "limit" and "rerank" of a request body. Raises ValueError when they are invalid.
+    """
+    fields = data.get("fields") or DEFAULT_PAGE["fields"]
+    if isinstance(fields, str):
+        fields = fields.split(",")
+    if not isinstance(fields, (list, tuple)):
+        raise ValueError("fields must be a list or a comma-separated string")
+    unknown = [field for field in fields if not isinstance(field, str) or field not in RESPONSE_FIELDS]
+    if unknown:
+        raise ValueError(f"Unknown fields {unknown}, expected some of {list(RESPONSE_FIELDS)}")
+    try:
+        offset = int(data.get("offset", DEFAULT_PAGE["offset"]))
+        limit = int(data.get("limit", DEFAULT_PAGE["limit"]))
+    except (TypeError, ValueError):
+        raise ValueError("offset and limit must be integers")
+    max_results = int(os.getenv("MCP_MAX_RESULTS", "1000"))
+    if offset < 0 or limit < 1 or offset + limit > max_results:
+        raise ValueError(f"Expected offset >= 0, limit >= 1 and offset + limit <= {max_results}")
+    rerank = data.get("rerank", os.getenv("RERANK_RESULTS", "false"))
+    if isinstance(rerank, str) and rerank.lower() in ("true", "false"):
+        rerank = rerank.lower() == "true"
+    if not isinstance(rerank, bool):
+        raise ValueError("rerank must be true or false")
+    return {"fields": tuple(dict.fromkeys(fields)), "offset": offset, "limit": limit, "rerank": rerank}
+
+def current_page() -> dict:
+    return _page.get() or DEFAULT_PAGE
+
+@contextmanager
+def use_page(page: dict):
+    token = _page.set(page)
+    try:
+        yield page
+    finally:
+        _page.reset(token)
+
+def format_results(results: list) -> list:
+    """
+    Shapes dispatcher results like the original news response: headlines under "data"
+    and the tool name as "result", plus "next_offset" when the page of headlines is full.
+    """
+    page = current_page()
+    formatted = []
+    for item in results:
+        item = dict(item)
+        if "result" in item:
+            known = item["result"] != "Unknown tool"
+            item["data"] = item["result"] if known else []
+            item["result"] = item["tool"] if known else item["result"]
+            if known and isinstance(item["data"], list) and len(item["data"]) >= page["limit"]:
+                item["next_offset"] = page["offset"] + page["limit"]
+        formatted.append(item)
+    return formatted
+
+def dumps(data) -> bytes:
+    """
+    Encodes a response body as compact JSON; values JSON has no type for (e.g. ObjectId) become strings.
+    """
+    if orjson is not None:
+        return orjson.dumps(data, default=str, option=orjson.OPT_SERIALIZE_NUMPY)
+    return json.dumps(data, default=str, separators=(",", ":")).encode()
+
+def sse_event(event: str, data) -> str:
+    """
+    Encodes one Server-Sent Events message, with the data encoded like a response body by `dumps`.
+    """
+    return f"event: {event}\ndata: {dumps(data).decode()}\n\n"
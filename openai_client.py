@@ -4,51 +4,207 @@ openai_client.py
 
 Provides a unified client for querying OpenAI or Azure OpenAI models.
 Handles environment configuration, prompt building, and chat completion requests.
+Requests go through a per-deployment RateLimitScheduler (rate_limiter.py) that paces them
+within the RPM/TPM budgets, caps concurrency and retries 429/5xx responses with backoff.
+With OPENAI_ENDPOINTS set, requests are spread over a pool of OpenAI and Azure OpenAI
+deployments (endpoint_pool.py) with circuit breaking and failover.
 
 Usage:
     # Example usage in your own script:
     from openai_client import OpenAIClient
     client = OpenAIClient()
     response = client.get_response([{"role": "user", "content": "Hello"}])
+    response = await client.get_response_async([{"role": "user", "content": "Hello"}])
+    for tool_call in client.stream_tool_calls(messages, tools):
+        ...
+    print(client.endpoint_stats())
+
+Environment:
+    USE_AZURE_OPENAI, AZURE_OPENAI_ENDPOINT, AZURE_OPENAI_API_KEY, OPENAI_API_KEY: single endpoint
+    AZURE_OPENAI_API_VERSION: Azure API version (default: 2024-12-01-preview)
+    OPENAI_ENDPOINTS: JSON list of endpoints replacing the single one, e.g.
+        [{"name": "east", "type": "azure", "endpoint": "https://east.openai.azure.com/",
+          "api_key_env": "AZURE_EAST_KEY", "model": "gpt-4o", "weight": 2, "rpm": 300, "tpm": 60000},
+         {"name": "openai", "type": "openai", "api_key_env": "OPENAI_API_KEY", "model": "gpt-4o"}]
 """
 
 import os
 import dotenv
 import argparse
-from openai import OpenAI
-from openai.lib.azure import AzureOpenAI
+import json
+import time
+from contextlib import closing
+from openai import AsyncOpenAI, OpenAI
+from openai.lib.azure import AsyncAzureOpenAI, AzureOpenAI
 from typing import List
+from endpoint_pool import Endpoint, EndpointPool
+from metrics import inc, observe, record_usage, timer
+from rate_limiter import RateLimitScheduler, create_scheduler, estimate_tokens
+
+DEFAULT_API_VERSION = "2024-12-01-preview"
+
+def endpoint_configs(model: str = None) -> list:
+    """
+    Endpoint settings from OPENAI_ENDPOINTS, or the single endpoint described by
+    USE_AZURE_OPENAI and its credentials.
+    """
+    if os.getenv("OPENAI_ENDPOINTS"):
+        configs = json.loads(os.getenv("OPENAI_ENDPOINTS"))
+        return [{**config, "model": config.get("model") or model} for config in configs]
+    if os.getenv("USE_AZURE_OPENAI", "false").lower() == "true":
+        if not os.getenv("AZURE_OPENAI_ENDPOINT") or not os.getenv("AZURE_OPENAI_API_KEY"):
+            raise ValueError("Environment variables AZURE_OPENAI_ENDPOINT and AZURE_OPENAI_API_KEY must be set.")
+        return [{"name": "azure", "type": "azure", "endpoint": os.getenv("AZURE_OPENAI_ENDPOINT"),
+                 "api_key_env": "AZURE_OPENAI_API_KEY", "model": model or "gpt-35-turbo"}]
+    if not os.getenv("OPENAI_API_KEY"):
+        raise ValueError("Environment variable OPENAI_API_KEY must be set.")
+    return [{"name": "openai", "type": "openai", "api_key_env": "OPENAI_API_KEY", "model": model or "gpt-4o"}]
+
+def create_endpoint(config: dict) -> Endpoint:
+    """
+    Builds an Endpoint with its SDK clients and scheduler from one endpoint config.
+    Retries are owned by the scheduler, so the SDK clients are created with max_retries=0.
+    """
+    kind = config.get("type", "openai")
+    api_key = config.get("api_key") or os.getenv(config.get("api_key_env", ""), "")
+    if not api_key:
+        raise ValueError(f"No API key for endpoint '{config.get('name')}'")
+    if kind == "azure":
+        options = dict(api_version=config.get("api_version") or os.getenv("AZURE_OPENAI_API_VERSION", DEFAULT_API_VERSION),
+                       azure_endpoint=config["endpoint"], api_key=api_key, max_retries=0)
+        client, async_factory = AzureOpenAI(**options), lambda: AsyncAzureOpenAI(**options)
+    else:
+        options = dict(api_key=api_key, max_retries=0)
+        if config.get("endpoint"):
+            options["base_url"] = config["endpoint"]
+        client, async_factory = OpenAI(**options), lambda: AsyncOpenAI(**options)
+    model = config["model"]
+    if "rpm" in config or "tpm" in config:
+        scheduler = RateLimitScheduler(config.get("rpm"), config.get("tpm"),
+                                       config.get("max_concurrency", int(os.getenv("OPENAI_MAX_CONCURRENCY", "16"))),
+                                       int(os.getenv("OPENAI_MAX_RETRIES", "4")))
+    else:
+        scheduler = create_scheduler(model)
+    return Endpoint(config.get("name", model), model, client, async_factory, float(config.get("weight", 1.0)),
+                    scheduler, int(os.getenv("OPENAI_CIRCUIT_FAILURES", "5")),
+                    float(os.getenv("OPENAI_CIRCUIT_COOLDOWN", "30")), kind)
 
 class OpenAIClient:
-    def __init__(self, model: str = None):
-        self.use_azure = os.getenv("USE_AZURE_OPENAI", "false").lower() == "true"
-        self.model = model or ("gpt-35-turbo" if self.use_azure else "gpt-4o")
-        if self.use_azure:
-            if not os.getenv("AZURE_OPENAI_ENDPOINT") or not os.getenv("AZURE_OPENAI_API_KEY"):
-                raise ValueError("Environment variables AZURE_OPENAI_ENDPOINT and AZURE_OPENAI_API_KEY must be set.")
-            self.client = AzureOpenAI(
-                api_version="2024-12-01-preview",
-                azure_endpoint=os.getenv("AZURE_OPENAI_ENDPOINT"),
-                api_key=os.getenv("AZURE_OPENAI_API_KEY"),
-            )
-        else:
-            if not os.getenv("OPENAI_API_KEY"):
-                raise ValueError("Environment variable OPENAI_API_KEY must be set.")
-            self.client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+    def __init__(self, model: str = None, endpoints: list = None, strategy: str = None):
+        """
+        Args:
+            model (str): Model (or Azure deployment) for endpoints that don't name one.
+            endpoints (list): Endpoint objects; built from the environment when omitted.
+            strategy (str): "least_outstanding" or "latency" (default: env OPENAI_ROUTING).
+        """
+        self.pool = EndpointPool(endpoints or [create_endpoint(config) for config in endpoint_configs(model)],
+                                 strategy or os.getenv("OPENAI_ROUTING", "least_outstanding"))
+        primary = self.pool.endpoints[0]
+        self.use_azure = primary.kind == "azure"
+        self.model = primary.model
+        self.client = primary.client
+        self.scheduler = primary.scheduler
+
+    @property
+    def async_client(self):
+        """
+        The asyncio client for the primary endpoint, created on first use.
+        """
+        return self.pool.endpoints[0].async_client
+
+    def _backend(self) -> str:
+        kinds = {endpoint.kind for endpoint in self.pool.endpoints}
+        return "Azure OpenAI" if kinds == {"azure"} else "OpenAI" if kinds == {"openai"} else "OpenAI/Azure OpenAI"
+
+    def _request(self, messages: list, tools: List, max_tokens: int) -> dict:
+        return dict(
+            messages=messages,
+            max_tokens=max_tokens,
+            temperature=0.0,
+            top_p=1.0,
+            model=self.model,
+            tools=tools,
+            tool_choice="auto" if tools else None,
+        )
 
     def get_response(self, messages: list, tools: List = None, max_tokens: int = 1024):
         try:
-            return self.client.chat.completions.create(
-                messages=messages,
-                max_tokens=max_tokens,
-                temperature=0.0,
-                top_p=1.0,
-                model=self.model,
-                tools=tools,
-                tool_choice="auto" if tools else None,
-            )
+            request = self._request(messages, tools, max_tokens)
+            with timer("llm"):
+                response = self.pool.call(lambda endpoint: endpoint.client.chat.completions.create(**{**request, "model": endpoint.model}),
+                                          estimate_tokens(messages, tools, max_tokens))
+            _record(response)
+            return response
+        except Exception as e:
+            inc("mcp_llm_requests_total", outcome="error")
+            raise RuntimeError(f"Failed to get response from {self._backend()}: {e}")
+
+    def stream_tool_calls(self, messages: list, tools: List = None, max_tokens: int = 1024):
+        """
+        Streams a completion (`stream=True`) and assembles tool-call arguments incrementally.
+        Each tool call is yielded as {"name", "arguments"} as soon as its arguments are complete,
+        i.e. when the next tool call starts or the stream ends, so callers can start work before
+        the whole completion has arrived.
+        """
+        try:
+            request = self._request(messages, tools, max_tokens)
+            start = time.perf_counter()
+            # The request keeps its scheduler slot until the stream is exhausted or closed
+            stream = self.pool.stream(lambda endpoint: endpoint.client.chat.completions.create(
+                                          stream=True, stream_options={"include_usage": True},
+                                          **{**request, "model": endpoint.model}),
+                                      estimate_tokens(messages, tools, max_tokens))
+            pending, usage = {}, None
+            with closing(stream):
+                for chunk in stream:
+                    # With include_usage the last chunk carries the usage of the whole completion
+                    usage = chunk if getattr(chunk, "usage", None) is not None else usage
+                    if not chunk.choices:
+                        continue
+                    for delta in chunk.choices[0].delta.tool_calls or []:
+                        if delta.index not in pending:
+                            # A new index means every earlier tool call is complete
+                            for index in sorted(i for i in pending if i < delta.index):
+                                yield _finish_tool_call(pending.pop(index))
+                            pending[delta.index] = {"name": "", "arguments": ""}
+                        if delta.function and delta.function.name:
+                            pending[delta.index]["name"] += delta.function.name
+                        if delta.function and delta.function.arguments:
+                            pending[delta.index]["arguments"] += delta.function.arguments
+            # From the request until the stream has ended
+            observe("llm", time.perf_counter() - start)
+            _record(usage)
+            for index in sorted(pending):
+                yield _finish_tool_call(pending.pop(index))
+        except Exception as e:
+            inc("mcp_llm_requests_total", outcome="error")
+            raise RuntimeError(f"Failed to get response from {self._backend()}: {e}")
+
+    async def get_response_async(self, messages: list, tools: List = None, max_tokens: int = 1024):
+        try:
+            request = self._request(messages, tools, max_tokens)
+            with timer("llm"):
+                response = await self.pool.call_async(
+                    lambda endpoint: endpoint.async_client.chat.completions.create(**{**request, "model": endpoint.model}),
+                    estimate_tokens(messages, tools, max_tokens))
+            _record(response)
+            return response
         except Exception as e:
-            raise RuntimeError(f"Failed to get response from {'Azure OpenAI' if self.use_azure else 'OpenAI'}: {e}")
+            inc("mcp_llm_requests_total", outcome="error")
+            raise RuntimeError(f"Failed to get response from {self._backend()}: {e}")
+
+    def endpoint_stats(self) -> dict:
+        """
+        Per-endpoint routing state, latency and error counts.
+        """
+        return self.pool.stats()
+
+def _record(response):
+    inc("mcp_llm_requests_total", outcome="ok")
+    record_usage(response)
+
+def _finish_tool_call(call: dict) -> dict:
+    return {"name": call["name"], "arguments": json.loads(call["arguments"] or "{}")}
 
 def build_prompt(place: str = "Taiwan") -> str:
     return f"I will be visiting {place} in summer and I want to know more about the local culture.\n"
@@ -0,0 +1,96 @@
+"""
+parallel_encoder.py
+@ken.chen
+
+Shards embedding generation across a pool of worker processes so CPU-only ingestion boxes use
+every core. Each worker loads its own model instance with a fixed torch thread count; shards are
+returned in submission order, so the output matches a single `model.encode(texts)` call row for row.
+
+Usage:
+    from parallel_encoder import ParallelEncoder
+    with ParallelEncoder(workers=8, torch_threads=1) as encoder:
+        embeddings = encoder.encode(texts, batch_size=64)
+        print(encoder.report())
+    # the pool is closed on exit, or terminated when encoding raised
+
+    python load_data.py --workers 8 --torch_threads 1
+"""
+
+import multiprocessing, os, time
+import numpy as np
+
+_worker_model = None
+
+def _init_worker(model_name: str, torch_threads: int):
+    global _worker_model
+    import torch
+    torch.set_num_threads(torch_threads)
+    from model_registry import get_model
+    _worker_model = get_model(model_name, "cpu")
+
+def _encode_shard(task: tuple) -> tuple:
+    texts, batch_size, options = task
+    start = time.perf_counter()
+    embeddings = _worker_model.encode(texts, batch_size=batch_size, **{"convert_to_numpy": True, **options})
+    return os.getpid(), np.asarray(embeddings, dtype=np.float32), time.perf_counter() - start
+
+class ParallelEncoder:
+    def __init__(self, workers: int = None, torch_threads: int = 1, model_name: str = "all-MiniLM-L6-v2",
+                 shard_size: int = 256):
+        """
+        Args:
+            workers (int): Number of worker processes (default: CPU count // torch_threads).
+            torch_threads (int): Intra-op torch threads per worker.
+            model_name (str): Sentence-transformers model each worker loads.
+            shard_size (int): Texts sent to a worker per task.
+        """
+        self.torch_threads = max(1, torch_threads)
+        self.workers = workers or max(1, (os.cpu_count() or 1) // self.torch_threads)
+        self.shard_size = shard_size
+        # Spawn rather than fork: forked children inherit torch's thread pools in an unusable state
+        context = multiprocessing.get_context("spawn")
+        self._pool = context.Pool(self.workers, initializer=_init_worker, initargs=(model_name, self.torch_threads))
+        self._stats = {}
+
+    def encode(self, texts: list, batch_size: int = 32, **kwargs) -> np.ndarray:
+        """
+        Encodes texts across the worker pool and returns a float32 matrix in input order. Other
+        keyword arguments (e.g. normalize_embeddings) are passed to each worker's `model.encode`.
+        """
+        texts = list(texts)
+        tasks = [(texts[i:i + self.shard_size], batch_size, kwargs) for i in range(0, len(texts), self.shard_size)]
+        shards = []
+        for pid, embeddings, seconds in self._pool.imap(_encode_shard, tasks):
+            docs, busy = self._stats.get(pid, (0, 0.0))
+            self._stats[pid] = (docs + len(embeddings), busy + seconds)
+            shards.append(embeddings)
+        if not shards:
+            return np.empty((0, 0), dtype=np.float32)
+        return np.vstack(shards)
+
+    def report(self) -> dict:
+        """
+        Returns docs encoded and docs/sec of busy time for each worker process.
+        """
+        return {pid: {"docs": docs, "docs_per_sec": docs / seconds if seconds else 0.0}
+                for pid, (docs, seconds) in sorted(self._stats.items())}
+
+    def close(self):
+        self._pool.close()
+        self._pool.join()
+
+    def terminate(self):
+        """
+        Stops the workers without waiting for queued shards, e.g. after a failed encode.
+        """
+        self._pool.terminate()
+        self._pool.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, *exc):
+        if exc_type is None:
+            self.close()
+        else:
+            self.terminate()
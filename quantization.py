@@ -0,0 +1,258 @@
+"""
+quantization.py
+@ken.chen
+
+Compact storage formats for embeddings, written to MongoDB as BSON BinData instead of arrays
+of doubles (about 4.9 KB of BSON per 384-dim MiniLM embedding), and scored directly in compact form by
+the resident index:
+
+    array     BSON array of doubles (the original format)
+    float32   BSON vector (subtype 9, FLOAT32), 4 bytes per dimension
+    float16   generic BinData (subtype 0) of little-endian halves, 2 bytes per dimension
+    int8      BSON vector (subtype 9, INT8) with a per-vector scale in `<field>_scale`, 1 byte per dimension
+    binary    BSON vector (subtype 9, PACKED_BIT) of the signs, 1 bit per dimension
+
+The float32, int8 and binary forms are the BSON vector types Atlas Vector Search reads. Cosine
+similarity ignores the int8 scale, so Atlas can index the int8 form directly.
+
+Usage:
+    doc.update(to_bson(embedding, "int8"))             # {"embedding": Binary, "embedding_scale": 0.0031}
+    vector = from_bson(doc)                            # float32 vector, whatever the stored format
+    codec = Codec("int8")
+    codes, scales = codec.encode(matrix)
+    scores = codec.score(queries, codes, scales)       # (Q, N), computed on the int8 codes
+
+    # memory, BSON bytes, latency and recall@k of each format against the float32 path
+    python quantization.py --mongo_url <MONGODB_URI> --formats float16 int8 binary --rescore 4
+    python quantization.py --synthetic 20000
+"""
+
+import argparse, dotenv, json, os, time
+import bson
+import numpy as np
+from bson.binary import Binary, BinaryVectorDtype
+
+FORMATS = ("array", "float32", "float16", "int8", "binary")
+_VECTOR_DTYPES = {b"\x27": "float32", b"\x03": "int8", b"\x10": "binary"}
+_CHUNK = 65536
+_ENCODE_ROWS = 8192
+# Set bits per byte value, for NumPy < 2.0 which has no np.bitwise_count
+_POPCOUNT = np.unpackbits(np.arange(256, dtype=np.uint8)[:, None], axis=1).sum(axis=1).astype(np.uint8)
+
+def _bitwise_count(codes: np.ndarray) -> np.ndarray:
+    if hasattr(np, "bitwise_count"):
+        return np.bitwise_count(codes)
+    return _POPCOUNT[codes]
+
+def _check(fmt: str):
+    if fmt not in FORMATS:
+        raise ValueError(f"Unknown storage format '{fmt}', expected one of {FORMATS}")
+
+def to_bson(vector, fmt: str = "array", field: str = "embedding") -> dict:
+    """
+    Returns the document fields storing `vector` in format `fmt`.
+    """
+    _check(fmt)
+    vector = np.asarray(vector, dtype=np.float32)
+    if fmt == "array":
+        return {field: vector.tolist()}
+    if fmt == "float32":
+        return {field: Binary.from_vector(vector, BinaryVectorDtype.FLOAT32)}
+    if fmt == "float16":
+        return {field: Binary(vector.astype("<f2").tobytes())}
+    codes, scales = Codec(fmt).encode(vector[None, :])
+    if fmt == "int8":
+        return {field: Binary.from_vector(codes[0].tolist(), BinaryVectorDtype.INT8), f"{field}_scale": float(scales[0])}
+    return {field: Binary.from_vector(codes[0].tolist(), BinaryVectorDtype.PACKED_BIT, padding=(-len(vector)) % 8)}
+
+def stored_format(value) -> str:
+    """
+    Storage format of an embedding value, or "unknown" for BinData this module did not write.
+    """
+    if isinstance(value, Binary):
+        if value.subtype == 9:
+            return _VECTOR_DTYPES.get(bytes(value[:1]), "unknown")
+        return "float16" if value.subtype == 0 else "unknown"
+    return "array"
+
+def from_bson(doc: dict, field: str = "embedding") -> np.ndarray:
+    """
+    Decodes the embedding stored in `doc[field]` into a float32 vector, whatever its format.
+    Binary vectors decode to -1/+1 per dimension.
+    """
+    value = doc[field]
+    fmt = stored_format(value)
+    if fmt == "array":
+        return np.asarray(value, dtype=np.float32)
+    if fmt == "float16":
+        return np.frombuffer(value, dtype="<f2").astype(np.float32)
+    data = bytes(value)
+    if fmt == "float32":
+        return np.frombuffer(data, dtype="<f4", offset=2).copy()
+    if fmt == "int8":
+        return np.frombuffer(data, dtype=np.int8, offset=2).astype(np.float32) * float(doc.get(f"{field}_scale", 1.0))
+    if fmt == "binary":
+        bits = np.unpackbits(np.frombuffer(data, dtype=np.uint8, offset=2))
+        return (bits[:len(bits) - data[1]].astype(np.float32) * 2 - 1)
+    raise ValueError(f"Unsupported BinData (subtype {value.subtype}) in field '{field}'")
+
+class Codec:
+    """
+    Resident form of a storage format: `encode` turns float32 rows into codes (and per-row
+    scales for int8) and `score` computes query-row similarities on the codes directly.
+    Binary codes are scored by Hamming distance, rescaled to the cosine range [-1, 1].
+    """
+    def __init__(self, fmt: str):
+        _check(fmt)
+        self.format = "float32" if fmt == "array" else fmt
+
+    @property
+    def dtype(self):
+        return {"float32": np.float32, "float16": np.float16, "int8": np.int8, "binary": np.uint8}[self.format]
+
+    def width(self, dimension: int) -> int:
+        return (dimension + 7) // 8 if self.format == "binary" else dimension
+
+    def encode(self, matrix: np.ndarray):
+        """
+        Returns (codes, scales); scales is None except for int8.
+        """
+        matrix = np.atleast_2d(np.asarray(matrix, dtype=np.float32))
+        if self.format == "float32":
+            return np.ascontiguousarray(matrix), None
+        if self.format == "float16":
+            return matrix.astype(np.float16), None
+        codes = np.empty((len(matrix), self.width(matrix.shape[1])), dtype=self.dtype)
+        scales = np.empty(len(matrix), dtype=np.float32) if self.format == "int8" else None
+        # Rows are encoded in chunks, so a large (e.g. memory-mapped) matrix never gets a
+        # full-size float32 or boolean temporary
+        for start in range(0, len(matrix), _ENCODE_ROWS):
+            chunk = matrix[start:start + _ENCODE_ROWS]
+            end = start + len(chunk)
+            if self.format == "int8":
+                chunk_scales = np.abs(chunk).max(axis=1) / 127.0
+                chunk_scales[chunk_scales == 0] = 1.0
+                codes[start:end] = np.clip(np.rint(chunk / chunk_scales[:, None]), -127, 127)
+                scales[start:end] = chunk_scales
+            else:
+                codes[start:end] = np.packbits(chunk > 0, axis=1)
+        return codes, scales
+
+    def decode(self, codes: np.ndarray, scales: np.ndarray = None, dimension: int = None) -> np.ndarray:
+        if self.format == "int8":
+            return codes.astype(np.float32) * scales[:, None]
+        if self.format == "binary":
+            bits = np.unpackbits(codes, axis=1)[:, :dimension or codes.shape[1] * 8]
+            return bits.astype(np.float32) * 2 - 1
+        return codes.astype(np.float32)
+
+    def score(self, queries: np.ndarray, codes: np.ndarray, scales: np.ndarray = None, dimension: int = None) -> np.ndarray:
+        """
+        Similarity of each float32 query to each coded row, shape (Q, N). Rows are converted
+        in chunks so no full float32 copy of the matrix is ever materialized.
+        """
+        queries = np.atleast_2d(np.asarray(queries, dtype=np.float32))
+        if self.format == "float32":
+            return queries @ codes.T
+        scores = np.empty((len(queries), len(codes)), dtype=np.float32)
+        if self.format == "binary":
+            dimension = dimension or codes.shape[1] * 8
+            packed = np.packbits(queries > 0, axis=1)
+            # The XOR intermediate is (Q, chunk, width) bytes; keep it around 16 MB
+            step = max(1, 2 ** 24 // max(1, len(queries) * codes.shape[1]))
+            for start in range(0, len(codes), step):
+                chunk = codes[start:start + step]
+                distance = _bitwise_count(packed[:, None, :] ^ chunk[None, :, :]).sum(axis=2, dtype=np.int32)
+                scores[:, start:start + len(chunk)] = 1.0 - 2.0 * distance / dimension
+            return scores
+        for start in range(0, len(codes), _CHUNK):
+            chunk = codes[start:start + _CHUNK]
+            scores[:, start:start + len(chunk)] = queries @ chunk.astype(np.float32).T
+        if self.format == "int8":
+            scores *= scales
+        return scores
+
+    def nbytes(self, codes: np.ndarray, scales: np.ndarray = None) -> int:
+        return codes.nbytes + (scales.nbytes if scales is not None else 0)
+
+def bson_bytes(vector, fmt: str, field: str = "embedding") -> int:
+    """
+    Size of the embedding fields of one document in BSON, including field names.
+    """
+    return len(bson.encode(to_bson(vector, fmt, field))) - 5
+
+def quantization_report(matrix: np.ndarray, queries: np.ndarray, fmt: str, ks=(1, 5, 10), rescore: int = 0) -> dict:
+    """
+    Compares scoring on `fmt` codes with the float32 path on the same corpus and queries:
+    resident memory, BSON bytes per document, latency and recall@k. With `rescore`, the top
+    `rescore * k` rows by code score are rescored with the float32 rows.
+    """
+    from index_backends import recall_at_k, top_k_rows
+    max_k = max(ks)
+    start = time.perf_counter()
+    exact_positions, _ = top_k_rows(queries @ matrix.T, max_k)
+    float_seconds = time.perf_counter() - start
+
+    codec = Codec(fmt)
+    codes, scales = codec.encode(matrix)
+    start = time.perf_counter()
+    scores = codec.score(queries, codes, scales, matrix.shape[1])
+    if rescore:
+        shortlist, _ = top_k_rows(scores, max_k * rescore)
+        exact = np.einsum("qd,qkd->qk", queries, matrix[shortlist])
+        top, _ = top_k_rows(exact, max_k)
+        positions = np.take_along_axis(shortlist, top, axis=1)
+    else:
+        positions, _ = top_k_rows(scores, max_k)
+    seconds = time.perf_counter() - start
+
+    report = {
+        "format": fmt,
+        "rescore": rescore,
+        "corpus": int(matrix.shape[0]),
+        "queries": int(len(queries)),
+        "memory_bytes": codec.nbytes(codes, scales),
+        "float32_memory_bytes": int(matrix.nbytes),
+        "bson_bytes_per_doc": bson_bytes(matrix[0], fmt),
+        "array_bson_bytes_per_doc": bson_bytes(matrix[0], "array"),
+        "ms_per_query": 1000 * seconds / max(1, len(queries)),
+        "float32_ms_per_query": 1000 * float_seconds / max(1, len(queries)),
+    }
+    for k in ks:
+        report[f"recall@{k}"] = recall_at_k(exact_positions, positions, k)
+    return report
+
+if __name__ == "__main__":
+    dotenv.load_dotenv()
+    parser = argparse.ArgumentParser(description="Benchmark compact embedding formats against the float32 path")
+    parser.add_argument("--mongo_url", help="MongoDB connection URI (optional, defaults to env MONGO_URL or localhost)")
+    parser.add_argument("--synthetic", type=int, help="Use this many random unit vectors instead of the stored corpus")
+    parser.add_argument("--formats", nargs="+", default=["float16", "int8", "binary"], help="Formats to report")
+    parser.add_argument("--rescore", type=int, nargs="+", default=[0, 4], help="Shortlist multipliers to report (0 disables)")
+    parser.add_argument("--k", type=int, nargs="+", default=[1, 5, 10], help="k values for recall@k")
+    parser.add_argument("--queries", type=int, default=200, help="Number of corpus rows used as queries")
+    parser.add_argument("--json", action="store_true", help="Print reports as JSON")
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    if args.synthetic:
+        matrix = rng.standard_normal((args.synthetic, 384)).astype(np.float32)
+        matrix /= np.linalg.norm(matrix, axis=1, keepdims=True)
+    else:
+        from mongo_pool import get_client
+        from embedding_index import EmbeddingIndex
+        mongo_url = args.mongo_url or os.getenv("MONGO_URL", "mongodb://localhost:27017/")
+        matrix = np.asarray(EmbeddingIndex(get_client(mongo_url)["testdb"]["ag_news"]).load().embeddings)
+    queries = matrix[rng.choice(len(matrix), size=min(args.queries, len(matrix)), replace=False)]
+
+    for fmt in args.formats:
+        for rescore in args.rescore:
+            report = quantization_report(matrix, queries, fmt, args.k, rescore)
+            if args.json:
+                print(json.dumps(report))
+                continue
+            recalls = ", ".join(f"recall@{k}={report[f'recall@{k}']:.3f}" for k in args.k)
+            print(f"{fmt:>7} rescore={rescore}: {report['memory_bytes'] / 2**20:.1f} MiB "
+                  f"(float32 {report['float32_memory_bytes'] / 2**20:.1f} MiB), "
+                  f"{report['bson_bytes_per_doc']} BSON bytes/doc (array {report['array_bson_bytes_per_doc']}), "
+                  f"{report['ms_per_query']:.3f} ms/query (float32 {report['float32_ms_per_query']:.3f}), {recalls}")
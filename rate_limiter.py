@@ -0,0 +1,302 @@
+"""
+rate_limiter.py
+@ken.chen
+
+Client-side scheduler for one OpenAI/Azure OpenAI deployment. It tracks the deployment's
+requests-per-minute and tokens-per-minute budgets over a sliding 60-second window, caps the
+number of requests in flight, and paces callers until a request fits the budget. 429 and 5xx
+responses and connection errors are retried with jittered exponential backoff; a Retry-After
+header pauses the whole deployment, not only the request that received it. Under bursty load
+throughput then settles at the quota instead of failing.
+
+Callers wait their turn first-in, first-out: a slot or budget that frees up goes to the caller
+that has waited longest, and a streamed response holds its slot until the stream is exhausted.
+
+Usage:
+    scheduler = RateLimitScheduler(rpm=300, tpm=60000, max_concurrency=16)
+    response = scheduler.call(lambda: client.chat.completions.create(**request), estimate_tokens(messages, tools, 1024))
+    response = await scheduler.call_async(lambda: async_client.chat.completions.create(**request), tokens)
+    for chunk in scheduler.stream(lambda: client.chat.completions.create(stream=True, **request), tokens):
+        ...
+
+Environment:
+    OPENAI_RPM: requests per minute per deployment (default: unlimited)
+    OPENAI_TPM: tokens per minute per deployment (default: unlimited)
+    OPENAI_RATE_LIMITS: JSON overrides per deployment, e.g. {"gpt-4o": {"rpm": 500, "tpm": 30000}}
+    OPENAI_MAX_CONCURRENCY: requests in flight per deployment (default: 16)
+    OPENAI_MAX_RETRIES: retries on 429/5xx and connection errors (default: 4)
+"""
+
+import asyncio, json, os, random, threading, time
+from collections import deque
+
+RETRY_STATUSES = {408, 409, 429, 500, 502, 503, 504}
+WINDOW_SECONDS = 60.0
+
+def estimate_tokens(messages: list, tools: list = None, max_tokens: int = 0) -> int:
+    """
+    Rough token count of a request: about four characters per token for the serialized
+    messages and tools, plus `max_tokens`, which the service also counts against the quota.
+    """
+    text = json.dumps(messages, default=str) + (json.dumps(tools) if tools else "")
+    return len(text) // 4 + 4 * len(messages) + max_tokens
+
+def retry_after(error) -> float:
+    """
+    Seconds the service asked us to wait (retry-after-ms / Retry-After headers), or None.
+    """
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None) or {}
+    for header, scale in (("retry-after-ms", 0.001), ("retry-after", 1.0)):
+        value = headers.get(header)
+        if value is not None:
+            try:
+                return float(value) * scale
+            except ValueError:
+                pass
+    return None
+
+def is_retryable(error) -> bool:
+    status = getattr(error, "status_code", None)
+    if status is not None:
+        return status in RETRY_STATUSES
+    # Connection errors and timeouts carry no status code
+    return type(error).__name__ in ("APIConnectionError", "APITimeoutError") or isinstance(error, (ConnectionError, TimeoutError))
+
+class _Waiter:
+    """
+    A caller queued in `acquire`/`acquire_async`, woken when it may be able to reserve.
+    """
+    def __init__(self, loop: asyncio.AbstractEventLoop = None):
+        self.loop = loop
+        self.event = asyncio.Event() if loop else threading.Event()
+
+    def wake(self):
+        if self.loop:
+            self.loop.call_soon_threadsafe(self.event.set)
+        else:
+            self.event.set()
+
+class RateLimitScheduler:
+    def __init__(self, rpm: int = None, tpm: int = None, max_concurrency: int = 16, max_retries: int = 4,
+                 backoff: float = 0.5, max_backoff: float = 30.0):
+        """
+        Args:
+            rpm (int): Requests per minute allowed for the deployment (None for unlimited).
+            tpm (int): Tokens per minute allowed for the deployment (None for unlimited).
+            max_concurrency (int): Requests in flight at once.
+            max_retries (int): Retries on 429/5xx and connection errors.
+            backoff (float): Base delay in seconds for exponential backoff with full jitter.
+            max_backoff (float): Upper bound for a single backoff delay.
+        """
+        self.rpm = rpm
+        self.tpm = tpm
+        self.max_concurrency = max_concurrency
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self._window = deque()  # [timestamp, tokens] per request started in the last minute
+        self._tokens = 0
+        self._in_flight = 0
+        self._paused_until = 0.0
+        self._waiters = deque()  # FIFO; only the first waiter may reserve
+        self._lock = threading.Lock()
+        self.counts = {"requests": 0, "retries": 0, "throttled": 0, "waited_seconds": 0.0}
+
+    def _reserve(self, tokens: int, waiter: _Waiter = None):
+        """
+        Reserves budget for one request if it fits now and no earlier caller is waiting.
+        Returns the reservation, or the number of seconds to wait before trying again
+        (None to wait until woken).
+        """
+        with self._lock:
+            now = time.monotonic()
+            while self._window and self._window[0][0] <= now - WINDOW_SECONDS:
+                self._tokens -= self._window.popleft()[1]
+            if self._waiters and self._waiters[0] is not waiter:
+                return None, None
+            if self._paused_until > now:
+                return None, self._paused_until - now
+            if self._in_flight >= self.max_concurrency:
+                return None, None
+            if self.rpm and len(self._window) >= self.rpm:
+                return None, self._window[0][0] + WINDOW_SECONDS - now
+            if self.tpm and self._window and self._tokens + tokens > self.tpm:
+                # Wait until enough of the window expires; a request larger than the whole
+                # budget is let through on an empty window rather than blocked forever
+                needed, expires = self._tokens + tokens - self.tpm, now
+                for started, used in self._window:
+                    needed -= used
+                    expires = started + WINDOW_SECONDS
+                    if needed <= 0:
+                        break
+                return None, max(expires - now, 0.01)
+            entry = [now, tokens]
+            self._window.append(entry)
+            self._tokens += tokens
+            self._in_flight += 1
+            self.counts["requests"] += 1
+            return entry, 0.0
+
+    def _release(self, entry: list, used_tokens: int = None):
+        with self._lock:
+            self._in_flight -= 1
+            if used_tokens is not None and entry in self._window:
+                # Replace the estimate with the usage the service reported
+                self._tokens += used_tokens - entry[1]
+                entry[1] = used_tokens
+            self._wake_first()
+
+    def _wake_first(self):
+        # Called with the lock held
+        if self._waiters:
+            self._waiters[0].wake()
+
+    def _enqueue(self, waiter: _Waiter):
+        with self._lock:
+            self._waiters.append(waiter)
+
+    def _dequeue(self, waiter: _Waiter, started: float):
+        with self._lock:
+            self._waiters.remove(waiter)
+            self.counts["waited_seconds"] += time.monotonic() - started
+            self._wake_first()
+
+    def acquire(self, tokens: int) -> list:
+        waiter, started = _Waiter(), time.monotonic()
+        self._enqueue(waiter)
+        try:
+            while True:
+                entry, wait = self._reserve(tokens, waiter)
+                if entry is not None:
+                    return entry
+                waiter.event.wait(wait)
+                waiter.event.clear()
+        finally:
+            self._dequeue(waiter, started)
+
+    async def acquire_async(self, tokens: int) -> list:
+        waiter, started = _Waiter(asyncio.get_running_loop()), time.monotonic()
+        self._enqueue(waiter)
+        try:
+            while True:
+                entry, wait = self._reserve(tokens, waiter)
+                if entry is not None:
+                    return entry
+                try:
+                    await asyncio.wait_for(waiter.event.wait(), wait)
+                except asyncio.TimeoutError:
+                    pass
+                waiter.event.clear()
+        finally:
+            self._dequeue(waiter, started)
+
+    def _retry_delay(self, error, attempt: int):
+        """
+        Returns the delay before the next attempt, or None when `error` should be raised.
+        """
+        if attempt >= self.max_retries or not is_retryable(error):
+            return None
+        delay = retry_after(error)
+        with self._lock:
+            self.counts["retries"] += 1
+            if getattr(error, "status_code", None) == 429:
+                self.counts["throttled"] += 1
+                if delay is not None:
+                    # The quota applies to the deployment, so every caller waits in acquire
+                    self._paused_until = max(self._paused_until, time.monotonic() + delay)
+                    return 0.0
+        if delay is None:
+            delay = random.uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt))
+        return delay
+
+    def call(self, fn, tokens: int):
+        """
+        Runs `fn()` once the request fits the budget, retrying retryable failures.
+        """
+        attempt = 0
+        while True:
+            entry = self.acquire(tokens)
+            used = None
+            try:
+                result = fn()
+                used = _usage(result)
+                return result
+            except Exception as e:
+                delay = self._retry_delay(e, attempt)
+                if delay is None:
+                    raise
+            finally:
+                self._release(entry, used)
+            attempt += 1
+            time.sleep(delay)
+
+    async def call_async(self, fn, tokens: int):
+        """
+        Same as `call`, for a `fn` returning an awaitable.
+        """
+        attempt = 0
+        while True:
+            entry = await self.acquire_async(tokens)
+            used = None
+            try:
+                result = await fn()
+                used = _usage(result)
+                return result
+            except Exception as e:
+                delay = self._retry_delay(e, attempt)
+                if delay is None:
+                    raise
+            finally:
+                self._release(entry, used)
+            attempt += 1
+            await asyncio.sleep(delay)
+
+    def stream(self, fn, tokens: int):
+        """
+        Same as `call`, for a `fn` opening a stream of chunks: opening is retried, then the
+        chunks are yielded while the request keeps its slot. The slot is released, with the
+        usage reported by the last chunk that carries one, once the stream is exhausted or closed.
+        """
+        attempt = 0
+        while True:
+            entry = self.acquire(tokens)
+            try:
+                chunks = fn()
+                break
+            except Exception as e:
+                self._release(entry)
+                delay = self._retry_delay(e, attempt)
+                if delay is None:
+                    raise
+            attempt += 1
+            time.sleep(delay)
+        used = None
+        try:
+            for chunk in chunks:
+                used = _usage(chunk) or used
+                yield chunk
+        finally:
+            if hasattr(chunks, "close"):
+                chunks.close()
+            self._release(entry, used)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {**self.counts, "waiting": len(self._waiters), "in_flight": self._in_flight, "window_requests": len(self._window),
+                    "window_tokens": self._tokens, "rpm": self.rpm, "tpm": self.tpm}
+
+def _usage(response):
+    total = getattr(getattr(response, "usage", None), "total_tokens", None)
+    return total if isinstance(total, int) else None
+
+def create_scheduler(deployment: str) -> RateLimitScheduler:
+    """
+    Builds a RateLimitScheduler for `deployment` configured from the environment.
+    """
+    limits = json.loads(os.getenv("OPENAI_RATE_LIMITS", "{}")).get(deployment, {})
+    rpm = limits.get("rpm", int(os.getenv("OPENAI_RPM", "0")))
+    tpm = limits.get("tpm", int(os.getenv("OPENAI_TPM", "0")))
+    return RateLimitScheduler(rpm or None, tpm or None,
+                              limits.get("max_concurrency", int(os.getenv("OPENAI_MAX_CONCURRENCY", "16"))),
+                              int(os.getenv("OPENAI_MAX_RETRIES", "4")))
@@ -0,0 +1,84 @@
+"""
+request_coalescer.py
+@ken.chen
+
+Collects concurrent requests over a short window and hands them to a batch function in one
+call, so that N concurrent searches cost one batched encode and one matrix-matrix product
+instead of N separate ones. Stages timed while a batch runs (see metrics.py) are added to the
+trace of every request in the batch.
+
+Usage:
+    from request_coalescer import RequestCoalescer
+    coalescer = RequestCoalescer(lambda queries: search_many(queries, mongo_url), window_ms=5)
+    headlines = coalescer.submit("Atlanta Braves")   # blocks until its batch completes
+"""
+
+import queue, threading, time
+from concurrent.futures import Future
+from metrics import current_trace, trace
+
+class RequestCoalescer:
+    def __init__(self, batch_fn, window_ms: float = 5.0, max_batch: int = 32):
+        """
+        Args:
+            batch_fn: Callable taking a list of items and returning a list of results in the same order,
+                one per item; otherwise every request of the batch fails.
+            window_ms (float): How long to wait for more requests after the first one arrives.
+            max_batch (int): Maximum number of requests sent to `batch_fn` at once.
+        """
+        self.batch_fn = batch_fn
+        self.window = window_ms / 1000.0
+        self.max_batch = max_batch
+        self._queue = queue.Queue()
+        self._worker = threading.Thread(target=self._run, name="request-coalescer", daemon=True)
+        self._worker.start()
+        self.batches = 0
+        self.requests = 0
+
+    def submit(self, item, timeout: float = None):
+        """
+        Queues an item and blocks until its batch has been processed.
+        """
+        return self.submit_async(item).result(timeout)
+
+    def submit_async(self, item) -> Future:
+        future = Future()
+        self._queue.put((item, future, current_trace()))
+        return future
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.window
+            while len(batch) < self.max_batch:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            self._dispatch(batch)
+
+    def _dispatch(self, batch: list):
+        self.batches += 1
+        self.requests += len(batch)
+        items = [item for item, _, _ in batch]
+        error = None
+        with trace() as batch_trace:
+            try:
+                results = list(self.batch_fn(items))
+            except Exception as e:
+                error = e
+        # Merged before any future completes, failed batches included; a request that
+        # submitted several items waited for the batch once
+        for request_trace in {id(t): t for _, _, t in batch if t is not None}.values():
+            request_trace.merge(batch_trace)
+        if error is None and len(results) != len(batch):
+            error = RuntimeError(f"Batch function returned {len(results)} results for {len(batch)} requests")
+        if error is not None:
+            for _, future, _ in batch:
+                future.set_exception(error)
+            return
+        for (_, future, _), result in zip(batch, results):
+            future.set_result(result)
@@ -0,0 +1,216 @@
+"""
+reranker.py
+@ken.chen
+
+Optional second retrieval stage: re-scores the first-stage candidates of a search (MiniLM dot
+products, or RRF scores in hybrid mode) with a local cross-encoder. The cross-encoder reads the
+query and a headline together, so it ranks much better than the bi-encoder. The cost is one
+transformer pass per (query, candidate) pair, which is bounded three ways:
+
+    - each candidate is cut to RERANK_MAX_TOKENS tokens before scoring, and each pair to the same length
+    - scores are cached per (model, query, truncated candidate text), so repeated queries are cheap
+    - pairs are scored in batches sized from the measured cost per pair to fit what is left of
+      RERANK_BUDGET_MS; candidates the budget does not reach follow the reranked ones in their
+      first-stage order, with a score of None, since first-stage scores are not comparable with
+      cross-encoder scores
+
+The cross-encoder is kept in the model registry's reranker slots (MODEL_REGISTRY_MAX_RERANKERS), apart
+from the query encoders, so the two never evict each other between requests.
+
+Pairs of every query in a call share the batches, taken rank by rank across queries, so
+coalesced requests rerank together and each query gets its best candidates scored first.
+
+Usage:
+    from reranker import get_reranker
+    rows = get_reranker().rerank_many(["braves win"], [[(7, 0.61, "Braves beat Mets"), (3, 0.58, "Mets lose")]])
+    # [[(3, 4.2), (7, 3.9)]]: (doc id, cross-encoder score), best first
+
+    python benchmark.py --mongo_url <MONGODB_URI> --targets local rerank   # latency and quality vs single stage
+
+Environment:
+    RERANK_MODEL: cross-encoder model (default: cross-encoder/ms-marco-MiniLM-L-6-v2)
+    RERANK_CANDIDATES: first-stage candidates reranked per query (default: 50)
+    RERANK_MAX_TOKENS: tokens kept per candidate and per pair (default: 128)
+    RERANK_BATCH_SIZE: largest number of pairs per forward pass (default: 32)
+    RERANK_BUDGET_MS: latency budget of one rerank call, 0 for none (default: 250)
+    RERANK_CACHE_SIZE: cached (query, candidate) scores (default: 20000)
+"""
+
+import os, threading, time
+from collections import OrderedDict
+import numpy as np
+from embedding_cache import cache_key
+from metrics import inc, timer
+
+DEFAULT_RERANK_MODEL = "cross-encoder/ms-marco-MiniLM-L-6-v2"
+
+def rerank_depth(top_k: int = 0) -> int:
+    """
+    Number of first-stage candidates to fetch for reranking `top_k` results.
+    """
+    return max(top_k, int(os.getenv("RERANK_CANDIDATES", "50")))
+
+class Reranker:
+    def __init__(self, model=None, model_name: str = None, max_tokens: int = None, batch_size: int = None,
+                 budget_ms: float = None, cache_size: int = None):
+        """
+        Args:
+            model: Object with `predict(pairs, batch_size=...)` (default: the shared CrossEncoder
+                of `model_name` from the model registry).
+            model_name (str): Cross-encoder model, also part of the cache key (default: RERANK_MODEL).
+            max_tokens (int): Tokens kept per candidate (default: RERANK_MAX_TOKENS).
+            batch_size (int): Largest batch of pairs (default: RERANK_BATCH_SIZE).
+            budget_ms (float): Latency budget per call, 0 for none (default: RERANK_BUDGET_MS).
+            cache_size (int): Cached scores (default: RERANK_CACHE_SIZE).
+        """
+        self.model_name = model_name or os.getenv("RERANK_MODEL", DEFAULT_RERANK_MODEL)
+        self.max_tokens = max_tokens or int(os.getenv("RERANK_MAX_TOKENS", "128"))
+        self.batch_size = batch_size or int(os.getenv("RERANK_BATCH_SIZE", "32"))
+        budget_ms = float(os.getenv("RERANK_BUDGET_MS", "250")) if budget_ms is None else budget_ms
+        self.budget = budget_ms / 1000
+        self.cache_size = int(os.getenv("RERANK_CACHE_SIZE", "20000")) if cache_size is None else cache_size
+        self._model = model
+        self._scores = OrderedDict()
+        self._lock = threading.Lock()
+        self._model_lock = threading.Lock()
+        self.pair_seconds = None   # moving average of the scoring time per pair
+        self.scored = self.cached = self.skipped = 0
+
+    @property
+    def model(self):
+        if self._model is not None:
+            return self._model
+        # Looked up on every use rather than kept, so the registry can still evict it
+        from model_registry import get_cross_encoder
+        return get_cross_encoder(self.model_name, max_length=self.max_tokens)
+
+    def truncate(self, texts: list) -> list:
+        """
+        Cuts each text after its first `max_tokens` tokens, using the model's fast tokenizer
+        offsets when it has one and whitespace-separated words otherwise.
+        """
+        tokenizer = getattr(self.model, "tokenizer", None)
+        if getattr(tokenizer, "is_fast", False) is True:
+            encoded = tokenizer(texts, add_special_tokens=False, truncation=True, max_length=self.max_tokens,
+                                return_offsets_mapping=True)
+            return [text[:offsets[-1][1]] if offsets else text
+                    for text, offsets in zip(texts, encoded["offset_mapping"])]
+        return [" ".join(text.split()[:self.max_tokens]) for text in texts]
+
+    def _next_batch_size(self, deadline: float) -> int:
+        if deadline is None or self.pair_seconds is None:
+            return self.batch_size
+        return min(self.batch_size, int((deadline - time.perf_counter()) / self.pair_seconds))
+
+    def _predict(self, pairs: list) -> list:
+        with self._model_lock:
+            # Time only the forward pass: waiting on concurrent reranks is not a cost per pair
+            model = self.model
+            start = time.perf_counter()
+            scores = model.predict(pairs, batch_size=len(pairs), show_progress_bar=False)
+            per_pair = (time.perf_counter() - start) / len(pairs)
+        self.pair_seconds = per_pair if self.pair_seconds is None else 0.8 * self.pair_seconds + 0.2 * per_pair
+        return np.asarray(scores, dtype=np.float32).reshape(-1).tolist()
+
+    def rerank_many(self, queries: list, candidates: list) -> list:
+        """
+        Reranks the candidates of several queries with shared batches.
+
+        Args:
+            queries (list): The query strings.
+            candidates (list): Per query, (doc id, first-stage score, text) tuples in first-stage order.
+
+        Returns:
+            list: Per query, (doc id, score) tuples: the reranked candidates by cross-encoder score,
+                then those the latency budget did not reach, in first-stage order with score None.
+        """
+        deadline = time.perf_counter() + self.budget if self.budget else None
+        with timer("rerank"):
+            texts = iter(self.truncate([text for row in candidates for _, _, text in row]))
+            keys, pairs, ranks = [], {}, {}
+            for query, row in zip(queries, candidates):
+                row_keys = []
+                for rank, _ in enumerate(row):
+                    text = next(texts)
+                    key = cache_key(self.model_name, f"{query}\0{text}")
+                    pairs.setdefault(key, (query, text))
+                    ranks[key] = min(rank, ranks.get(key, rank))
+                    row_keys.append(key)
+                keys.append(row_keys)
+
+            scores = self._lookup(list(pairs))
+            cached = len(scores)
+            # Best first-stage ranks of every query first, so a short budget still helps each query
+            missing = sorted((key for key in pairs if key not in scores), key=ranks.get)
+            done = 0
+            while done < len(missing):
+                size = self._next_batch_size(deadline)
+                if size < 1:
+                    break
+                batch = missing[done:done + size]
+                fresh = dict(zip(batch, self._predict([pairs[key] for key in batch])))
+                self._remember(fresh)
+                scores.update(fresh)
+                done += len(batch)
+
+        results, skipped = [], 0
+        for row, row_keys in zip(candidates, keys):
+            reranked, rest = [], []
+            for (doc_id, _, _), key in zip(row, row_keys):
+                if key in scores:
+                    reranked.append((doc_id, scores[key]))
+                else:
+                    rest.append((doc_id, None))
+            reranked.sort(key=lambda hit: hit[1], reverse=True)
+            skipped += len(rest)
+            results.append(reranked + rest)
+        with self._lock:
+            self.cached += cached
+            self.scored += done
+            self.skipped += skipped
+        inc("mcp_rerank_pairs_total", cached, result="cached")
+        inc("mcp_rerank_pairs_total", done, result="scored")
+        inc("mcp_rerank_pairs_total", skipped, result="skipped")
+        return results
+
+    def _lookup(self, keys: list) -> dict:
+        found = {}
+        with self._lock:
+            for key in keys:
+                if key in self._scores:
+                    self._scores.move_to_end(key)
+                    found[key] = self._scores[key]
+        return found
+
+    def _remember(self, scores: dict):
+        if not self.cache_size:
+            return
+        with self._lock:
+            self._scores.update(scores)
+            for key in scores:
+                self._scores.move_to_end(key)
+            while len(self._scores) > self.cache_size:
+                self._scores.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._scores.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"model": self.model_name, "cached_scores": len(self._scores), "scored": self.scored,
+                    "cache_hits": self.cached, "skipped": self.skipped,
+                    "pair_ms": None if self.pair_seconds is None else 1000 * self.pair_seconds}
+
+_reranker = None
+_reranker_lock = threading.Lock()
+
+def get_reranker() -> Reranker:
+    """
+    Returns the process-wide reranker configured from the environment.
+    """
+    global _reranker
+    with _reranker_lock:
+        if _reranker is None:
+            _reranker = Reranker()
+        return _reranker
@@ -2,79 +2,258 @@
 sbert_vector_search.py
 @ken.chen
 
-Performs local semantic vector search on a MongoDB collection using sentence-transformers and PyTorch.
-Encodes queries and documents, computes dot product similarity, and returns the top matching results.
+Performs local semantic vector search on a MongoDB collection using sentence-transformers and NumPy.
+Keeps the stored document embeddings resident in memory, encodes queries, computes dot product
+similarity, and returns the top matching results.
+
+Indexes are kept per namespace (database, collection, model) by an IndexManager (index_manager.py)
+that loads them on first use and evicts the least recently queried ones under INDEX_MEMORY_BUDGET_MB;
+searches use the namespace passed in, or that of the current request's tenant.
+
+Scoring works on document ids only; the winning documents are then fetched with one `$in` query
+that projects just the fields the caller asked for (default: text and label), never the embeddings.
+
+With rerank, the top RERANK_CANDIDATES hits are re-scored by a cross-encoder (reranker.py) and
+the returned scores are cross-encoder scores, or None for candidates the rerank budget did not reach.
+
+Queries are encoded with the ENCODER_BACKEND backend of the namespace model (encoder_backends.py),
+e.g. an int8-quantized copy for lower CPU latency; stored embeddings always come from the stock model.
+
+Searches accept metadata filters on 'label' ({"label": 1} or {"label": {"$in": [1, 2]}}), applied as
+pre-filters through the index's posting lists, and an optional hybrid mode that fuses the vector
+ranking with a MongoDB text ranking by reciprocal rank fusion (see hybrid_search.py).
 
 Usage:
     python sbert_vector_search.py --mongo_url <MONGODB_URI> "Your query text here"
+    python sbert_vector_search.py --label 1 --hybrid "Atlanta Braves"
+    python sbert_vector_search.py --namespace acme.articles "quarterly results"
+    python sbert_vector_search.py --top_k 50 --fields id score "Atlanta Braves"
+    python sbert_vector_search.py --rerank "Atlanta Braves"
 
 If --mongo_url is omitted, it defaults to the MONGO_URL environment variable or localhost.
 """
 
 import argparse, dotenv, os
-from pymongo import MongoClient
-from sentence_transformers import SentenceTransformer
-import torch
+from embedding_cache import get_cache
+from embedding_index import EmbeddingIndex
+from encoder_backends import cache_name, query_backend
+from hybrid_search import reciprocal_rank_fusion, text_search
+from index_backends import create_backend
+from index_manager import DEFAULT_NAMESPACE, IndexManager, current_namespace, namespace_key
+from model_registry import get_model
+from mongo_pool import get_client
+from reranker import get_reranker, rerank_depth
+
+# Fields of a returned headline: stored document fields plus "id" (the _id) and "score"
+HEADLINE_FIELDS = ("text", "label", "score")
+
+def load_index(namespace: dict) -> EmbeddingIndex:
+    """
+    Loads the embedding index of a namespace. The index refreshes in the background according to
+    LOCAL_INDEX_REFRESH ("watch" by default, "poll", or "none") and searches with the
+    LOCAL_INDEX_BACKEND backend ("exact" by default, or "ivf" tuned by IVF_NPROBE, or by
+    IVF_NUM_CANDIDATES which overrides it).
+    When the namespace's "snapshot" (or, for testdb.ag_news, LOCAL_INDEX_SNAPSHOT) points at a
+    snapshot written by load_data.py, the embeddings are memory-mapped from it instead of being
+    read from MongoDB. LOCAL_INDEX_STORAGE keeps
+    them resident as "float16", "int8" or "binary" codes, and LOCAL_INDEX_RESCORE (a shortlist
+    multiplier) rescores with LOCAL_INDEX_RESCORE_FIELD (default "embedding_full", see EmbeddingIndex).
+    """
+    mongo_url, database, collection, model = namespace_key(namespace)
+    backend = os.getenv("LOCAL_INDEX_BACKEND", "exact")
+    options = {}
+    if backend == "ivf":
+        options["nprobe"] = int(os.getenv("IVF_NPROBE", "8"))
+        if os.getenv("IVF_NUM_CANDIDATES"):
+            options["num_candidates"] = int(os.getenv("IVF_NUM_CANDIDATES"))
+    index = EmbeddingIndex(get_client(mongo_url)[database][collection], backend=create_backend(backend, **options),
+                           storage=os.getenv("LOCAL_INDEX_STORAGE", "float32"),
+                           rescore=int(os.getenv("LOCAL_INDEX_RESCORE", "0")),
+                           rescore_field=os.getenv("LOCAL_INDEX_RESCORE_FIELD"),
+                           filter_fields=tuple(namespace.get("filter_fields", ("label",))))
+    snapshot = namespace.get("snapshot")
+    if snapshot is None and (database, collection) == (DEFAULT_NAMESPACE["database"], DEFAULT_NAMESPACE["collection"]):
+        snapshot = os.getenv("LOCAL_INDEX_SNAPSHOT")
+    if snapshot and os.path.isdir(snapshot):
+        index.load_snapshot(snapshot, model=model)
+    else:
+        index.load()
+    refresh = os.getenv("LOCAL_INDEX_REFRESH", "watch")
+    if refresh != "none":
+        index.start(refresh)
+    return index
 
-def run_local_vector_search(query_text, mongo_url, top_k=5) -> list:
+manager = IndexManager(load_index)
+
+def get_index(mongo_url, namespace: dict = None) -> EmbeddingIndex:
+    """
+    Returns the resident embedding index of `namespace` (default: the current request's tenant,
+    testdb.ag_news outside a request) at `mongo_url`, loading it on first use. A namespace
+    that names its own "mongo_url" is read from there instead.
+    """
+    return manager.get({"mongo_url": mongo_url, **(namespace or current_namespace())})
+
+def reset_indexes():
+    manager.clear()
+
+def run_local_vector_search(query_text, mongo_url, top_k=5, filters=None, hybrid=False, namespace=None,
+                            fields=HEADLINE_FIELDS, rerank=False) -> list:
     """
     Runs a local vector search using dot product similarity between a query
-    and stored embeddings in MongoDB.
+    and the resident embedding index of the MongoDB collection.
 
     Args:
         query_text (str): The input query string to search for.
         mongo_url (str): MongoDB connection URI.
         top_k (int): Number of top results to return (default = 5).
+        filters (dict): Metadata filter on 'label', e.g. {"label": 1} (optional).
+        hybrid (bool): Fuse with a MongoDB text ranking by reciprocal rank fusion.
+        namespace (dict): Database, collection and model to search (default: the current tenant's).
+        fields (tuple): Fields of each headline (default: text, label and score).
+        rerank (bool): Re-score the top RERANK_CANDIDATES hits with a cross-encoder.
+    """
+    headlines = search_many([query_text], mongo_url, top_k, filters, hybrid, namespace, fields, rerank=rerank)[0]
+    print(f"\nTop {len(headlines)} local results for query: \"{query_text}\"")
+    return headlines
+
+def search_many(queries, mongo_url, top_k=5, filters=None, hybrid=False, namespace=None,
+                fields=HEADLINE_FIELDS, offset=0, rerank=False) -> list:
+    """
+    Runs several local vector searches at once: all queries are encoded in one batch
+    and scored with one matrix-matrix product.
+
+    Args:
+        queries (list): The query strings to search for.
+        mongo_url (str): MongoDB connection URI.
+        top_k (int): Number of top results to return per query (default = 5).
+        filters (dict): Metadata filter on 'label' shared by all queries (optional).
+        hybrid (bool): Fuse each vector ranking with a text ranking by reciprocal rank fusion;
+            scores are then RRF scores.
+        namespace (dict): Database, collection and model to search (default: the current tenant's).
+        fields (tuple): Fields of each headline: stored document fields, "id" and "score" (default:
+            text, label and score). Only the stored ones are fetched; with none, MongoDB is not queried.
+        offset (int): Hits to skip per query before the `top_k` returned, for pagination.
+        rerank (bool): Re-score the top RERANK_CANDIDATES hits (at least offset + top_k) with a
+            cross-encoder; every candidate is then hydrated, with its text.
+
+    Returns:
+        list: One list of headlines per query, in the order of `queries`.
+    """
+    limit = offset + top_k
+    candidates = rerank_depth(limit) if rerank else limit
+    hits = rank_many(queries, mongo_url, candidates, filters, hybrid, namespace)
+    if rerank:
+        docs = get_index(mongo_url, namespace).hydrate(hit_ids(hits), headline_projection(("text",) + tuple(fields)))
+        hits = rerank_hits(queries, hits, docs)
+        return to_headlines([row[offset:limit] for row in hits], docs, fields)
+    hits = [row[offset:] for row in hits]
+    projection = headline_projection(fields)
+    docs = get_index(mongo_url, namespace).hydrate(hit_ids(hits), projection) if projection else None
+    return to_headlines(hits, docs, fields)
+
+def rank_many(queries, mongo_url, top_k=5, filters=None, hybrid=False, namespace=None) -> list:
+    """
+    Returns the top_k (document id, score) hits of each query: vector scores, or with `hybrid`
+    RRF scores fusing the vector ranking with a text ranking.
+    """
+    if not hybrid:
+        return score_many(queries, mongo_url, top_k, filters, namespace)
+    # Fuse deeper rankings than top_k so documents found by only one side can still rank
+    depth = max(4 * top_k, 20)
+    collection = get_index(mongo_url, namespace).collection
+    return [reciprocal_rank_fusion([[doc_id for doc_id, _ in row], text_search(collection, query, depth, filters)],
+                                   limit=top_k)
+            for query, row in zip(queries, score_many(queries, mongo_url, depth, filters, namespace))]
+
+def rerank_hits(queries: list, hits: list, docs: list) -> list:
     """
-    # Connect to MongoDB and access the 'ag_news' collection
-    client = MongoClient(mongo_url)
-    db = client["testdb"]
-    collection = db["ag_news"]
+    Reorders each query's hits by cross-encoder score over the hydrated texts.
+    """
+    texts = {doc["_id"]: doc.get("text") or "" for doc in docs}
+    candidates = [[(doc_id, score, texts[doc_id]) for doc_id, score in row if doc_id in texts] for row in hits]
+    return get_reranker().rerank_many(queries, candidates)
 
-    # Load sentence-transformers model and detect CUDA if available
-    model = SentenceTransformer("all-MiniLM-L6-v2")
-    device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+def score_many(queries, mongo_url, top_k=5, filters=None, namespace=None) -> list:
+    """
+    Encodes and scores queries against the resident index without touching MongoDB
+    (after the first load).
 
-    # Encode the query into an embedding and move to the correct device
-    query_embedding = model.encode(query_text, convert_to_tensor=True).to(device)
+    Returns:
+        list: One list of (document id, score) tuples per query.
+    """
+    if not queries:
+        return []
 
-    # Load all documents with precomputed embeddings from MongoDB
-    docs = list(collection.find({}, {"_id": 1, "text": 1, "label": 1, "embedding": 1}))
-    corpus_embeddings = torch.tensor([doc["embedding"] for doc in docs]).to(device)
+    # Reuse the resident index; only the first call reads embeddings from MongoDB
+    namespace = namespace or current_namespace()
+    index = get_index(mongo_url, namespace)
 
-    # Compute dot product similarity scores
-    scores = query_embedding @ corpus_embeddings.T  # Shape: (N,)
+    # Reuse the process-wide model of the namespace and encode all uncached queries together
+    model_name = namespace_key(namespace)[3]
+    backend = query_backend()
+    query_embeddings = get_cache().encode(get_model(model_name, backend=backend), queries, cache_name(model_name, backend))
 
-    # Retrieve top-k results based on scores
-    k = min(top_k, scores.shape[-1])
-    top_results = torch.topk(scores, k=k)
-    
-    top_indices = top_results.indices.cpu().numpy()
-    top_scores = top_results.values.cpu().numpy()
+    # Score against the in-memory matrix, or only the rows in the filter's posting lists
+    return index.search_many(query_embeddings, top_k, filters)
 
-    # Print results
-    print(f"\nTop {k} local results for query: \"{query_text}\"")
-    headlines = []
-    for idx, score in zip(top_indices, top_scores):
-        doc = docs[idx]
-        item = {"text": doc["text"], "label": doc["label"], "score": float(score)}
-        headlines.append(item)
+def hit_ids(hits: list) -> list:
+    return list(dict.fromkeys(doc_id for row in hits for doc_id, _ in row))
 
-    return headlines
+def headline_projection(fields=HEADLINE_FIELDS) -> dict:
+    """
+    MongoDB projection of the stored fields among `fields`, or None when only ids and scores are needed.
+    """
+    stored = [field for field in fields if field not in ("id", "score")]
+    return {"_id": 1, **{field: 1 for field in stored}} if stored else None
+
+def to_headlines(hits: list, docs: list = None, fields=HEADLINE_FIELDS) -> list:
+    """
+    Joins scored hits with their hydrated documents, keeping only `fields`. Hits whose document
+    is gone are dropped; with `docs` None (nothing hydrated) every hit is kept.
+    """
+    docs = None if docs is None else {doc["_id"]: doc for doc in docs}
+    results = []
+    for row in hits:
+        headlines = []
+        for doc_id, score in row:
+            doc = {} if docs is None else docs.get(doc_id)
+            if doc is not None:
+                headlines.append({field: score if field == "score" else doc_id if field == "id" else doc.get(field)
+                                  for field in fields})
+        results.append(headlines)
+    return results
 
 if __name__ == "__main__":
+    from news_tools import RESPONSE_FIELDS
     dotenv.load_dotenv()
     parser = argparse.ArgumentParser(description="Run local vector search with sentence-transformers")
     parser.add_argument("--mongo_url", help="MongoDB connection URI (optional, defaults to env MONGO_URL or localhost)")
     parser.add_argument("query_text", nargs="?", default="Breaking news about sports",
                         help="Query text to search for (default: 'Breaking news about sports')")
+    parser.add_argument("--label", type=int, nargs="+", help="Only return documents with these labels")
+    parser.add_argument("--hybrid", action="store_true", help="Fuse with a MongoDB text search by reciprocal rank fusion")
+    parser.add_argument("--top_k", type=int, default=5, help="Number of results to return")
+    parser.add_argument("--fields", nargs="+", choices=RESPONSE_FIELDS, default=list(HEADLINE_FIELDS),
+                        help="Fields to return per result")
+    parser.add_argument("--rerank", action="store_true", help="Rerank the top candidates with a cross-encoder")
+    parser.add_argument("--namespace", default="testdb.ag_news", help="database.collection to search")
+    parser.add_argument("--model", default=DEFAULT_NAMESPACE["model"], help="Model the collection was embedded with")
     args = parser.parse_args()
 
     # Resolve MongoDB connection string
     mongo_url = args.mongo_url or os.getenv("MONGO_URL", "mongodb://localhost:27017/")
 
     # Execute vector search
-    headlines = run_local_vector_search(args.query_text, mongo_url)
+    filters = {"label": {"$in": args.label}} if args.label else None
+    database, collection = args.namespace.split(".", 1)
+    namespace = {"database": database, "collection": collection, "model": args.model}
+    headlines = run_local_vector_search(args.query_text, mongo_url, args.top_k, filters, args.hybrid, namespace,
+                                        tuple(dict.fromkeys(args.fields)), args.rerank)
     for i, headline in enumerate(headlines, start=1):
-        print(f"{i}. {headline['text']} (score: {headline['score']:.4f})")
+        details = ", ".join(f"{field}: {value:.4f}" if field == "score" and value is not None else f"{field}: {value}"
+                            for field, value in headline.items() if field != "text")
+        if "text" in headline:
+            print(f"{i}. {headline['text']} ({details})")
+        else:
+            print(f"{i}. {details}")
 
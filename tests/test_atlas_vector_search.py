@@ -3,12 +3,13 @@ import unittest
 from unittest.mock import patch, MagicMock
 
 import dotenv
-from atlas_vector_search import run_atlas_vector_search
+from bson.binary import Binary, BinaryVectorDtype
+from atlas_vector_search import run_atlas_vector_search, tune_num_candidates, vector_search_stage
 
 class TestAtlasVectorSearch(unittest.TestCase):
-    @patch("atlas_vector_search.MongoClient")
-    @patch("atlas_vector_search.SentenceTransformer")
-    def test_run_atlas_vector_search(self, mock_model_class, mock_mongo_client):
+    @patch("atlas_vector_search.get_client")
+    @patch("atlas_vector_search.get_model")
+    def test_run_atlas_vector_search(self, mock_get_model, mock_mongo_client):
         # Mock MongoDB aggregate results
         mock_collection = MagicMock()
         mock_aggregate_result = [
@@ -21,7 +22,7 @@ class TestAtlasVectorSearch(unittest.TestCase):
         # Mock SentenceTransformer
         mock_model = MagicMock()
         mock_model.encode.return_value = [[0.1, 0.2, 0.3]]
-        mock_model_class.return_value = mock_model
+        mock_get_model.return_value = mock_model
 
         # Run the function
         import dotenv
@@ -34,5 +35,64 @@ class TestAtlasVectorSearch(unittest.TestCase):
         self.assertEqual(results[0]["label"], "sports")
         self.assertEqual(results[1]["label"], "tech")
 
+class TestAtlasSearchOptions(unittest.TestCase):
+    def test_stage_defaults_to_binary_query_and_multiplier(self):
+        with patch.dict(os.environ, {}, clear=True):
+            stage = vector_search_stage([0.5, -0.25], top_k=10)["$vectorSearch"]
+        self.assertEqual(stage["index"], "vector_index")
+        self.assertEqual(stage["limit"], 10)
+        self.assertEqual(stage["numCandidates"], 200)
+        self.assertIsInstance(stage["queryVector"], Binary)
+        self.assertEqual(stage["queryVector"].as_vector().dtype, BinaryVectorDtype.FLOAT32)
+        self.assertEqual(stage["queryVector"].as_vector().data, [0.5, -0.25])
+
+    def test_stage_options(self):
+        env = {"ATLAS_VECTOR_INDEX": "idx", "ATLAS_NUM_CANDIDATES": "40", "ATLAS_BINARY_QUERY": "false"}
+        with patch.dict(os.environ, env, clear=True):
+            stage = vector_search_stage([0.5], top_k=5, filters={"label": 1})["$vectorSearch"]
+            self.assertEqual((stage["index"], stage["numCandidates"], stage["filter"]), ("idx", 40, {"label": 1}))
+            self.assertEqual(stage["queryVector"], [0.5])
+            self.assertEqual(vector_search_stage([0.5], 5, num_candidates=50000)["$vectorSearch"]["numCandidates"], 10000)
+            # An explicit multiplier wins over the tuned default
+            self.assertEqual(vector_search_stage([0.5], 5, candidate_multiplier=3)["$vectorSearch"]["numCandidates"], 15)
+            exact = vector_search_stage([0.5], 5, exact=True)["$vectorSearch"]
+        self.assertTrue(exact["exact"])
+        self.assertNotIn("numCandidates", exact)
+
+    @patch("atlas_vector_search.get_client")
+    @patch("atlas_vector_search.get_model")
+    def test_namespace_and_top_k(self, mock_get_model, mock_get_client):
+        mock_get_model.return_value.encode.return_value = [[0.3, 0.4]]
+        database = mock_get_client.return_value.__getitem__.return_value
+        database.__getitem__.return_value.aggregate.return_value = [
+            {"_id": i, "text": f"h{i}", "label": 0, "score": 1.0 - i / 10} for i in range(8)]
+
+        results = run_atlas_vector_search("namespace query", "mongodb://localhost", top_k=8, namespace="news.items",
+                                          candidate_multiplier=3)
+        mock_get_client.return_value.__getitem__.assert_called_with("news")
+        database.__getitem__.assert_called_with("items")
+        stage = database.__getitem__.return_value.aggregate.call_args.args[0][0]["$vectorSearch"]
+        self.assertEqual((stage["limit"], stage["numCandidates"]), (8, 24))
+        self.assertEqual(len(results), 8)
+
+    def test_tune_picks_smallest_passing_num_candidates(self):
+        # Recall grows with numCandidates: the ANN finds all true neighbors from 30 candidates on
+        truth = [[0, 1, 2, 3, 4], [5, 6, 7, 8, 9]]
+        collection = MagicMock()
+
+        def aggregate(pipeline):
+            stage = pipeline[0]["$vectorSearch"]
+            found = min(5, stage["numCandidates"] // 6)
+            query = 0 if stage["queryVector"].as_vector().data[0] == 1.0 else 1
+            return [{"_id": doc_id} for doc_id in truth[query][:found]] + [{"_id": -1}] * (5 - found)
+
+        collection.aggregate.side_effect = aggregate
+        report = tune_num_candidates(collection, [[1.0, 0.0], [0.0, 1.0]], recall_target=1.0, top_k=5, truth=truth)
+        self.assertEqual(report["num_candidates"], 30)
+        self.assertEqual(report["candidate_multiplier"], 6)
+        self.assertTrue(report["target_met"])
+        self.assertEqual([t["num_candidates"] for t in report["trials"]], sorted(t["num_candidates"] for t in report["trials"]))
+        self.assertTrue(all(t["recall"] < 1.0 for t in report["trials"] if t["num_candidates"] < 30))
+
 if __name__ == "__main__":
     unittest.main()
\ No newline at end of file
@@ -0,0 +1,96 @@
+import os
+import tempfile
+import unittest
+from unittest.mock import MagicMock
+
+import numpy as np
+from benchmark import (RecordedCollection, RecordingCollection, compare_reports, exact_top_k, label_precision,
+                       load_corpus, noisy_queries, run_atlas_target, run_index_target, synthetic_corpus)
+from index_backends import ExactBackend
+
+class TestBenchmark(unittest.TestCase):
+    def test_synthetic_corpus_is_deterministic_and_normalized(self):
+        first = synthetic_corpus(3000, 16, seed=3)
+        self.assertEqual(first.shape, (3000, 16))
+        np.testing.assert_allclose(np.linalg.norm(first, axis=1), 1.0, rtol=1e-5)
+        np.testing.assert_array_equal(first, synthetic_corpus(3000, 16, seed=3))
+
+    def test_cached_corpus_is_memory_mapped(self):
+        with tempfile.TemporaryDirectory() as cache:
+            generated = load_corpus(500, 8, seed=1, cache=cache)
+            cached = load_corpus(500, 8, seed=1, cache=cache)
+            self.assertIsInstance(cached, np.memmap)
+            np.testing.assert_array_equal(np.asarray(generated), synthetic_corpus(500, 8, seed=1))
+            self.assertEqual(os.listdir(cache), ["synthetic-500x8-seed1"])
+
+    def test_exact_top_k_matches_a_single_scan(self):
+        matrix = synthetic_corpus(300000, 8, seed=2)
+        queries = noisy_queries(matrix, 5)
+        expected, _ = ExactBackend().search(matrix, queries, 10)
+        np.testing.assert_array_equal(exact_top_k(matrix, queries, 10), expected)
+
+    def test_index_targets_report_metrics(self):
+        matrix = synthetic_corpus(2000, 32)
+        queries = noisy_queries(matrix, 20)
+        truth = exact_top_k(matrix, queries, 10).tolist()
+        exact = run_index_target("exact", matrix, queries, truth, ks=(1, 10), batch=4, warmup=2)
+        self.assertEqual(exact["recall@10"], 1.0)
+        self.assertEqual((exact["queries"], exact["batch"], exact["corpus"], exact["dimension"]), (20, 4, 2000, 32))
+        self.assertEqual(exact["index_bytes"], matrix.nbytes)
+        self.assertGreater(exact["qps"], 0)
+        self.assertLessEqual(exact["p50_ms"], exact["p99_ms"])
+
+        int8 = run_index_target("int8", matrix, queries, truth, ks=(10,), warmup=0)
+        self.assertEqual(int8["index_bytes"], matrix.size + 4 * len(matrix))
+        self.assertGreater(int8["recall@10"], 0.8)
+        with self.assertRaises(ValueError):
+            run_index_target("hnsw", matrix, queries, truth)
+
+    def test_recorded_atlas_stand_in_replays_responses(self):
+        vectors = np.eye(3, dtype=np.float32)
+        live = MagicMock()
+        live.aggregate.side_effect = lambda pipeline: [{"_id": int(np.argmax(
+            pipeline[0]["$vectorSearch"]["queryVector"].as_vector().data)), "score": 1.0}]
+        recorder = RecordingCollection(live)
+        truth = [[0], [1], [9]]
+        live_report = run_atlas_target(recorder, vectors, truth, ks=(1,), warmup=0, corpus=10)
+        self.assertEqual(len(recorder.calls), 3)
+
+        replayed = RecordedCollection({"calls": recorder.calls}, latency=0)
+        report = run_atlas_target(replayed, vectors, truth, ks=(1,), warmup=0, corpus=10)
+        self.assertTrue(report["replayed"])
+        self.assertEqual(report["recall@1"], live_report["recall@1"])
+        self.assertAlmostEqual(report["recall@1"], 2 / 3)
+        with self.assertRaises(KeyError):
+            run_atlas_target(replayed, np.ones((1, 3), dtype=np.float32), [[0]], ks=(1,), warmup=0)
+
+    def test_compare_flags_regressions_beyond_tolerance(self):
+        base = {"target": "exact", "corpus": 1000, "dimension": 384, "batch": 1, "top_k": 10,
+                "qps": 1000.0, "p99_ms": 2.0, "recall@10": 1.0, "index_bytes": 100, "rss_bytes": 10}
+        baseline = {"results": [base]}
+        current = {"results": [dict(base, qps=950.0, p99_ms=2.5, **{"recall@10": 0.95}, rss_bytes=99),
+                               dict(base, corpus=5000)]}
+        rows = {row["metric"]: row for row in compare_reports(baseline, current, tolerance=0.1)}
+        self.assertEqual(set(rows), {"qps", "p99_ms", "recall@10", "index_bytes"})
+        self.assertFalse(rows["qps"]["regression"])
+        self.assertTrue(rows["p99_ms"]["regression"])
+        self.assertTrue(rows["recall@10"]["regression"])
+        self.assertFalse(rows["index_bytes"]["regression"])
+        self.assertAlmostEqual(rows["qps"]["change"], -0.05)
+
+        # Runs at different nprobe are different results, not a regression of one another
+        ivf = dict(base, target="ivf", nprobe=8)
+        self.assertEqual(compare_reports({"results": [ivf]}, {"results": [dict(ivf, nprobe=2, **{"recall@10": 0.5})]}), [])
+
+    def test_label_precision_skips_the_query_document(self):
+        labeled = [(1, 0), (2, 3)]
+        ranked = [[{"id": 1, "label": 0}, {"id": 4, "label": 0}, {"id": 5, "label": 2}],
+                  [{"id": 6, "label": 3}, {"id": 2, "label": 3}, {"id": 7, "label": 1}]]
+        self.assertEqual(label_precision(labeled, ranked, 1), 1.0)
+        self.assertEqual(label_precision(labeled, ranked, 2), 0.5)
+        rows = compare_reports({"results": [{"target": "rerank", "label_precision@5": 0.8}]},
+                               {"results": [{"target": "rerank", "label_precision@5": 0.7}]})
+        self.assertTrue(rows[0]["regression"])
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,53 @@
+import os
+import tempfile
+import unittest
+from unittest.mock import MagicMock
+
+import numpy as np
+from embedding_cache import EmbeddingCache, SQLiteStore, cache_key
+
+def fake_model():
+    model = MagicMock()
+    model.encode.side_effect = lambda texts, **kwargs: np.array([[len(t), 1.0] for t in texts], dtype=np.float32)
+    return model
+
+class TestEmbeddingCache(unittest.TestCase):
+    def test_keys_normalize_whitespace_and_include_model(self):
+        self.assertEqual(cache_key("m", "Atlanta  Braves "), cache_key("m", "Atlanta Braves"))
+        self.assertNotEqual(cache_key("m", "Atlanta Braves"), cache_key("other", "Atlanta Braves"))
+
+    def test_encodes_only_misses(self):
+        cache = EmbeddingCache(capacity=10)
+        model = fake_model()
+
+        cache.encode(model, ["a", "bb"], "m")
+        embeddings = cache.encode(model, ["bb", "ccc", "ccc"], "m")
+
+        self.assertEqual(embeddings[:, 0].tolist(), [2, 3, 3])
+        self.assertEqual(model.encode.call_args_list[-1].args[0], ["ccc"])
+        stats = cache.stats()
+        self.assertEqual((stats["memory_hits"], stats["misses"]), (1, 3))
+
+    def test_lru_eviction(self):
+        cache = EmbeddingCache(capacity=2)
+        model = fake_model()
+        cache.encode(model, ["a", "bb", "ccc"], "m")
+        self.assertEqual(cache.stats()["entries"], 2)
+        cache.encode(model, ["a"], "m")
+        self.assertEqual(cache.stats()["misses"], 4)
+
+    def test_sqlite_tier_survives_new_process_cache(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "cache.db")
+            EmbeddingCache(store=SQLiteStore(path)).encode(fake_model(), ["a", "bb"], "m")
+
+            cache = EmbeddingCache(store=SQLiteStore(path))
+            model = fake_model()
+            embeddings = cache.encode(model, ["bb", "a"], "m")
+
+            model.encode.assert_not_called()
+            self.assertEqual(embeddings[:, 0].tolist(), [2, 1])
+            self.assertEqual(cache.stats()["store_hits"], 2)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,110 @@
+import unittest
+from unittest.mock import MagicMock
+
+import numpy as np
+from bson.min_key import MinKey
+from embedding_index import EmbeddingIndex
+
+def polled_collection(collection, ids, changed):
+    # Answers the refresh's id sweep with `ids` and its change query with `changed`
+    collection.find.side_effect = lambda query, projection=None: (
+        [{"_id": doc_id} for doc_id in ids] if query == {"_id": {"$gte": MinKey()}} else changed)
+
+class TestEmbeddingIndex(unittest.TestCase):
+    def setUp(self):
+        self.collection = MagicMock()
+        self.collection.find.return_value = [
+            {"_id": 1, "embedding": [1.0, 0.0]},
+            {"_id": 2, "embedding": [0.0, 1.0]},
+            {"_id": 3, "embedding": [0.7, 0.7]},
+        ]
+        self.index = EmbeddingIndex(self.collection).load()
+
+    def test_load_builds_contiguous_float32_matrix(self):
+        self.assertEqual(len(self.index), 3)
+        self.assertEqual(self.index.embeddings.dtype, np.float32)
+        self.assertTrue(self.index.embeddings.flags["C_CONTIGUOUS"])
+        self.assertEqual(list(self.index.ids), [1, 2, 3])
+
+    def test_search_orders_by_score(self):
+        hits = self.index.search([1.0, 0.1], top_k=2)
+        self.assertEqual([doc_id for doc_id, _ in hits], [1, 3])
+
+    def test_search_many_matches_single_searches(self):
+        queries = np.array([[1.0, 0.1], [0.0, 1.0]], dtype=np.float32)
+        batch = self.index.search_many(queries, top_k=2)
+        self.assertEqual(batch, [self.index.search(q, top_k=2) for q in queries])
+
+    def test_upsert_and_remove(self):
+        self.index.upsert(4, [-1.0, 0.0])
+        self.index.upsert(2, [2.0, 0.0])
+        self.assertTrue(self.index.remove(1))
+        self.assertFalse(self.index.remove(1))
+
+        self.assertEqual(len(self.index), 3)
+        self.assertEqual(self.index.search([1.0, 0.0], top_k=1), [(2, 2.0)])
+
+    def test_refresh_polls_for_new_ids(self):
+        self.collection.estimated_document_count.return_value = 4
+        polled_collection(self.collection, [1, 2, 3, 4], [{"_id": 4, "embedding": [0.5, 0.5]}])
+
+        self.assertEqual(self.index.refresh(), 1)
+        self.collection.find.assert_called_with({"_id": {"$gt": 3}}, {"_id": 1, "embedding": 1, "embedding_scale": 1, "updated_at": 1})
+        self.assertEqual(len(self.index), 4)
+
+    def test_unchanged_collection_skips_the_id_sweep(self):
+        self.collection.estimated_document_count.return_value = 3
+        polled_collection(self.collection, [1, 2, 3], [])
+        self.collection.find.reset_mock()
+
+        self.assertEqual(self.index.refresh(), 0)
+        self.collection.find.assert_called_once_with({"_id": {"$gt": 3}}, {"_id": 1, "embedding": 1, "embedding_scale": 1, "updated_at": 1})
+
+    def test_refresh_removes_deleted_ids_when_count_is_unchanged(self):
+        # One document deleted and one inserted between polls
+        self.collection.estimated_document_count.return_value = 3
+        polled_collection(self.collection, [1, 3, 4], [{"_id": 4, "embedding": [0.5, 0.5]}])
+
+        self.assertEqual(self.index.refresh(), 2)
+        self.assertEqual(sorted(self.index.ids), [1, 3, 4])
+        self.assertNotIn(2, [doc_id for doc_id, _ in self.index.search([0.0, 1.0], top_k=3)])
+
+    def test_change_stream_events(self):
+        self.index._apply_change({"operationType": "insert", "documentKey": {"_id": 5},
+                                  "fullDocument": {"_id": 5, "embedding": [0.0, -1.0]}})
+        self.index._apply_change({"operationType": "delete", "documentKey": {"_id": 2}})
+        self.assertEqual(sorted(self.index.ids), [1, 3, 5])
+
+    def test_hydrate_preserves_order(self):
+        self.collection.find.return_value = [{"_id": 1, "text": "a"}, {"_id": 3, "text": "c"}]
+        docs = self.index.hydrate([3, 1])
+        self.assertEqual([doc["text"] for doc in docs], ["c", "a"])
+
+class TestEmbeddingIndexFilters(unittest.TestCase):
+    def setUp(self):
+        self.collection = MagicMock()
+        self.collection.find.return_value = [
+            {"_id": 1, "embedding": [1.0, 0.0], "label": 0},
+            {"_id": 2, "embedding": [0.9, 0.1], "label": 1},
+            {"_id": 3, "embedding": [0.0, 1.0], "label": 1},
+            {"_id": 4, "embedding": [0.7, 0.7], "label": 2},
+        ]
+        self.index = EmbeddingIndex(self.collection, filter_fields=("label",)).load()
+
+    def test_filters_restrict_scored_rows(self):
+        self.assertEqual([doc_id for doc_id, _ in self.index.search([1.0, 0.0], top_k=2, filters={"label": 1})], [2, 3])
+        hits = self.index.search([1.0, 0.0], top_k=5, filters={"label": {"$in": [0, 2]}})
+        self.assertEqual([doc_id for doc_id, _ in hits], [1, 4])
+        self.assertEqual(self.index.search([1.0, 0.0], filters={"label": 9}), [])
+        with self.assertRaises(ValueError):
+            self.index.search([1.0, 0.0], filters={"source": "x"})
+
+    def test_posting_lists_follow_upserts_and_removes(self):
+        self.index.upsert(5, [1.0, 0.0], {"label": 1})
+        self.index.upsert(2, [0.9, 0.1], {"label": 0})
+        self.assertTrue(self.index.remove(1))  # moves doc 5 into the freed row
+        self.assertEqual([doc_id for doc_id, _ in self.index.search([1.0, 0.0], top_k=5, filters={"label": 1})], [5, 3])
+        self.assertEqual([doc_id for doc_id, _ in self.index.search([1.0, 0.0], top_k=5, filters={"label": 0})], [2])
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,85 @@
+import os
+import tempfile
+import unittest
+from datetime import datetime
+from unittest.mock import MagicMock
+
+import numpy as np
+from bson import ObjectId
+from bson.min_key import MinKey
+from embedding_index import EmbeddingIndex
+from embedding_snapshot import load_snapshot, write_snapshot
+
+def polled_collection(collection, ids, changed):
+    # Answers the catch-up's id sweep with `ids` and its change query with `changed`
+    collection.find.side_effect = lambda query, projection=None: (
+        [{"_id": doc_id} for doc_id in ids] if query == {"_id": {"$gte": MinKey()}} else changed)
+
+class TestEmbeddingSnapshot(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp.name, "ag_news")
+        self.matrix = np.arange(12, dtype=np.float32).reshape(4, 3)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_round_trip_is_memory_mapped(self):
+        header = write_snapshot(self.path, self.matrix, [0, 1, 2, 3], model="all-MiniLM-L6-v2")
+        matrix, ids, loaded = load_snapshot(self.path, model="all-MiniLM-L6-v2", verify=True)
+
+        self.assertIsInstance(matrix, np.memmap)
+        np.testing.assert_array_equal(matrix, self.matrix)
+        self.assertEqual(list(ids), [0, 1, 2, 3])
+        self.assertEqual(loaded, header)
+        self.assertEqual((header["count"], header["dimension"]), (4, 3))
+
+    def test_object_ids_and_overwrite(self):
+        ids = [ObjectId() for _ in range(4)]
+        write_snapshot(self.path, np.zeros((4, 3)), [0, 1, 2, 3], model="m")
+        write_snapshot(self.path, self.matrix, ids, model="m")
+
+        _, loaded_ids, header = load_snapshot(self.path, verify=True)
+        self.assertEqual(header["id_format"], "extended_json")
+        self.assertEqual(list(loaded_ids), ids)
+
+    def test_checksum_and_model_mismatch(self):
+        write_snapshot(self.path, self.matrix, [0, 1, 2, 3], model="all-MiniLM-L6-v2")
+        with self.assertRaises(ValueError):
+            load_snapshot(self.path, model="other-model")
+
+        with open(os.path.join(self.path, "embeddings.f32"), "r+b") as f:
+            f.write(b"\x00\x00\x80\x3f")
+        with self.assertRaises(ValueError):
+            load_snapshot(self.path, verify=True)
+
+    def test_index_loads_snapshot_and_catches_up(self):
+        write_snapshot(self.path, self.matrix, [0, 1, 2, 3], model="m")
+        collection = MagicMock()
+        # Document 2 was deleted after the snapshot was written
+        collection.estimated_document_count.return_value = 4
+        polled_collection(collection, [0, 1, 3, 4], [{"_id": 4, "embedding": [0.0, 0.0, 100.0]}])
+
+        index = EmbeddingIndex(collection).load_snapshot(self.path)
+
+        collection.find.assert_any_call({"_id": {"$gt": 3}}, {"_id": 1, "embedding": 1, "embedding_scale": 1, "updated_at": 1})
+        self.assertEqual(sorted(index.ids), [0, 1, 3, 4])
+        self.assertEqual(index.search([0.0, 0.0, 1.0], top_k=1)[0][0], 4)
+
+    def test_index_catches_up_on_updates_after_the_snapshot(self):
+        written_at = datetime(2026, 10, 1, 12, 0)
+        header = write_snapshot(self.path, self.matrix, [0, 1, 2, 3], model="m", last_updated=written_at)
+        self.assertEqual(header["last_updated"], {"$date": "2026-10-01T12:00:00Z"})
+        collection = MagicMock()
+        collection.estimated_document_count.return_value = 4
+        polled_collection(collection, [0, 1, 2, 3], [{"_id": 1, "embedding": [0.0, 0.0, 100.0], "updated_at": datetime(2026, 10, 2)}])
+
+        index = EmbeddingIndex(collection).load_snapshot(self.path)
+
+        query = collection.find.call_args.args[0]
+        self.assertEqual(query, {"$or": [{"_id": {"$gt": 3}}, {"updated_at": {"$gt": written_at}}]})
+        self.assertEqual(index.search([0.0, 0.0, 1.0], top_k=1)[0][0], 1)
+        self.assertEqual(index._last_updated, datetime(2026, 10, 2))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,142 @@
+import os
+import shutil
+import tempfile
+import unittest
+from unittest.mock import patch
+
+import numpy as np
+import torch
+from sentence_transformers import SentenceTransformer, models
+from transformers import BertConfig, BertModel, BertTokenizerFast
+
+from encoder_backends import FastEncoder, agreement, cache_name, load_encoder, query_backend, validate
+import model_registry
+from model_registry import ModelRegistry
+
+WORDS = "the a braves mets win lose beat home again atlanta stocks fall rise oil prices market game season".split()
+TEXTS = ["Braves beat Mets at home", "Oil prices rise again", "stocks fall as market slides", "Atlanta wins the season",
+         "Mets lose", "a game"]
+
+def build_model(path: str):
+    """
+    Saves a small randomly initialized BERT sentence-transformer, so no download is needed.
+    """
+    os.makedirs(path)
+    with open(os.path.join(path, "vocab.txt"), "w") as f:
+        f.write("\n".join(["[PAD]", "[UNK]", "[CLS]", "[SEP]", "[MASK]"] + WORDS))
+    torch.manual_seed(0)
+    config = BertConfig(vocab_size=len(WORDS) + 5, hidden_size=64, num_hidden_layers=2, num_attention_heads=4,
+                        intermediate_size=128, max_position_embeddings=64)
+    BertModel(config).save_pretrained(path)
+    BertTokenizerFast(os.path.join(path, "vocab.txt")).save_pretrained(path)
+    transformer = models.Transformer(path, max_seq_length=32)
+    SentenceTransformer(modules=[transformer, models.Pooling(64, "mean"), models.Normalize()]).save(path)
+
+class TestEncoderBackends(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.directory = tempfile.mkdtemp()
+        cls.path = os.path.join(cls.directory, "tiny-minilm")
+        build_model(cls.path)
+        cls.reference = SentenceTransformer(cls.path, device="cpu").encode(TEXTS)
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.directory)
+
+    def test_fast_path_matches_stock_encode(self):
+        encoder = load_encoder(self.path, "cpu", "fast")
+        self.assertIsInstance(encoder, FastEncoder)
+        encoded = encoder.encode(TEXTS, batch_size=4)
+        self.assertEqual((encoded.dtype, encoded.shape), (np.float32, self.reference.shape))
+        np.testing.assert_allclose(encoded, self.reference, atol=1e-5)
+        np.testing.assert_allclose(encoder.encode(TEXTS[0]), self.reference[:1], atol=1e-5)
+        self.assertIs(encoder.tokenizer, encoder.model.tokenizer)
+
+    def test_int8_quantizes_linear_layers_and_agrees(self):
+        encoder = load_encoder(self.path, "cpu", "int8")
+        layers = list(encoder.model.modules())
+        self.assertFalse(any(type(layer) is torch.nn.Linear for layer in layers))
+        self.assertTrue(any(isinstance(layer, torch.ao.nn.quantized.dynamic.Linear) for layer in layers))
+        report = agreement(encoder.encode(TEXTS), self.reference)
+        self.assertEqual(report["count"], len(TEXTS))
+        self.assertGreater(report["min_cosine"], 0.98)
+
+    def test_max_seq_length_and_unknown_backend(self):
+        with patch.dict(os.environ, {"ENCODER_MAX_SEQ_LENGTH": "3"}):
+            encoder = load_encoder(self.path, "cpu", "fast")
+        self.assertEqual(encoder.max_seq_length, 3)
+        np.testing.assert_allclose(encoder.encode(["Braves beat Mets at home"]),
+                                   encoder.encode(["Braves"]), atol=1e-5)   # [CLS] braves [SEP]
+        with self.assertRaises(ValueError):
+            load_encoder(self.path, "cpu", "tensorrt")
+        with patch.dict(os.environ, {"ENCODER_BACKEND": "int4"}), self.assertRaises(ValueError):
+            query_backend()
+
+    def test_registry_keeps_backends_apart(self):
+        registry = ModelRegistry(max_models=3)
+        stock = registry.get(self.path, "cpu")
+        fast = registry.get(self.path, "cpu", lambda name, device: load_encoder(name, device, "fast"), variant="fast")
+        self.assertIsNot(stock, fast)
+        self.assertIs(registry.get(self.path, "cpu", variant="fast"), fast)
+        self.assertEqual(registry.loaded(), [(self.path, "cpu"), (self.path, "cpu", "fast")])
+        self.assertTrue(registry.evict(self.path))
+        self.assertEqual(registry.loaded(), [])
+        self.assertEqual((cache_name("m", "torch"), cache_name("m", "int8")), ("m", "m@int8"))
+
+    def test_encode_options(self):
+        encoder = load_encoder(self.path, "cpu", "fast")
+        forward = encoder.model.forward
+        def scaled(features):
+            output = forward(features)
+            output["sentence_embedding"] = output["sentence_embedding"] * 3
+            return output
+        with patch.object(encoder.model, "forward", side_effect=scaled):
+            raw = encoder.encode(TEXTS)
+            normalized = encoder.encode(TEXTS, normalize_embeddings=True, show_progress_bar=False)
+        np.testing.assert_allclose(np.linalg.norm(raw, axis=1), 3.0, atol=1e-4)
+        np.testing.assert_allclose(normalized, raw / 3, atol=1e-5)
+        with self.assertRaises(TypeError):
+            encoder.encode(TEXTS, convert_to_tensor=True)
+        with self.assertRaises(TypeError):
+            encoder.encode(TEXTS, convert_to_numpy=False)
+
+    def test_threads_are_set_once_at_load(self):
+        before = torch.get_num_threads()
+        try:
+            with patch.dict(os.environ, {"ENCODER_THREADS": "1"}):
+                encoder = load_encoder(self.path, "cpu", "fast")
+            self.assertEqual(torch.get_num_threads(), 1)
+            with patch("encoder_backends.torch.set_num_threads") as mock_set_threads:
+                encoder.encode(TEXTS[:1])
+            mock_set_threads.assert_not_called()
+        finally:
+            torch.set_num_threads(before)
+
+    def test_registry_keys_cpu_backends_on_cpu(self):
+        with patch.object(model_registry, "_registry", ModelRegistry(max_models=2)), \
+             patch("model_registry.default_device", return_value="cuda"):
+            encoder = model_registry.get_model(self.path, backend="int8")
+            self.assertIs(model_registry.get_model(self.path, "cpu", backend="int8"), encoder)
+            self.assertEqual(model_registry.get_registry().loaded(), [(self.path, "cpu", "int8")])
+
+class TestFastEncoderWithoutModel(unittest.TestCase):
+    def test_missing_model_raises_attribute_error(self):
+        encoder = FastEncoder.__new__(FastEncoder)
+        with self.assertRaises(AttributeError):
+            encoder.tokenizer
+
+    def test_validate_rejects_empty_sample(self):
+        with self.assertRaises(ValueError):
+            validate([], "fast")
+
+class TestAgreement(unittest.TestCase):
+    def test_cosines_ignore_scale(self):
+        reference = np.array([[1.0, 0.0], [0.0, 1.0], [1.0, 1.0]])
+        report = agreement(np.array([[2.0, 0.0], [1.0, 1.0], [-1.0, -1.0]]), reference)
+        self.assertAlmostEqual(report["mean_cosine"], (1 + 2 ** -0.5 - 1) / 3, places=5)
+        self.assertAlmostEqual(report["min_cosine"], -1.0, places=5)
+        self.assertAlmostEqual(report["p50_cosine"], 2 ** -0.5, places=5)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,129 @@
+import asyncio
+import os
+import unittest
+from unittest.mock import patch, MagicMock
+import httpx2
+import openai
+from endpoint_pool import Endpoint, EndpointPool
+from rate_limiter import RateLimitScheduler
+
+def server_error():
+    response = httpx2.Response(503, request=httpx2.Request("POST", "http://test"))
+    return openai.InternalServerError("unavailable", response=response, body=None)
+
+def endpoint(name, weight=1.0, **kwargs):
+    return Endpoint(name, "gpt-4o", MagicMock(), weight=weight, scheduler=RateLimitScheduler(max_retries=0), **kwargs)
+
+class TestEndpointPool(unittest.TestCase):
+    def test_least_outstanding_spreads_requests(self):
+        east, west = endpoint("east"), endpoint("west")
+        pool = EndpointPool([east, west])
+        first, second = pool.acquire(), pool.acquire()
+        self.assertEqual({first, second}, {east, west})
+
+    def test_weight_scales_share(self):
+        light, heavy = endpoint("light", 1.0), endpoint("heavy", 3.0)
+        pool = EndpointPool([light, heavy])
+        picked = [pool.acquire().name for _ in range(4)]
+        self.assertEqual(picked.count("heavy"), 3)
+
+    def test_latency_strategy_prefers_fast_endpoint(self):
+        slow, fast = endpoint("slow"), endpoint("fast")
+        for e, seconds in ((slow, 2.0), (fast, 0.1)):
+            e.start()
+            e.finish(seconds, failed=False)
+        self.assertIs(EndpointPool([slow, fast], "latency").acquire(), fast)
+
+    def test_fails_over_and_opens_circuit(self):
+        east, west = endpoint("east", failure_threshold=1, cooldown=60), endpoint("west")
+        pool = EndpointPool([east, west])
+
+        def create(e):
+            if e is east:
+                raise server_error()
+            return "ok from " + e.name
+
+        with patch("random.choices", side_effect=lambda population, weights: [population[0]]):
+            self.assertEqual(pool.call(create, 10), "ok from west")
+        self.assertEqual(east.state, "open")
+        self.assertFalse(east.available())
+        stats = pool.stats()
+        self.assertEqual(stats["east"]["errors"], 1)
+        self.assertEqual(stats["west"]["requests"], 1)
+        self.assertEqual(stats["west"]["outstanding"], 0)
+
+    def test_stream_fails_over_before_the_first_chunk(self):
+        east, west = endpoint("east"), endpoint("west")
+        pool = EndpointPool([east, west])
+
+        def create(e):
+            if e is east:
+                raise server_error()
+            return iter(["a", "b"])
+
+        with patch("random.choices", side_effect=lambda population, weights: [population[0]]):
+            chunks = pool.stream(create, 10)
+            self.assertEqual(next(chunks), "a")
+        self.assertEqual((west.outstanding, west.scheduler.stats()["in_flight"]), (1, 1))
+        self.assertEqual(list(chunks), ["b"])
+        self.assertEqual((west.outstanding, west.scheduler.stats()["in_flight"]), (0, 0))
+        self.assertEqual((east.errors, west.errors), (1, 0))
+
+    def test_half_open_trial_closes_circuit(self):
+        e = endpoint("east", failure_threshold=1, cooldown=0)
+        pool = EndpointPool([e])
+        with self.assertRaises(openai.InternalServerError):
+            pool.call(lambda _: (_ for _ in ()).throw(server_error()), 10)
+        self.assertEqual(e.state, "open")
+        self.assertEqual(pool.call(lambda _: "ok", 10), "ok")
+        self.assertEqual(e.state, "closed")
+
+    def test_client_errors_neither_fail_over_nor_count_as_failures(self):
+        east, west = endpoint("east", failure_threshold=2), endpoint("west", failure_threshold=2)
+        calls = []
+
+        def create(e):
+            calls.append(e.name)
+            raise ValueError("bad request")
+
+        pool = EndpointPool([east, west])
+        for _ in range(3):
+            with self.assertRaises(ValueError):
+                pool.call(create, 10)
+        self.assertEqual(len(calls), 3)
+        for e in (east, west):
+            self.assertEqual((e.errors, e.consecutive_failures, e.outstanding, e.state), (0, 0, 0, "closed"))
+        self.assertEqual(east.requests + west.requests, 3)
+        self.assertEqual(len(east.latencies) + len(west.latencies), 3)
+
+    def test_call_async_fails_over(self):
+        east, west = endpoint("east"), endpoint("west")
+        pool = EndpointPool([east, west])
+
+        async def create(e):
+            if e is east:
+                raise server_error()
+            return "ok"
+
+        with patch("random.choices", side_effect=lambda population, weights: [population[0]]):
+            self.assertEqual(asyncio.run(pool.call_async(create, 10)), "ok")
+
+    @patch.dict(os.environ, {"OPENAI_ENDPOINTS": '[{"name": "east", "type": "azure", "endpoint": "https://east.example.com/", '
+                                                 '"api_key": "k1", "model": "gpt-4o", "weight": 2, "rpm": 100}, '
+                                                 '{"name": "openai", "type": "openai", "api_key": "k2"}]'})
+    @patch("openai_client.OpenAI")
+    @patch("openai_client.AzureOpenAI")
+    def test_openai_client_builds_mixed_pool(self, mock_azure, mock_openai):
+        from openai_client import OpenAIClient
+        client = OpenAIClient(model="gpt-4o-mini")
+        east, other = client.pool.endpoints
+        self.assertEqual((east.kind, east.model, east.weight, east.scheduler.rpm), ("azure", "gpt-4o", 2.0, 100))
+        self.assertEqual((other.kind, other.model), ("openai", "gpt-4o-mini"))
+        mock_azure.return_value.chat.completions.create.side_effect = server_error()
+        with patch("random.choices", side_effect=lambda population, weights: [population[0]]):
+            client.get_response([{"role": "user", "content": "Hello"}])
+        self.assertEqual(mock_openai.return_value.chat.completions.create.call_args.kwargs["model"], "gpt-4o-mini")
+        self.assertEqual(set(client.endpoint_stats()), {"east", "openai"})
+
+if __name__ == "__main__":
+    unittest.main()
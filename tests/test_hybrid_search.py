@@ -0,0 +1,65 @@
+import unittest
+from unittest.mock import patch, MagicMock
+
+from pymongo.errors import OperationFailure
+
+from hybrid_search import atlas_filter_clauses, atlas_text_search, reciprocal_rank_fusion, text_search
+from news_tools import category_filter
+
+class TestHybridSearch(unittest.TestCase):
+    def test_reciprocal_rank_fusion(self):
+        fused = reciprocal_rank_fusion([[1, 2, 3], [3, 1, 4]], k=60)
+        self.assertEqual([doc_id for doc_id, _ in fused], [1, 3, 2, 4])
+        self.assertAlmostEqual(fused[0][1], 1 / 61 + 1 / 62)
+        self.assertEqual(len(reciprocal_rank_fusion([[1, 2, 3]], limit=2)), 2)
+
+    def test_text_search_applies_filters(self):
+        collection = MagicMock()
+        collection.full_name = "testdb.ag_news"
+        collection.find.return_value.sort.return_value.limit.return_value = [{"_id": 7}, {"_id": 3}]
+        self.assertEqual(text_search(collection, "Braves", 10, {"label": 1}), [7, 3])
+        self.assertEqual(collection.find.call_args.args[0], {"$text": {"$search": "Braves"}, "label": 1})
+        collection.create_index.assert_not_called()   # searches never write
+
+    def test_text_search_reports_missing_index(self):
+        collection = MagicMock()
+        collection.full_name = "acme.articles"
+        collection.find.return_value.sort.return_value.limit.side_effect = OperationFailure("text index required", 27)
+        with self.assertRaisesRegex(RuntimeError, "hybrid_search.py --namespace acme.articles"):
+            text_search(collection, "Braves", 10)
+
+    def test_atlas_text_search_filter_clauses(self):
+        self.assertEqual(atlas_filter_clauses({"label": 1, "source": {"$in": ["a", "b"]}}),
+                         [{"equals": {"path": "label", "value": 1}}, {"in": {"path": "source", "value": ["a", "b"]}}])
+        collection = MagicMock()
+        collection.aggregate.return_value = [{"_id": 5}]
+        self.assertEqual(atlas_text_search(collection, "Braves", 20, {"label": {"$eq": 1}}, index="text_index"), [5])
+        search = collection.aggregate.call_args.args[0][0]["$search"]
+        self.assertEqual(search["compound"]["filter"], [{"equals": {"path": "label", "value": 1}}])
+
+    def test_category_filter(self):
+        self.assertEqual(category_filter("Sports"), {"label": 1})
+        self.assertIsNone(category_filter(None))
+        with self.assertRaises(ValueError):
+            category_filter("Weather")
+
+    @patch("atlas_vector_search.atlas_text_search", return_value=[9, 1])
+    @patch("atlas_vector_search.get_client")
+    @patch("atlas_vector_search.get_model")
+    def test_atlas_filter_and_hybrid(self, mock_get_model, mock_get_client, mock_text_search):
+        from atlas_vector_search import run_atlas_vector_search
+        collection = MagicMock()
+        collection.aggregate.return_value = [{"_id": 1, "text": "Braves win", "label": 1, "score": 0.9},
+                                             {"_id": 2, "text": "Braves lose", "label": 1, "score": 0.8}]
+        collection.find.return_value = [{"_id": 9, "text": "Braves trade", "label": 1}]
+        mock_get_client.return_value.__getitem__.return_value.__getitem__.return_value = collection
+        mock_get_model.return_value.encode.return_value = [[0.1, 0.2, 0.3]]
+
+        results = run_atlas_vector_search("Braves filter hybrid", "mongodb://localhost", 5, {"label": 1}, hybrid=True)
+        stage = collection.aggregate.call_args.args[0][0]["$vectorSearch"]
+        self.assertEqual(stage["filter"], {"label": 1})
+        self.assertEqual([r["text"] for r in results], ["Braves win", "Braves trade", "Braves lose"])
+        self.assertEqual(mock_text_search.call_args.args[3], {"label": 1})
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,95 @@
+import threading, unittest
+from unittest.mock import MagicMock
+
+import numpy as np
+from embedding_index import EmbeddingIndex
+from index_backends import ExactBackend, IndexBackend, IVFFlatBackend, create_backend, recall_report
+
+def make_corpus(n=2000, dim=32, seed=0):
+    rng = np.random.default_rng(seed)
+    matrix = rng.normal(size=(n, dim)).astype(np.float32)
+    return matrix / np.linalg.norm(matrix, axis=1, keepdims=True)
+
+class TestIndexBackends(unittest.TestCase):
+    def test_exact_backend_orders_by_score(self):
+        matrix = np.array([[1.0, 0.0], [0.0, 1.0], [0.7, 0.7]], dtype=np.float32)
+        positions, scores = ExactBackend().search(matrix, np.array([[1.0, 0.1]], dtype=np.float32), 2)
+        self.assertEqual(positions.tolist(), [[0, 2]])
+        self.assertGreater(scores[0, 0], scores[0, 1])
+
+    def test_ivf_probing_every_list_matches_exact(self):
+        matrix = make_corpus()
+        report = recall_report(matrix, matrix[:50], IVFFlatBackend(nlist=16, nprobe=16), ks=(1, 10))
+        self.assertEqual(report["recall@1"], 1.0)
+        self.assertEqual(report["recall@10"], 1.0)
+
+    def test_ivf_recall_grows_with_nprobe(self):
+        matrix = make_corpus()
+        low = recall_report(matrix, matrix[:50], IVFFlatBackend(nlist=32, nprobe=1), ks=(10,))
+        high = recall_report(matrix, matrix[:50], IVFFlatBackend(nlist=32, nprobe=8), ks=(10,))
+        self.assertLessEqual(low["recall@10"], high["recall@10"])
+
+    def test_num_candidates_sets_lists_to_probe(self):
+        backend = IVFFlatBackend(nlist=10, num_candidates=400)
+        backend.build(make_corpus(n=1000))
+        self.assertEqual(backend.lists_to_probe(), 4)
+
+    def test_ivf_sees_rows_changed_after_build(self):
+        collection = MagicMock()
+        collection.find.return_value = [{"_id": i, "embedding": row.tolist()} for i, row in enumerate(make_corpus(n=500))]
+        index = EmbeddingIndex(collection, backend=IVFFlatBackend(nlist=8, nprobe=1)).load()
+
+        target = np.zeros(32, dtype=np.float32)
+        target[0] = 10.0
+        index.upsert("new", target)
+        index.remove(0)
+
+        hits = index.search(target, top_k=1)
+        self.assertEqual(hits[0][0], "new")
+        self.assertNotIn(0, [doc_id for doc_id, _ in index.search(target, top_k=500)])
+
+    def test_ivf_rebuilds_in_background(self):
+        matrix = make_corpus(n=500)
+        backend = IVFFlatBackend(nlist=8, nprobe=8)
+        backend.build(matrix)
+        for position in range(100):
+            backend.on_upsert(position)
+
+        started, release = threading.Event(), threading.Event()
+        train = backend._train
+        def slow_train(rows):
+            started.set()
+            release.wait(5)
+            return train(rows)
+        backend._train = slow_train
+
+        # The search is answered from the old lists while the rebuild trains
+        positions, _ = backend.search(matrix, matrix[:1], 1)
+        self.assertEqual(positions.tolist(), [[0]])
+        self.assertTrue(started.wait(5))
+        self.assertEqual(backend.builds, 1)
+
+        # A row written during the rebuild stays exact after the swap
+        matrix[3] = matrix[0]
+        backend.on_upsert(3)
+        release.set()
+        backend.wait(5)
+        self.assertEqual(backend.builds, 2)
+        self.assertEqual(backend._pending, {3})
+        self.assertEqual(set(backend.search(matrix, matrix[:1], 2)[0][0].tolist()), {0, 3})
+
+    def test_ivf_scans_everything_before_first_build(self):
+        matrix = make_corpus(n=50)
+        positions, _ = IVFFlatBackend(nlist=4).search(matrix, matrix[:2], 1)
+        self.assertEqual(positions.tolist(), [[0], [1]])
+
+    def test_base_backend_is_abstract(self):
+        with self.assertRaises(TypeError):
+            IndexBackend()
+
+    def test_unknown_backend(self):
+        with self.assertRaises(ValueError):
+            create_backend("hnsw")
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,53 @@
+import unittest
+from unittest.mock import patch, MagicMock
+
+import numpy as np
+from load_data import stream_and_store_vector_data
+
+def fake_encode(texts, batch_size=32):
+    return np.ones((len(texts), 3), dtype=np.float32)
+
+class TestStreamingLoad(unittest.TestCase):
+    def setUp(self):
+        self.dataset = [{"text": f"headline {i}", "label": i % 4} for i in range(10)]
+        self.db = MagicMock()
+        self.collections = {}
+        self.db.__getitem__.side_effect = lambda name: self.collections.setdefault(name, MagicMock(name=name))
+
+    @patch("load_data.get_model")
+    @patch("load_data.get_client")
+    def test_streams_chunks_into_staging_and_swaps(self, mock_mongo_client, mock_get_model):
+        mock_mongo_client.return_value.__getitem__.return_value = self.db
+        mock_get_model.return_value.encode.side_effect = fake_encode
+
+        stream_and_store_vector_data("mongodb://localhost", limit=10, chunk_size=4, dataset=self.dataset)
+
+        staging = self.collections["ag_news_staging"]
+        staging.drop.assert_called_once()
+        chunks = [call.args[0] for call in staging.insert_many.call_args_list]
+        self.assertEqual([len(chunk) for chunk in chunks], [4, 4, 2])
+        self.assertEqual([doc["_id"] for chunk in chunks for doc in chunk], list(range(10)))
+        self.assertTrue(all(call.kwargs["ordered"] is False for call in staging.insert_many.call_args_list))
+        staging.rename.assert_called_once_with("ag_news", dropTarget=True)
+        staging.create_index.assert_called_once_with([("text", "text")])
+
+        offsets = [call.args[1]["$set"]["next_offset"] for call in self.collections["ingest_checkpoints"].update_one.call_args_list]
+        self.assertEqual(offsets, [4, 8, 10])
+
+    @patch("load_data.get_model")
+    @patch("load_data.get_client")
+    def test_resume_continues_from_checkpoint(self, mock_mongo_client, mock_get_model):
+        mock_mongo_client.return_value.__getitem__.return_value = self.db
+        mock_get_model.return_value.encode.side_effect = fake_encode
+        self.db["ingest_checkpoints"].find_one.return_value = {"_id": "testdb.ag_news", "next_offset": 8}
+
+        stream_and_store_vector_data("mongodb://localhost", limit=10, chunk_size=4, resume=True, dataset=self.dataset)
+
+        staging = self.collections["ag_news_staging"]
+        staging.drop.assert_not_called()
+        docs = staging.insert_many.call_args.args[0]
+        self.assertEqual([doc["_id"] for doc in docs], [8, 9])
+        self.assertEqual(docs[0]["text"], "headline 8")
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,89 @@
+import unittest
+from unittest.mock import patch, MagicMock
+import requests
+from mcp_client import McpClient, load_report, render_event
+
+def make_response(status, body=None, headers=None):
+    response = MagicMock()
+    response.status_code = status
+    response.headers = headers or {}
+    response.json.return_value = body or {}
+    return response
+
+class TestMcpClient(unittest.TestCase):
+    def test_base_url_from_env(self):
+        with patch.dict("os.environ", {"MCP_URL": "http://example:8080/"}):
+            self.assertEqual(McpClient().base_url, "http://example:8080")
+
+    @patch("mcp_client.time.sleep")
+    def test_retries_on_5xx_then_succeeds(self, mock_sleep):
+        client = McpClient("http://server", retries=3)
+        with patch.object(client.session, "post", side_effect=[make_response(503), make_response(200, {"data": ["x"]})]) as mock_post:
+            self.assertEqual(client.send_request("hello"), {"data": ["x"]})
+        self.assertEqual(mock_post.call_count, 2)
+        mock_post.assert_called_with("http://server/mcp", json={"input": "hello"}, timeout=client.timeout)
+        mock_sleep.assert_called_once()
+
+    @patch("mcp_client.time.sleep")
+    def test_honors_retry_after(self, mock_sleep):
+        client = McpClient("http://server", retries=1)
+        with patch.object(client.session, "post", side_effect=[make_response(429, headers={"Retry-After": "2"}),
+                                                               make_response(200)]):
+            client.send_request("hello")
+        mock_sleep.assert_called_once_with(2.0)
+
+    @patch("mcp_client.time.sleep")
+    def test_gives_up_after_retries(self, mock_sleep):
+        client = McpClient("http://server", retries=2)
+        with patch.object(client.session, "post", side_effect=requests.ConnectionError("refused")) as mock_post:
+            with self.assertRaises(requests.ConnectionError):
+                client.send_request("hello")
+        self.assertEqual(mock_post.call_count, 3)
+        with patch.object(client.session, "post", return_value=make_response(503)) as mock_post:
+            self.assertEqual(client.post("/mcp", {"input": "hello"}).status_code, 503)
+        self.assertEqual(mock_post.call_count, 3)
+
+    @patch("mcp_client.time.sleep")
+    def test_retries_timeouts(self, mock_sleep):
+        client = McpClient("http://server", retries=1)
+        with patch.object(client.session, "post", side_effect=[requests.Timeout("read"), make_response(200)]) as mock_post:
+            self.assertEqual(client.post("/mcp", {}).status_code, 200)
+        self.assertEqual(mock_post.call_count, 2)
+
+    def test_does_not_retry_deterministic_errors(self):
+        client = McpClient("http://server")
+        for status in (400, 500, 504):
+            with patch.object(client.session, "post", return_value=make_response(status)) as mock_post:
+                self.assertEqual(client.post("/mcp", {}).status_code, status)
+            mock_post.assert_called_once()
+
+    @patch("mcp_client.time.sleep")
+    def test_run_load_reports_throughput_and_histogram(self, mock_sleep):
+        client = McpClient("http://server", retries=0)
+        responses = {"ok": make_response(200), "bad": make_response(500)}
+        with patch.object(client.session, "post", side_effect=lambda url, json, **kw: responses[json["input"]]):
+            report = client.run_load(["ok", "ok", "bad", "ok"], concurrency=2)
+        self.assertEqual(report["requests"], 4)
+        self.assertEqual(report["errors"], 1)
+        self.assertEqual(sum(report["histogram"].values()), 4)
+        self.assertGreater(report["throughput_rps"], 0)
+
+    @patch("builtins.print")
+    def test_render_event_handles_missing_fields_and_scores(self, mock_print):
+        render_event("hit", {"tool": "find_headline_report", "rank": 1, "text": "Braves win", "label": 1, "score": 0.91234})
+        render_event("hit", {"tool": "find_headline_report", "rank": 2, "text": "Braves lose", "score": None})
+        render_event("hit", {"tool": "find_headline_report", "rank": 3, "id": 7})
+        self.assertEqual([call.args[0] for call in mock_print.call_args_list],
+                         ["1. Braves win (label: 1, score: 0.9123)", "2. Braves lose (score: n/a)", "3. id: 7"])
+
+    def test_load_report_buckets(self):
+        report = load_report([0.001, 0.03, 0.2, 20.0], errors=0, seconds=2.0, concurrency=1)
+        self.assertEqual(report["histogram"]["<=5ms"], 1)
+        self.assertEqual(report["histogram"]["<=50ms"], 1)
+        self.assertEqual(report["histogram"]["<=250ms"], 1)
+        self.assertEqual(report["histogram"][">10000ms"], 1)
+        self.assertEqual(report["throughput_rps"], 2.0)
+        self.assertEqual(report["p50_ms"], 200.0)
+
+if __name__ == "__main__":
+    unittest.main()
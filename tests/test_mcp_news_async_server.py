@@ -0,0 +1,89 @@
+import os
+import unittest
+from unittest.mock import patch, AsyncMock, MagicMock
+
+from aiohttp.test_utils import AioHTTPTestCase
+
+with patch.dict(os.environ, {"USE_AZURE_OPENAI": "false", "OPENAI_API_KEY": "fake-key"}):
+    import mcp_news_async_server
+
+from news_tools import use_page
+
+def llm_response(name, arguments):
+    call = MagicMock()
+    call.function.name = name
+    call.function.arguments = arguments
+    response = MagicMock()
+    response.choices[0].message.tool_calls = [call]
+    return response
+
+class TestMcpNewsAsyncServer(AioHTTPTestCase):
+    async def get_application(self):
+        return mcp_news_async_server.create_app()
+
+    async def test_missing_input(self):
+        response = await self.client.post("/mcp", json={})
+        self.assertEqual(response.status, 400)
+
+    async def test_routes_through_async_llm_and_search(self):
+        headlines = [{"text": "Braves win", "label": 1, "score": 0.9}]
+        router = mcp_news_async_server.router
+        router.cache._entries.clear()
+        mock_find = AsyncMock(return_value=headlines)
+        self.app[mcp_news_async_server.dispatcher_key].registry["find_headline_report"] = mock_find
+        with patch.object(router.agent, "get_response_async",
+                          AsyncMock(return_value=llm_response("find_headline_report", '{"headline": "Braves"}'))):
+            response = await self.client.post("/mcp", json={"input": "Atlanta Braves"})
+            body = await response.json()
+
+        self.assertEqual(response.status, 200, body)
+        self.assertEqual(body, {"tool": "find_headline_report", "arguments": {"headline": "Braves"},
+                                "result": "find_headline_report", "data": headlines})
+        self.assertEqual(mock_find.await_args.kwargs, {"headline": "Braves"})
+
+    async def test_timings_and_metrics(self):
+        router = mcp_news_async_server.router
+        router.cache._entries.clear()
+        self.app[mcp_news_async_server.dispatcher_key].registry["find_headline_report"] = AsyncMock(return_value=[])
+        with patch.object(router.agent, "get_response_async",
+                          AsyncMock(return_value=llm_response("find_headline_report", '{"headline": "Falcons"}'))):
+            response = await self.client.post("/mcp", json={"input": "Atlanta Falcons", "timings": True})
+            body = await response.json()
+
+        self.assertEqual(response.status, 200, body)
+        self.assertIn("tool", body["timings"]["stages_ms"])
+        self.assertGreaterEqual(body["timings"]["total_ms"], body["timings"]["stages_ms"]["tool"])
+        self.assertEqual(body["timings"]["counters"], {"route_decisions_llm": 1})
+
+        response = await self.client.get("/metrics")
+        text = await response.text()
+        self.assertEqual(response.status, 200)
+        self.assertIn('mcp_stage_seconds_count{stage="tool"}', text)
+        self.assertIn('mcp_requests_total{endpoint="/mcp",status="200"}', text)
+        self.assertIn("# TYPE mcp_stage_seconds histogram", text)
+
+    async def test_stats_lists_endpoints(self):
+        response = await self.client.get("/mcp/stats")
+        body = await response.json()
+        self.assertEqual(response.status, 200)
+        self.assertIn("openai", body["endpoints"])
+        self.assertIn("llm_skipped_rate", body["router"])
+
+class TestAsyncFindHeadlineReport(unittest.IsolatedAsyncioTestCase):
+    @patch("sbert_vector_search.get_index")
+    @patch("sbert_vector_search.text_search", return_value=[3, 2])
+    @patch("sbert_vector_search.score_many", return_value=[[(1, 0.9), (2, 0.8)]])
+    async def test_honours_hybrid_search(self, mock_score_many, mock_text_search, mock_get_index):
+        page = {"fields": ("id",), "offset": 0, "limit": 2, "rerank": False}
+        with use_page(page), patch.dict(os.environ, {"HYBRID_SEARCH": "true"}):
+            hybrid = await mcp_news_async_server.find_headline_report(None, "Braves")
+        with use_page(page), patch.dict(os.environ, {"HYBRID_SEARCH": "false"}):
+            vector = await mcp_news_async_server.find_headline_report(None, "Braves")
+
+        # Document 2 is ranked by both sides, so fusion puts it first, as the Flask server does
+        self.assertEqual(hybrid, [{"id": 2}, {"id": 1}])
+        self.assertEqual(vector, [{"id": 1}, {"id": 2}])
+        mock_text_search.assert_called_once()
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,162 @@
+import os
+import time
+import unittest
+from unittest.mock import patch, MagicMock
+
+from bson import ObjectId
+
+with patch.dict(os.environ, {"USE_AZURE_OPENAI": "false", "OPENAI_API_KEY": "fake-key"}):
+    import mcp_news_server
+
+import news_tools
+from mcp_client import stream_request
+from news_tools import DEFAULT_PAGE, current_page, page_options
+
+class TestMcpNewsServerStream(unittest.TestCase):
+    def setUp(self):
+        mcp_news_server.router.cache._entries.clear()
+        self.client = mcp_news_server.app.test_client()
+
+    def test_stream_emits_routing_hits_and_summary(self):
+        headlines = [{"text": "Braves win", "label": 1, "score": 0.9}, {"text": "Braves lose", "label": 1, "score": 0.8}]
+        with patch.object(mcp_news_server.router.agent, "stream_tool_calls",
+                          return_value=iter([{"name": "find_headline_report", "arguments": {"headline": "Braves"}}])), \
+             patch.dict(mcp_news_server.dispatcher.registry, {"find_headline_report": lambda headline: headlines}):
+            response = self.client.post("/mcp/stream", json={"input": "Atlanta Braves"})
+            body = response.get_data(as_text=True)
+
+        self.assertEqual(response.mimetype, "text/event-stream")
+        events = [block.split("\n")[0] for block in body.strip().split("\n\n")]
+        self.assertEqual(events, ["event: routing", "event: hit", "event: hit", "event: summary"])
+        self.assertIn('"source":"llm"', body)
+
+        # The client parses the same stream into events
+        mock_response = MagicMock()
+        mock_response.headers = {"Content-Type": "text/event-stream"}
+        mock_response.iter_lines.return_value = body.split("\n")
+        with patch("mcp_client.requests.Session.post") as mock_post:
+            mock_post.return_value.__enter__.return_value = mock_response
+            parsed = list(stream_request("Atlanta Braves"))
+        self.assertEqual([event for event, _ in parsed], ["routing", "hit", "hit", "summary"])
+        self.assertEqual(parsed[-1][1]["data"], headlines)
+
+    def test_stream_keeps_finished_results_when_a_call_times_out(self):
+        def find(headline):
+            time.sleep(1 if headline == "slow" else 0)
+            return [{"text": headline, "label": 1, "score": 0.9}]
+
+        calls = [{"name": "find_headline_report", "arguments": {"headline": headline}} for headline in ("slow", "fast")]
+        with patch.object(mcp_news_server.router.agent, "stream_tool_calls", return_value=iter(calls)), \
+             patch.dict(mcp_news_server.dispatcher.registry, {"find_headline_report": find}), \
+             patch.dict(mcp_news_server.dispatcher.timeouts, {"find_headline_report": 0.3}):
+            body = self.client.post("/mcp/stream", json={"input": "Braves"}).get_data(as_text=True)
+
+        blocks = [block.split("\n") for block in body.strip().split("\n\n")]
+        self.assertEqual([lines[0] for lines in blocks],
+                         ["event: routing", "event: routing", "event: hit", "event: error", "event: summary"])
+        self.assertIn('"text":"fast"', blocks[2][1])
+        self.assertIn('"headline":"slow"', blocks[3][1])
+        self.assertIn('"status":504', blocks[3][1])
+        self.assertIn('"result":"find_headline_report"', blocks[4][1])
+
+    def test_stream_encodes_object_ids(self):
+        doc_id = ObjectId("0123456789abcdef01234567")
+        with patch.object(mcp_news_server.router.agent, "stream_tool_calls",
+                          return_value=iter([{"name": "find_headline_report", "arguments": {"headline": "Braves"}}])), \
+             patch.dict(mcp_news_server.dispatcher.registry, {"find_headline_report": lambda headline: [{"id": doc_id}]}):
+            body = self.client.post("/mcp/stream", json={"input": "Braves", "fields": ["id"]}).get_data(as_text=True)
+
+        blocks = [block.split("\n") for block in body.strip().split("\n\n")]
+        self.assertEqual([lines[0] for lines in blocks], ["event: routing", "event: hit", "event: summary"])
+        self.assertIn('"id":"0123456789abcdef01234567"', blocks[1][1])
+
+class TestMcpNewsServerTenants(unittest.TestCase):
+    def test_unknown_tenant_is_rejected(self):
+        client = mcp_news_server.app.test_client()
+        with patch.dict(os.environ, {"TENANTS": '{"acme": {"database": "acme", "collection": "articles"}}'}):
+            response = client.post("/mcp", json={"input": "Braves"}, headers={"X-Tenant-ID": "globex"})
+        self.assertEqual(response.status_code, 404)
+        self.assertIn("globex", response.get_json()["error"])
+
+    def test_tenant_api_key_is_required(self):
+        client = mcp_news_server.app.test_client()
+        configured = '{"acme": {"database": "acme", "collection": "articles", "api_key_env": "ACME_API_KEY"}}'
+        with patch.dict(os.environ, {"TENANTS": configured, "ACME_API_KEY": "k3y"}):
+            response = client.post("/mcp", json={"input": "Braves"}, headers={"X-Tenant-ID": "acme"})
+        self.assertEqual(response.status_code, 401)
+
+    def test_tool_calls_search_the_tenant_namespace(self):
+        client = mcp_news_server.app.test_client()
+        mcp_news_server.router.cache._entries.clear()
+        seen = []
+        registry = {"find_headline_report": lambda headline: seen.append(mcp_news_server.current_namespace()) or []}
+        with patch.dict(os.environ, {"TENANTS": '{"acme": {"database": "acme", "collection": "articles"}}'}), \
+             patch.object(mcp_news_server.router, "route",
+                          return_value=([{"name": "find_headline_report", "arguments": {"headline": "Q3"}}], "llm")), \
+             patch.dict(mcp_news_server.dispatcher.registry, registry):
+            response = client.post("/mcp", json={"input": "Q3 results"}, headers={"X-Tenant-ID": "acme"})
+        self.assertEqual(response.status_code, 200, response.get_json())
+        self.assertEqual((seen[0]["tenant"], seen[0]["database"], seen[0]["collection"]), ("acme", "acme", "articles"))
+
+        stats = client.get("/mcp/stats").get_json()
+        self.assertIn("memory_budget", stats["indexes"])
+
+class TestMcpNewsServerPages(unittest.TestCase):
+    def test_page_options_are_validated(self):
+        client = mcp_news_server.app.test_client()
+        for body in ({"fields": ["embedding"]}, {"fields": 5}, {"fields": [["text"]]}, {"rerank": "yes"}, {"rerank": 1},
+                     {"limit": 0}, {"offset": "x"}, {"offset": 995, "limit": 10}):
+            response = client.post("/mcp", json={"input": "Braves", **body})
+            self.assertEqual(response.status_code, 400, body)
+        self.assertFalse(page_options({"rerank": "false"})["rerank"])
+        self.assertTrue(page_options({"rerank": "True"})["rerank"])
+        with patch.dict(os.environ, {"RERANK_RESULTS": "true"}):
+            self.assertTrue(page_options({})["rerank"])
+
+    def test_response_carries_requested_page(self):
+        client = mcp_news_server.app.test_client()
+        mcp_news_server.router.cache._entries.clear()
+        pages = []
+
+        def find(headline):
+            pages.append(current_page())
+            return [{"id": i} for i in range(2)]
+
+        with patch.object(mcp_news_server.router, "route",
+                          return_value=([{"name": "find_headline_report", "arguments": {"headline": "Q3"}}], "llm")), \
+             patch.dict(mcp_news_server.dispatcher.registry, {"find_headline_report": find}):
+            response = client.post("/mcp", json={"input": "Q3", "fields": "id", "offset": 4, "limit": 2})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.mimetype, "application/json")
+        self.assertEqual(pages, [{"fields": ("id",), "offset": 4, "limit": 2, "rerank": False}])
+        self.assertEqual((response.get_json()["data"], response.get_json()["next_offset"]), ([{"id": 0}, {"id": 1}], 6))
+
+    def test_dumps_falls_back_to_json(self):
+        body = {"data": [{"id": ObjectId("0123456789abcdef01234567"), "score": 0.5}]}
+        expected = b'{"data":[{"id":"0123456789abcdef01234567","score":0.5}]}'
+        self.assertEqual(news_tools.dumps(body), expected)
+        with patch.object(news_tools, "orjson", None):
+            self.assertEqual(news_tools.dumps(body), expected)
+
+class TestMcpNewsServerSearchBatch(unittest.TestCase):
+    def test_batches_per_category(self):
+        news = {"database": "testdb", "collection": "ag_news"}
+        acme = {"database": "acme", "collection": "articles"}
+
+        page = DEFAULT_PAGE
+        second_page = dict(DEFAULT_PAGE, offset=5)
+
+        def fake_search(headlines, mongo_url, top_k, filters, hybrid, namespace, fields, offset, rerank):
+            return [[{"text": f"{headline} {filters} {namespace['collection']} {offset}"}] for headline in headlines]
+
+        with patch.object(mcp_news_server, "search_many", side_effect=fake_search) as mock_search:
+            results = mcp_news_server.search_batch([("a", None, news, page), ("b", "Sports", news, page),
+                                                    ("c", None, news, page), ("d", None, acme, page),
+                                                    ("e", None, news, second_page)])
+        self.assertEqual(mock_search.call_count, 4)
+        self.assertEqual([r[0]["text"] for r in results],
+                         ["a None ag_news 0", "b {'label': 1} ag_news 0", "c None ag_news 0", "d None articles 0",
+                          "e None ag_news 5"])
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,95 @@
+import threading
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from unittest.mock import MagicMock
+
+import metrics
+from metrics import Registry, in_context, inc, record_usage, timer, trace
+from request_coalescer import RequestCoalescer
+
+class TestRegistry(unittest.TestCase):
+    def test_render_prometheus_text(self):
+        registry = Registry()
+        for value in (0.0002, 0.003, 0.003, 40.0):
+            registry.observe("mcp_stage_seconds", value, stage="encode")
+        registry.inc("mcp_llm_tokens_total", 12, kind="prompt")
+        registry.inc("mcp_route_decisions_total", source='a"b')
+        text = registry.render()
+
+        self.assertIn("# TYPE mcp_stage_seconds histogram", text)
+        self.assertIn('mcp_stage_seconds_bucket{stage="encode",le="0.0005"} 1', text)
+        self.assertIn('mcp_stage_seconds_bucket{stage="encode",le="0.005"} 3', text)
+        self.assertIn('mcp_stage_seconds_bucket{stage="encode",le="30.0"} 3', text)
+        self.assertIn('mcp_stage_seconds_bucket{stage="encode",le="+Inf"} 4', text)
+        self.assertIn('mcp_stage_seconds_count{stage="encode"} 4', text)
+        self.assertIn("# TYPE mcp_llm_tokens_total counter", text)
+        self.assertIn('mcp_llm_tokens_total{kind="prompt"} 12', text)
+        self.assertIn('mcp_route_decisions_total{source="a\\"b"} 1', text)
+        self.assertEqual(registry.snapshot()['mcp_stage_seconds_count{stage="encode"}'], 4)
+
+class TestTracing(unittest.TestCase):
+    def setUp(self):
+        metrics.registry.reset()
+
+    def test_timer_records_histogram_and_active_trace(self):
+        with timer("score"):
+            pass
+        with trace() as request_trace:
+            with timer("score"):
+                pass
+            inc("mcp_embedding_cache_total", 3, result="hit")
+            inc("mcp_embedding_cache_total", 0, result="miss")
+        self.assertEqual(metrics.registry.snapshot()['mcp_stage_seconds_count{stage="score"}'], 2)
+        timings = request_trace.as_dict()
+        self.assertEqual(list(timings["stages_ms"]), ["score"])
+        self.assertEqual(timings["counters"], {"embedding_cache_hit": 3})
+        self.assertIsNone(metrics.current_trace())
+
+    def test_trace_follows_work_into_threads(self):
+        pool = ThreadPoolExecutor(max_workers=2)
+
+        def work():
+            with timer("mongo"):
+                return threading.current_thread().name
+
+        with trace() as request_trace:
+            pool.submit(in_context(work)).result()
+        untraced = pool.submit(work).result()
+        pool.shutdown()
+        self.assertTrue(untraced.startswith("ThreadPoolExecutor"))
+        self.assertIn("mongo", request_trace.stages)
+        self.assertEqual(metrics.registry.snapshot()['mcp_stage_seconds_count{stage="mongo"}'], 2)
+
+    def test_coalesced_batch_stages_reach_every_request(self):
+        def batch_fn(items):
+            with timer("encode"):
+                return items
+
+        coalescer = RequestCoalescer(batch_fn, window_ms=100, max_batch=2)
+        traces = []
+
+        def request(item):
+            with trace() as request_trace:
+                traces.append(request_trace)
+                return coalescer.submit(item)
+
+        with ThreadPoolExecutor(max_workers=2) as pool:
+            self.assertEqual(list(pool.map(request, ["a", "b"])), ["a", "b"])
+        self.assertEqual(coalescer.batches, 1)
+        self.assertTrue(all("encode" in request_trace.stages for request_trace in traces))
+        self.assertEqual(metrics.registry.snapshot()['mcp_stage_seconds_count{stage="encode"}'], 1)
+
+    def test_record_usage_counts_tokens(self):
+        response = MagicMock()
+        response.usage.prompt_tokens = 40
+        response.usage.completion_tokens = 7
+        with trace() as request_trace:
+            record_usage(response)
+            record_usage(None)
+        snapshot = metrics.registry.snapshot()
+        self.assertEqual(snapshot['mcp_llm_tokens_total{kind="prompt"}'], 40)
+        self.assertEqual(snapshot['mcp_llm_tokens_total{kind="completion"}'], 7)
+        self.assertEqual(request_trace.counters, {"llm_tokens_prompt": 40, "llm_tokens_completion": 7})
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,61 @@
+import unittest
+from unittest.mock import patch, MagicMock
+
+import model_registry
+from model_registry import ModelRegistry
+
+class TestModelRegistry(unittest.TestCase):
+    @patch("model_registry.SentenceTransformer")
+    def test_get_loads_once_per_key(self, mock_model_class):
+        mock_model_class.side_effect = lambda name, device=None: MagicMock(name=f"{name}@{device}")
+        registry = ModelRegistry(max_models=2)
+
+        first = registry.get("all-MiniLM-L6-v2", "cpu")
+        second = registry.get("all-MiniLM-L6-v2", "cpu")
+
+        self.assertIs(first, second)
+        mock_model_class.assert_called_once_with("all-MiniLM-L6-v2", device="cpu")
+
+    @patch("model_registry.SentenceTransformer")
+    def test_evicts_least_recently_used(self, mock_model_class):
+        mock_model_class.side_effect = lambda name, device=None: MagicMock()
+        registry = ModelRegistry(max_models=2)
+
+        registry.get("model-a", "cpu")
+        registry.get("model-b", "cpu")
+        registry.get("model-a", "cpu")
+        registry.get("model-c", "cpu")
+
+        self.assertEqual(registry.loaded(), [("model-a", "cpu"), ("model-c", "cpu")])
+        self.assertTrue(registry.evict("model-a"))
+        self.assertFalse(registry.evict("model-b"))
+        self.assertEqual(registry.loaded(), [("model-c", "cpu")])
+
+    @patch("model_registry.CrossEncoder")
+    def test_cross_encoders_are_keyed_by_max_length(self, mock_cross_encoder):
+        mock_cross_encoder.side_effect = lambda name, device=None, max_length=None: MagicMock(max_length=max_length)
+        with patch.object(model_registry, "_rerankers", ModelRegistry(max_models=2)):
+            short = model_registry.get_cross_encoder("reranker", "cpu", max_length=64)
+            self.assertIs(model_registry.get_cross_encoder("reranker", "cpu", max_length=64), short)
+            self.assertEqual(model_registry.get_cross_encoder("reranker", "cpu", max_length=256).max_length, 256)
+            self.assertEqual(short.max_length, 64)
+
+    @patch("model_registry.CrossEncoder")
+    @patch("model_registry.SentenceTransformer")
+    def test_cross_encoders_do_not_evict_query_encoders(self, mock_model_class, mock_cross_encoder):
+        mock_model_class.side_effect = lambda name, device=None: MagicMock()
+        mock_cross_encoder.side_effect = lambda name, device=None, max_length=None: MagicMock()
+        with patch.object(model_registry, "_registry", ModelRegistry(max_models=2)), \
+             patch.object(model_registry, "_rerankers", ModelRegistry(max_models=1)):
+            stock = model_registry.get_model("model-a", "cpu")
+            other = model_registry.get_model("model-b", "cpu")
+            model_registry.get_cross_encoder("reranker", "cpu", max_length=128)
+
+            self.assertIs(model_registry.get_model("model-a", "cpu"), stock)
+            self.assertIs(model_registry.get_model("model-b", "cpu"), other)
+            self.assertEqual(mock_model_class.call_count, 2)
+            self.assertTrue(model_registry.evict_model("reranker"))
+            self.assertEqual(model_registry._rerankers.loaded(), [])
+
+if __name__ == "__main__":
+    unittest.main()
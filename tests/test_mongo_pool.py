@@ -0,0 +1,47 @@
+import unittest
+from unittest.mock import patch
+
+import mongo_pool
+
+class TestMongoPool(unittest.TestCase):
+    def tearDown(self):
+        mongo_pool._clients.clear()
+
+    @patch("mongo_pool.MongoClient")
+    def test_one_client_per_url(self, mock_mongo_client):
+        first = mongo_pool.get_client("mongodb://a:27017/")
+        second = mongo_pool.get_client("mongodb://a:27017/")
+        other = mongo_pool.get_client("mongodb://b:27017/", maxPoolSize=5)
+
+        self.assertIs(first, second)
+        self.assertEqual(mock_mongo_client.call_count, 2)
+        self.assertEqual(mock_mongo_client.call_args.kwargs["maxPoolSize"], 5)
+        self.assertIs(other, mock_mongo_client.return_value)
+
+    @patch("mongo_pool.MongoClient")
+    def test_close_all(self, mock_mongo_client):
+        client = mongo_pool.get_client("mongodb://a:27017/")
+        mongo_pool.close_all()
+        client.close.assert_called_once()
+        mongo_pool.get_client("mongodb://a:27017/")
+        self.assertEqual(mock_mongo_client.call_count, 2)
+
+    @patch("mongo_pool.MongoClient")
+    def test_forked_child_gets_new_client(self, mock_mongo_client):
+        mongo_pool.get_client("mongodb://a:27017/")
+        with patch("mongo_pool.os.getpid", return_value=-1):
+            mongo_pool.get_client("mongodb://a:27017/")
+        self.assertEqual(mock_mongo_client.call_count, 2)
+        mongo_pool._pid = mongo_pool.os.getpid()
+
+    def test_fork_callbacks_run_in_the_child(self):
+        forgotten = []
+        callback = mongo_pool.after_fork(lambda: forgotten.append(True))
+        try:
+            mongo_pool._after_fork_in_child()
+        finally:
+            mongo_pool._fork_callbacks.remove(callback)
+        self.assertEqual(forgotten, [True])
+
+if __name__ == "__main__":
+    unittest.main()
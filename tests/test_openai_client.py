@@ -2,6 +2,7 @@ import unittest
 from unittest.mock import patch, MagicMock
 import os
 
+from metrics import trace
 from openai_client import OpenAIClient, build_prompt
 
 class TestOpenAIClient(unittest.TestCase):
@@ -27,6 +28,41 @@ class TestOpenAIClient(unittest.TestCase):
         mock_client.chat.completions.create.assert_called_once()
         self.assertEqual(response.choices[0].message.content, "Test response")
 
+    @patch.dict(os.environ, {
+        "USE_AZURE_OPENAI": "false",
+        "OPENAI_API_KEY": "fake-key"
+    })
+    @patch("openai_client.OpenAI")
+    def test_stream_tool_calls_assembles_arguments(self, mock_openai_class):
+        def chunk(index, name=None, arguments=None):
+            delta = MagicMock()
+            delta.index = index
+            delta.function.name = name
+            delta.function.arguments = arguments
+            c = MagicMock()
+            c.choices[0].delta.tool_calls = [delta]
+            return c
+
+        usage = MagicMock(choices=[])
+        usage.usage.prompt_tokens, usage.usage.completion_tokens, usage.usage.total_tokens = 40, 12, 52
+        chunks = [chunk(0, "find_report", '{"ti'), chunk(0, None, 'tle": "a"}'),
+                  chunk(1, "find_course", '{"title"'), chunk(1, None, ': "b"}'), usage]
+        mock_openai_class.return_value.chat.completions.create.return_value = iter(chunks)
+
+        client = OpenAIClient(model="gpt-4o")
+        with trace() as request_trace:
+            calls = list(client.stream_tool_calls([{"role": "user", "content": "Hello"}], tools=[{}]))
+
+        self.assertEqual(calls, [{"name": "find_report", "arguments": {"title": "a"}},
+                                 {"name": "find_course", "arguments": {"title": "b"}}])
+        kwargs = mock_openai_class.return_value.chat.completions.create.call_args.kwargs
+        self.assertTrue(kwargs["stream"])
+        self.assertEqual(kwargs["stream_options"], {"include_usage": True})
+        self.assertEqual(client.scheduler.stats()["in_flight"], 0)
+        self.assertEqual(client.scheduler.stats()["window_tokens"], 52)
+        counters = request_trace.as_dict()["counters"]
+        self.assertEqual((counters["llm_tokens_prompt"], counters["llm_tokens_completion"]), (40, 12))
+
     def test_build_prompt(self):
         prompt = build_prompt("Japan")
         self.assertIn("Japan", prompt)
@@ -0,0 +1,92 @@
+import unittest
+from unittest.mock import patch, MagicMock
+
+import numpy as np
+import parallel_encoder
+from parallel_encoder import ParallelEncoder
+
+class InProcessPool:
+    def __init__(self):
+        self.closed = self.terminated = False
+
+    def imap(self, fn, tasks):
+        return map(fn, tasks)
+
+    def close(self):
+        self.closed = True
+
+    def terminate(self):
+        self.terminated = True
+
+    def join(self):
+        pass
+
+class TestParallelEncoder(unittest.TestCase):
+    @patch("parallel_encoder.multiprocessing.get_context")
+    def test_encode_keeps_input_order(self, mock_get_context):
+        mock_get_context.return_value.Pool.return_value = InProcessPool()
+        model = MagicMock()
+        model.encode.side_effect = lambda texts, **kwargs: np.array([[float(t)] for t in texts])
+        parallel_encoder._worker_model = model
+
+        with ParallelEncoder(workers=2, shard_size=3) as encoder:
+            embeddings = encoder.encode([str(i) for i in range(10)], batch_size=8)
+            report = encoder.report()
+
+        self.assertEqual(embeddings.dtype, np.float32)
+        self.assertEqual(embeddings[:, 0].tolist(), list(range(10)))
+        self.assertEqual(model.encode.call_count, 4)
+        self.assertEqual(sum(stats["docs"] for stats in report.values()), 10)
+        mock_get_context.assert_called_once_with("spawn")
+
+    @patch("parallel_encoder.multiprocessing.get_context")
+    def test_encode_options_reach_the_workers(self, mock_get_context):
+        mock_get_context.return_value.Pool.return_value = InProcessPool()
+        model = MagicMock()
+        model.encode.side_effect = lambda texts, **kwargs: np.ones((len(texts), 2))
+        parallel_encoder._worker_model = model
+
+        with ParallelEncoder(workers=2, shard_size=2) as encoder:
+            encoder.encode(["a", "b", "c"], batch_size=16, normalize_embeddings=True)
+
+        self.assertEqual(model.encode.call_count, 2)
+        model.encode.assert_called_with(["c"], batch_size=16, convert_to_numpy=True, normalize_embeddings=True)
+
+    @patch("parallel_encoder.multiprocessing.get_context")
+    def test_failed_encode_terminates_pool(self, mock_get_context):
+        pool = InProcessPool()
+        mock_get_context.return_value.Pool.return_value = pool
+        parallel_encoder._worker_model = MagicMock(**{"encode.side_effect": RuntimeError("worker died")})
+
+        with self.assertRaises(RuntimeError):
+            with ParallelEncoder(workers=2) as encoder:
+                encoder.encode(["a", "b"])
+        self.assertTrue(pool.terminated)
+        self.assertFalse(pool.closed)
+
+    @patch("parallel_encoder.multiprocessing.get_context")
+    def test_worker_report_leaves_pool_open(self, mock_get_context):
+        import load_data
+        pool = InProcessPool()
+        mock_get_context.return_value.Pool.return_value = pool
+        parallel_encoder._worker_model = MagicMock(**{"encode.side_effect": lambda texts, **kwargs: np.ones((len(texts), 2))})
+
+        with load_data.open_encoder(workers=2) as encoder:
+            load_data.print_worker_report(encoder)
+            self.assertFalse(pool.closed)
+            self.assertEqual(len(encoder.encode(["a"])), 1)
+        self.assertTrue(pool.closed)
+
+    @patch("load_data.get_model")
+    def test_single_process_encoder_sets_torch_threads(self, mock_get_model):
+        import load_data
+        torch = MagicMock()
+        with patch.dict("sys.modules", {"torch": torch}):
+            with load_data.open_encoder(workers=1, torch_threads=2) as encoder:
+                self.assertIs(encoder, mock_get_model.return_value)
+            with load_data.open_encoder(workers=1):
+                pass
+        torch.set_num_threads.assert_called_once_with(2)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,121 @@
+import unittest
+from types import SimpleNamespace
+from unittest.mock import MagicMock, patch
+
+import numpy as np
+from bson.binary import Binary
+from embedding_index import EmbeddingIndex
+from load_data import embedding_fields
+from quantization import FORMATS, Codec, bson_bytes, from_bson, quantization_report, stored_format, to_bson
+
+def unit_rows(n, d=384, seed=0):
+    matrix = np.random.default_rng(seed).standard_normal((n, d)).astype(np.float32)
+    return matrix / np.linalg.norm(matrix, axis=1, keepdims=True)
+
+class TestQuantization(unittest.TestCase):
+    def test_bson_round_trip(self):
+        vector = unit_rows(1)[0]
+        for fmt in FORMATS:
+            doc = to_bson(vector, fmt)
+            self.assertEqual(stored_format(doc["embedding"]), "float32" if fmt == "float32" else fmt)
+            decoded = from_bson(doc)
+            cosine = decoded @ vector / np.linalg.norm(decoded)
+            self.assertGreater(cosine, 0.99 if fmt != "binary" else 0.7, fmt)
+        self.assertIsInstance(to_bson(vector, "int8")["embedding"], Binary)
+        self.assertIn("embedding_scale", to_bson(vector, "int8"))
+        with self.assertRaises(ValueError):
+            to_bson(vector, "int4")
+
+    def test_unknown_bindata_is_rejected(self):
+        for value in (Binary(b"\x00\x00\x80\x3f", subtype=4), Binary(b"\x17\x00\x01", subtype=9)):
+            self.assertEqual(stored_format(value), "unknown")
+            with self.assertRaises(ValueError):
+                from_bson({"embedding": value})
+
+    def test_compact_formats_shrink_documents(self):
+        vector = unit_rows(1)[0]
+        sizes = [bson_bytes(vector, fmt) for fmt in ("array", "float32", "float16", "int8", "binary")]
+        self.assertEqual(sizes, sorted(sizes, reverse=True))
+        self.assertLess(bson_bytes(vector, "binary"), 100)
+
+    def test_scores_on_codes_track_float_scores(self):
+        matrix, queries = unit_rows(200), unit_rows(3, seed=1)
+        exact = queries @ matrix.T
+        for fmt in ("float16", "int8"):
+            codec = Codec(fmt)
+            codes, scales = codec.encode(matrix)
+            self.assertEqual(codes.dtype, codec.dtype)
+            np.testing.assert_allclose(codec.score(queries, codes, scales), exact, atol=0.02)
+        codec = Codec("binary")
+        codes, _ = codec.encode(matrix)
+        self.assertEqual(codes.shape, (200, 48))
+        self.assertTrue(np.allclose(codec.score(matrix[:1], codes)[0, 0], 1.0))
+
+    def test_binary_scores_without_bitwise_count(self):
+        matrix, queries = unit_rows(100), unit_rows(3, seed=1)
+        codec = Codec("binary")
+        codes, _ = codec.encode(matrix)
+        expected = codec.score(queries, codes)
+        with patch("quantization.np", SimpleNamespace(**{name: getattr(np, name) for name in dir(np)
+                                                          if name != "bitwise_count"})):
+            np.testing.assert_array_equal(codec.score(queries, codes), expected)
+
+    def test_encoding_in_chunks_matches_whole_matrix(self):
+        matrix = unit_rows(300, d=16)
+        for fmt in ("int8", "binary"):
+            expected = Codec(fmt).encode(matrix)
+            with patch("quantization._ENCODE_ROWS", 7):
+                codes, scales = Codec(fmt).encode(matrix)
+            np.testing.assert_array_equal(codes, expected[0])
+            if fmt == "int8":
+                np.testing.assert_array_equal(scales, expected[1])
+
+    def test_report_rescoring_recovers_recall(self):
+        matrix = unit_rows(2000)
+        queries = matrix[:20]
+        plain = quantization_report(matrix, queries, "int8", ks=(10,))
+        rescored = quantization_report(matrix, queries, "int8", ks=(10,), rescore=4)
+        self.assertEqual(plain["memory_bytes"], 2000 * 384 + 2000 * 4)
+        self.assertGreaterEqual(rescored["recall@10"], plain["recall@10"])
+        self.assertEqual(rescored["recall@10"], 1.0)
+
+    def test_index_scores_int8_and_rescores_from_full_field(self):
+        matrix = unit_rows(50, d=16)
+        docs = [{"_id": i, **embedding_fields(row, "int8", keep_full=True)} for i, row in enumerate(matrix)]
+        collection = MagicMock()
+        collection.find.return_value = docs
+        index = EmbeddingIndex(collection, storage="int8", rescore=3, rescore_field="embedding_full").load()
+        self.assertEqual(index.codes.dtype, np.int8)
+        self.assertLess(index.nbytes, matrix.nbytes)
+
+        hits = index.search(matrix[7], top_k=3)
+        expected = np.argsort(-(matrix @ matrix[7]))[:3].tolist()
+        self.assertEqual([doc_id for doc_id, _ in hits], expected)
+        self.assertAlmostEqual(hits[0][1], 1.0, places=5)
+        self.assertEqual(collection.find.call_args.args[1], {"_id": 1, "embedding_full": 1, "embedding_full_scale": 1})
+
+        index.upsert(50, -matrix[7])
+        self.assertTrue(index.remove(7))
+        self.assertEqual(len(index), 50)
+
+    def test_rescores_from_full_field_by_default(self):
+        matrix = unit_rows(50, d=16)
+        compact = [{"_id": i, **embedding_fields(row, "int8")} for i, row in enumerate(matrix)]
+        full = [{"_id": i, **embedding_fields(row, "int8", keep_full=True)} for i, row in enumerate(matrix)]
+        collection = MagicMock()
+        collection.find.return_value = full
+        index = EmbeddingIndex(collection, storage="int8", rescore=3).load()
+        self.assertEqual(index.search(matrix[7], top_k=1)[0][0], 7)
+        self.assertIn("embedding_full", collection.find.call_args.args[1])
+
+        collection.find.return_value = compact
+        with self.assertRaises(ValueError):
+            EmbeddingIndex(collection, storage="int8", rescore=3).load().search(matrix[7], top_k=1)
+
+    def test_compact_storage_requires_exact_backend(self):
+        from index_backends import IVFFlatBackend
+        with self.assertRaises(ValueError):
+            EmbeddingIndex(MagicMock(), backend=IVFFlatBackend(), storage="int8")
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,130 @@
+import asyncio
+import threading
+import time
+import unittest
+from unittest.mock import patch, MagicMock
+import httpx2
+import openai
+from rate_limiter import RateLimitScheduler, create_scheduler, estimate_tokens, retry_after
+
+def rate_limit_error(headers=None):
+    response = httpx2.Response(429, headers=headers or {}, request=httpx2.Request("POST", "http://test"))
+    return openai.RateLimitError("rate limited", response=response, body=None)
+
+class TestRateLimitScheduler(unittest.TestCase):
+    def test_estimate_tokens_counts_messages_tools_and_max_tokens(self):
+        messages = [{"role": "user", "content": "x" * 400}]
+        self.assertGreater(estimate_tokens(messages), 100)
+        self.assertGreater(estimate_tokens(messages, [{"type": "function"}]), estimate_tokens(messages))
+        self.assertEqual(estimate_tokens(messages, None, 50), estimate_tokens(messages) + 50)
+
+    def test_rpm_budget_makes_callers_wait(self):
+        scheduler = RateLimitScheduler(rpm=2)
+        for _ in range(2):
+            entry, wait = scheduler._reserve(1)
+            scheduler._release(entry)
+        entry, wait = scheduler._reserve(1)
+        self.assertIsNone(entry)
+        self.assertGreater(wait, 59)
+
+    def test_tpm_budget_and_reported_usage(self):
+        scheduler = RateLimitScheduler(tpm=100)
+        entry, _ = scheduler._reserve(80)
+        # The service reported fewer tokens than estimated, which frees budget
+        scheduler._release(entry, used_tokens=30)
+        self.assertIsNotNone(scheduler._reserve(60)[0])
+        self.assertIsNone(scheduler._reserve(20)[0])
+        # A request larger than the whole budget still runs on an empty window
+        self.assertIsNotNone(RateLimitScheduler(tpm=10)._reserve(50)[0])
+
+    def test_concurrency_cap(self):
+        scheduler = RateLimitScheduler(max_concurrency=1)
+        entry, _ = scheduler._reserve(1)
+        self.assertIsNone(scheduler._reserve(1)[0])
+        scheduler._release(entry)
+        self.assertIsNotNone(scheduler._reserve(1)[0])
+
+    def test_waiters_are_served_in_arrival_order(self):
+        scheduler = RateLimitScheduler(max_concurrency=1)
+        held, served = scheduler.acquire(1), []
+
+        def caller(name):
+            entry = scheduler.acquire(1)
+            served.append(name)
+            scheduler._release(entry)
+
+        threads = []
+        for name in ("first", "second", "third"):
+            threads.append(threading.Thread(target=caller, args=(name,)))
+            threads[-1].start()
+            while scheduler.stats()["waiting"] < len(threads):
+                time.sleep(0.001)
+        self.assertIsNone(scheduler._reserve(1)[0])   # no cutting in ahead of the queue
+        scheduler._release(held)
+        for thread in threads:
+            thread.join(timeout=5)
+        self.assertEqual(served, ["first", "second", "third"])
+        self.assertEqual(scheduler.stats()["in_flight"], 0)
+
+    def test_stream_holds_its_slot_until_exhausted(self):
+        scheduler = RateLimitScheduler(max_concurrency=1, tpm=1000)
+        usage = MagicMock(usage=MagicMock(total_tokens=7))
+        chunks = scheduler.stream(lambda: iter([MagicMock(usage=None), usage]), 100)
+        next(chunks)
+        self.assertEqual(scheduler.stats()["in_flight"], 1)
+        self.assertEqual(list(chunks), [usage])
+        self.assertEqual((scheduler.stats()["in_flight"], scheduler.stats()["window_tokens"]), (0, 7))
+
+        chunks = scheduler.stream(lambda: iter([MagicMock(usage=None)] * 3), 100)
+        next(chunks)
+        chunks.close()   # a caller stopping early frees the slot too
+        self.assertEqual(scheduler.stats()["in_flight"], 0)
+
+    def test_retry_after_pauses_deployment_and_retries(self):
+        scheduler = RateLimitScheduler(max_retries=2)
+        fn = MagicMock(side_effect=[rate_limit_error({"retry-after-ms": "50"}), "ok"])
+        start = time.monotonic()
+        self.assertEqual(scheduler.call(fn, 10), "ok")
+        self.assertGreaterEqual(time.monotonic() - start, 0.05)
+        self.assertEqual(fn.call_count, 2)
+        self.assertGreater(scheduler._paused_until, 0)
+        self.assertEqual(scheduler.stats()["throttled"], 1)
+        self.assertEqual(scheduler.stats()["in_flight"], 0)
+
+    @patch("rate_limiter.time.sleep")
+    def test_gives_up_and_does_not_retry_client_errors(self, mock_sleep):
+        scheduler = RateLimitScheduler(max_retries=1)
+        fn = MagicMock(side_effect=rate_limit_error())
+        with self.assertRaises(openai.RateLimitError):
+            scheduler.call(fn, 10)
+        self.assertEqual(fn.call_count, 2)
+        fn = MagicMock(side_effect=ValueError("bad request"))
+        with self.assertRaises(ValueError):
+            scheduler.call(fn, 10)
+        fn.assert_called_once()
+
+    def test_call_async_retries(self):
+        scheduler = RateLimitScheduler(max_retries=1, backoff=0.001)
+        attempts = []
+
+        async def fn():
+            attempts.append(1)
+            if len(attempts) == 1:
+                raise rate_limit_error({"retry-after-ms": "1"})
+            return "ok"
+
+        self.assertEqual(asyncio.run(scheduler.call_async(fn, 10)), "ok")
+        self.assertEqual(len(attempts), 2)
+
+    def test_retry_after_headers(self):
+        self.assertEqual(retry_after(rate_limit_error({"retry-after-ms": "1500"})), 1.5)
+        self.assertIsNone(retry_after(ValueError()))
+
+    def test_create_scheduler_per_deployment_overrides(self):
+        with patch.dict("os.environ", {"OPENAI_RPM": "100", "OPENAI_RATE_LIMITS": '{"gpt-4o": {"tpm": 5000}}'}):
+            scheduler = create_scheduler("gpt-4o")
+            self.assertEqual((scheduler.rpm, scheduler.tpm), (100, 5000))
+            self.assertIsNone(create_scheduler("other").tpm)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,56 @@
+import threading
+import unittest
+
+from metrics import timer, trace
+from request_coalescer import RequestCoalescer
+
+class TestRequestCoalescer(unittest.TestCase):
+    def test_concurrent_requests_share_a_batch(self):
+        batches = []
+        def batch_fn(items):
+            batches.append(list(items))
+            return [item.upper() for item in items]
+
+        coalescer = RequestCoalescer(batch_fn, window_ms=200, max_batch=8)
+        results = {}
+        def worker(text):
+            results[text] = coalescer.submit(text, timeout=5)
+
+        threads = [threading.Thread(target=worker, args=(text,)) for text in ("a", "b", "c")]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        self.assertEqual(results, {"a": "A", "b": "B", "c": "C"})
+        self.assertEqual(len(batches), 1)
+        self.assertEqual(sorted(batches[0]), ["a", "b", "c"])
+
+    def test_batch_errors_propagate(self):
+        def batch_fn(items):
+            raise ValueError("boom")
+
+        coalescer = RequestCoalescer(batch_fn, window_ms=1)
+        with self.assertRaises(ValueError):
+            coalescer.submit("a", timeout=5)
+
+    def test_missing_results_fail_the_batch(self):
+        coalescer = RequestCoalescer(lambda items: [item.upper() for item in items][1:], window_ms=1)
+        with self.assertRaises(RuntimeError):
+            coalescer.submit("a", timeout=5)
+        # The worker survives and serves the next batch
+        coalescer.batch_fn = lambda items: (item.upper() for item in items)
+        self.assertEqual(coalescer.submit("b", timeout=5), "B")
+
+    def test_failed_batches_show_up_in_request_traces(self):
+        def batch_fn(items):
+            with timer("encode"):
+                raise ValueError("boom")
+
+        coalescer = RequestCoalescer(batch_fn, window_ms=1)
+        with trace() as request_trace, self.assertRaises(ValueError):
+            coalescer.submit("a", timeout=5)
+        self.assertIn("encode", request_trace.as_dict()["stages_ms"])
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,77 @@
+import threading
+import time
+import unittest
+
+import metrics
+from reranker import Reranker
+
+class FakeCrossEncoder:
+    """
+    Scores a pair by the number of query words in the candidate text.
+    """
+    def __init__(self, seconds_per_pair: float = 0.0):
+        self.seconds_per_pair = seconds_per_pair
+        self.batches = []
+
+    def predict(self, pairs, batch_size=32, show_progress_bar=None):
+        self.batches.append(list(pairs))
+        time.sleep(self.seconds_per_pair * len(pairs))
+        return [float(len(set(query.lower().split()) & set(text.lower().split()))) for query, text in pairs]
+
+def candidates(*texts):
+    return [(i, 1.0 - i / 10, text) for i, text in enumerate(texts)]
+
+class TestReranker(unittest.TestCase):
+    def setUp(self):
+        metrics.registry.reset()
+        self.model = FakeCrossEncoder()
+
+    def test_reorders_by_cross_encoder_score_and_caches(self):
+        reranker = Reranker(self.model, model_name="fake", budget_ms=0)
+        rows = candidates("Mets lose at home", "Braves beat Mets", "Atlanta Braves win again")
+        first = reranker.rerank_many(["atlanta braves win"], [rows])
+        self.assertEqual([doc_id for doc_id, _ in first[0]], [2, 1, 0])
+        self.assertEqual(first[0][0], (2, 3.0))
+
+        again = reranker.rerank_many(["atlanta braves win"], [rows])
+        self.assertEqual(again, first)
+        self.assertEqual(len(self.model.batches), 1)
+        self.assertEqual(reranker.stats()["cache_hits"], 3)
+        snapshot = metrics.registry.snapshot()
+        self.assertEqual(snapshot['mcp_rerank_pairs_total{result="scored"}'], 3)
+        self.assertEqual(snapshot['mcp_rerank_pairs_total{result="cached"}'], 3)
+
+    def test_queries_share_batches_best_ranks_first(self):
+        reranker = Reranker(self.model, model_name="fake", batch_size=4, budget_ms=0)
+        rows = candidates("a", "b", "c", "d", "e")
+        reranker.rerank_many(["q1", "q2"], [rows, rows])
+        self.assertEqual([len(batch) for batch in self.model.batches], [4, 4, 2])
+        self.assertEqual(self.model.batches[0], [("q1", "a"), ("q2", "a"), ("q1", "b"), ("q2", "b")])
+
+    def test_budget_limits_scored_pairs(self):
+        self.model.seconds_per_pair = 0.02
+        reranker = Reranker(self.model, model_name="fake", batch_size=8, budget_ms=50)
+        reranker.pair_seconds = 0.02   # measured earlier: two pairs fit in the budget, then none
+        rows = candidates("x", "braves", "y", "braves win")
+        result = reranker.rerank_many(["braves win"], [rows])[0]
+        self.assertEqual(self.model.batches, [[("braves win", "x"), ("braves win", "braves")]])
+        # Scored candidates first, by score, then the rest in first-stage order without a score
+        self.assertEqual(result, [(1, 1.0), (0, 0.0), (2, None), (3, None)])
+        self.assertEqual(reranker.stats()["skipped"], 2)
+
+    def test_waiting_for_the_model_is_not_pair_cost(self):
+        reranker = Reranker(self.model, model_name="fake", budget_ms=0)
+        with reranker._model_lock:
+            worker = threading.Thread(target=reranker._predict, args=([("q", "a"), ("q", "b")],))
+            worker.start()
+            time.sleep(0.2)   # a concurrent rerank holds the model meanwhile
+        worker.join()
+        self.assertLess(reranker.pair_seconds, 0.05)
+
+    def test_truncates_candidates(self):
+        reranker = Reranker(self.model, model_name="fake", max_tokens=3, budget_ms=0)
+        reranker.rerank_many(["q"], [candidates("one two three four five")])
+        self.assertEqual(self.model.batches, [[("q", "one two three")]])
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,12 +1,19 @@
+import os
 import unittest
 from unittest.mock import patch, MagicMock
 import torch
-from sbert_vector_search import run_local_vector_search
+from embedding_cache import get_cache
+from sbert_vector_search import run_local_vector_search, reset_indexes, search_many
 
 class TestSbertVectorSearch(unittest.TestCase):
-    @patch("sbert_vector_search.MongoClient")
-    @patch("sbert_vector_search.SentenceTransformer")
-    def test_run_local_vector_search(self, mock_model_class, mock_mongo_client):
+    def tearDown(self):
+        reset_indexes()
+        get_cache().clear()
+
+    @patch.dict(os.environ, {"LOCAL_INDEX_REFRESH": "none"})
+    @patch("sbert_vector_search.get_client")
+    @patch("sbert_vector_search.get_model")
+    def test_run_local_vector_search(self, mock_get_model, mock_mongo_client):
         # Setup mock MongoDB documents
         mock_collection = MagicMock()
         mock_docs = [
@@ -21,7 +28,7 @@ class TestSbertVectorSearch(unittest.TestCase):
         mock_model = MagicMock()
         mock_query_embedding = torch.tensor([0.1, 0.2, 0.3])
         mock_model.encode.return_value = mock_query_embedding
-        mock_model_class.return_value = mock_model
+        mock_get_model.return_value = mock_model
 
         # Run search
         results = run_local_vector_search("sports news", "mongodb://localhost:27017/testdb")
@@ -33,6 +40,70 @@ class TestSbertVectorSearch(unittest.TestCase):
             self.assertIn("label", res)
             self.assertIn("score", res)
             self.assertIsInstance(res["score"], float)
+        self.assertEqual(results[0]["label"], "politics")
+
+    @patch.dict(os.environ, {"LOCAL_INDEX_REFRESH": "none"})
+    @patch("sbert_vector_search.get_client")
+    @patch("sbert_vector_search.get_model")
+    def test_index_is_loaded_once(self, mock_get_model, mock_mongo_client):
+        mock_collection = MagicMock()
+        mock_collection.find.return_value = [
+            {"_id": 1, "text": "News about sports", "label": "sports", "embedding": [0.1, 0.2, 0.3]},
+        ]
+        mock_mongo_client.return_value.__getitem__.return_value.__getitem__.return_value = mock_collection
+        mock_get_model.return_value.encode.return_value = torch.tensor([0.1, 0.2, 0.3])
+
+        run_local_vector_search("sports news", "mongodb://localhost:27017/testdb")
+        run_local_vector_search("more sports", "mongodb://localhost:27017/testdb")
+
+        # One full load, then one hydration query per search
+        self.assertEqual(mock_mongo_client.call_count, 1)
+        self.assertEqual(mock_collection.find.call_count, 3)
+
+    @patch.dict(os.environ, {"LOCAL_INDEX_REFRESH": "none"})
+    @patch("sbert_vector_search.get_client")
+    @patch("sbert_vector_search.get_model")
+    def test_hydrates_only_requested_fields_of_the_page(self, mock_get_model, mock_mongo_client):
+        mock_collection = MagicMock()
+        mock_collection.find.return_value = [
+            {"_id": i, "text": f"headline {i}", "label": 1, "embedding": [0.1 * i, 0.2, 0.3]} for i in range(1, 6)
+        ]
+        mock_mongo_client.return_value.__getitem__.return_value.__getitem__.return_value = mock_collection
+        mock_get_model.return_value.encode.return_value = torch.tensor([[1.0, 0.0, 0.0]])
+
+        page = search_many(["sports"], "mongodb://localhost:27017/testdb", top_k=2, fields=("id", "text"), offset=1)[0]
+        self.assertEqual(page, [{"id": 4, "text": "headline 4"}, {"id": 3, "text": "headline 3"}])
+        query, projection = mock_collection.find.call_args.args
+        self.assertEqual(query, {"_id": {"$in": [4, 3]}})
+        self.assertEqual(projection, {"_id": 1, "text": 1})
+
+        # Ids and scores come from the index alone
+        calls = mock_collection.find.call_count
+        ranked = search_many(["sports"], "mongodb://localhost:27017/testdb", top_k=3, fields=("id", "score"))[0]
+        self.assertEqual([hit["id"] for hit in ranked], [5, 4, 3])
+        self.assertEqual(mock_collection.find.call_count, calls)
+
+    @patch.dict(os.environ, {"LOCAL_INDEX_REFRESH": "none", "RERANK_CANDIDATES": "4"})
+    @patch("sbert_vector_search.get_reranker")
+    @patch("sbert_vector_search.get_client")
+    @patch("sbert_vector_search.get_model")
+    def test_rerank_reorders_hydrated_candidates(self, mock_get_model, mock_mongo_client, mock_get_reranker):
+        mock_collection = MagicMock()
+        mock_collection.find.return_value = [
+            {"_id": i, "text": f"headline {i}", "label": 1, "embedding": [0.1 * i, 0.2, 0.3]} for i in range(1, 6)
+        ]
+        mock_mongo_client.return_value.__getitem__.return_value.__getitem__.return_value = mock_collection
+        mock_get_model.return_value.encode.return_value = torch.tensor([[1.0, 0.0, 0.0]])
+        # The cross-encoder prefers the lowest ids
+        mock_get_reranker.return_value.rerank_many.side_effect = lambda queries, rows: [
+            sorted(((doc_id, -float(doc_id)) for doc_id, _, _ in row), key=lambda hit: -hit[1]) for row in rows]
+
+        results = search_many(["sports"], "mongodb://localhost:27017/testdb", top_k=2, fields=("id",), rerank=True)[0]
+        queries, rows = mock_get_reranker.return_value.rerank_many.call_args.args
+        self.assertEqual([(doc_id, text) for doc_id, _, text in rows[0]],
+                         [(5, "headline 5"), (4, "headline 4"), (3, "headline 3"), (2, "headline 2")])
+        self.assertEqual(mock_collection.find.call_args.args[1], {"_id": 1, "text": 1})
+        self.assertEqual(results, [{"id": 2}, {"id": 3}])
 
 if __name__ == "__main__":
     unittest.main()
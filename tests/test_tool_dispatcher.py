@@ -0,0 +1,93 @@
+import asyncio
+import time
+import unittest
+
+from tool_dispatcher import ToolDispatcher, build_response
+
+tools = [
+    {"type": "function", "function": {"name": "slow_echo"}},
+    {"type": "function", "function": {"name": "fail"}},
+]
+
+def slow_echo(text, delay=0.2):
+    time.sleep(delay)
+    return text
+
+def fail():
+    raise ValueError("boom")
+
+class TestToolDispatcher(unittest.TestCase):
+    def setUp(self):
+        self.dispatcher = ToolDispatcher(tools, {"slow_echo": slow_echo, "fail": fail}, timeout=5)
+
+    def tearDown(self):
+        self.dispatcher.shutdown()
+
+    def test_requires_a_function_per_tool(self):
+        with self.assertRaises(ValueError):
+            ToolDispatcher(tools, {"slow_echo": slow_echo})
+
+    def test_runs_calls_concurrently_in_order(self):
+        calls = [{"name": "slow_echo", "arguments": {"text": str(i)}} for i in range(4)]
+        start = time.perf_counter()
+        results = self.dispatcher.dispatch(calls)
+        elapsed = time.perf_counter() - start
+
+        self.assertEqual([item["result"] for item in results], ["0", "1", "2", "3"])
+        self.assertLess(elapsed, 0.6)
+
+    def test_errors_timeouts_and_unknown_tools(self):
+        self.dispatcher.timeouts = {"slow_echo": 0.05}
+        results = self.dispatcher.dispatch([
+            {"name": "slow_echo", "arguments": {"text": "late"}},
+            {"name": "fail", "arguments": {}},
+            {"name": "missing", "arguments": {}},
+        ])
+        self.assertIn("timed out", results[0]["error"])
+        self.assertEqual((results[0]["status"], results[1]["error"], results[1]["status"]), (504, "boom", 500))
+        self.assertEqual(results[2]["result"], "Unknown tool")
+
+    def test_timeouts_run_from_submission(self):
+        self.dispatcher.timeouts = {"slow_echo": 0.3}
+        start = time.perf_counter()
+        results = self.dispatcher.dispatch([{"name": "slow_echo", "arguments": {"text": str(i), "delay": 1}}
+                                            for i in range(3)])
+        self.assertLess(time.perf_counter() - start, 0.6)   # one timeout, not three in turn
+        self.assertTrue(all(item["status"] == 504 for item in results))
+
+    def test_invalid_arguments_fail_only_their_call(self):
+        calls = [{"name": "slow_echo", "arguments": ["x"]}, {"name": "slow_echo", "arguments": {"txt": "x"}},
+                 {"name": "slow_echo", "arguments": {"text": "ok", "delay": 0}}]
+        for results in (self.dispatcher.dispatch(calls), asyncio.run(self.dispatcher.dispatch_async(calls))):
+            self.assertEqual([item.get("status") for item in results], [400, 400, None])
+            self.assertIn("must be an object", results[0]["error"])
+            self.assertEqual(build_response(results)[0]["result"], "ok")
+
+    def test_dispatch_async_mixes_coroutines_and_functions(self):
+        async def async_echo(text):
+            await asyncio.sleep(0.01)
+            return text.upper()
+
+        dispatcher = ToolDispatcher([{"type": "function", "function": {"name": "async_echo"}}] + tools,
+                                    {"async_echo": async_echo, "slow_echo": slow_echo, "fail": fail})
+        results = asyncio.run(dispatcher.dispatch_async([
+            {"name": "async_echo", "arguments": {"text": "a"}},
+            {"name": "slow_echo", "arguments": {"text": "b", "delay": 0}},
+        ]))
+        dispatcher.shutdown()
+        self.assertEqual([item["result"] for item in results], ["A", "b"])
+
+    def test_build_response(self):
+        one = [{"tool": "t", "arguments": {}, "result": "r"}]
+        self.assertEqual(build_response(one), (one[0], 200))
+        two = one + [{"tool": "u", "arguments": {}, "error": "boom"}]
+        body, status = build_response(two)
+        self.assertEqual((body["result"], body["calls"], status), ("r", two, 200))
+        self.assertEqual(build_response(two[1:]), ({"error": "boom"}, 500))
+        body, status = build_response(two[::-1])   # a failed first call does not become the top level
+        self.assertEqual((body["result"], status), ("r", 200))
+        self.assertEqual(build_response([{"tool": "t", "arguments": [], "error": "bad", "status": 400}]),
+                         ({"error": "bad"}, 400))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,112 @@
+import json
+import unittest
+from unittest.mock import patch, MagicMock
+
+import numpy as np
+from embedding_cache import get_cache
+from tool_router import SemanticRouter, TTLCache, ToolRouter
+
+tools = [
+    {"type": "function", "function": {"name": "find_headline_report", "parameters": {
+        "type": "object", "properties": {"headline": {"type": "string"}}, "required": ["headline"]}}},
+    {"type": "function", "function": {"name": "find_engineer_by_name", "parameters": {
+        "type": "object", "properties": {"name": {"type": "string"}}, "required": ["name"]}}},
+]
+
+def llm_response(name, arguments):
+    call = MagicMock()
+    call.function.name = name
+    call.function.arguments = json.dumps(arguments)
+    response = MagicMock()
+    response.choices[0].message.tool_calls = [call]
+    return response
+
+def fake_model():
+    # Embeds by keyword so exemplars and inputs about the same topic line up
+    def encode(texts, **kwargs):
+        return np.array([[1.0 if "news" in t.lower() else 0.0, 1.0 if "engineer" in t.lower() else 0.0, 0.1]
+                         for t in texts], dtype=np.float32)
+    model = MagicMock()
+    model.encode.side_effect = encode
+    return model
+
+class TestToolRouter(unittest.TestCase):
+    def tearDown(self):
+        get_cache().clear()
+
+    def test_llm_result_is_cached_per_normalized_input(self):
+        agent = MagicMock()
+        agent.get_response.return_value = llm_response("find_headline_report", {"headline": "Braves"})
+        router = ToolRouter(agent, tools)
+
+        first = router.route("Atlanta Braves", [])
+        second = router.route("  atlanta   BRAVES ", [])
+
+        self.assertEqual(first, ([{"name": "find_headline_report", "arguments": {"headline": "Braves"}}], "llm"))
+        self.assertEqual(second[1], "cache")
+        agent.get_response.assert_called_once()
+        self.assertEqual(router.stats()["llm_skipped_rate"], 0.5)
+
+    def test_cached_calls_are_copies(self):
+        agent = MagicMock()
+        agent.get_response.return_value = llm_response("find_headline_report", {"headline": "Braves"})
+        router = ToolRouter(agent, tools)
+
+        calls, _ = router.route("Atlanta Braves", [])
+        calls[0]["arguments"]["headline"] = "changed by the caller"
+        cached, _ = router.route("Atlanta Braves", [])
+        cached[0]["arguments"]["category"] = "Sports"
+
+        self.assertEqual(router.route("Atlanta Braves", [])[0],
+                         [{"name": "find_headline_report", "arguments": {"headline": "Braves"}}])
+
+    def test_ttl_expiry(self):
+        cache = TTLCache(ttl=-1)
+        cache.put("key", "value")
+        self.assertIsNone(cache.get("key"))
+
+    @patch("tool_router.get_model")
+    def test_semantic_router_skips_llm_above_threshold(self, mock_get_model):
+        mock_get_model.return_value = fake_model()
+        agent = MagicMock()
+        semantic = SemanticRouter(tools, {"find_headline_report": ["Latest news"],
+                                          "find_engineer_by_name": ["Find engineer Alice"]},
+                                  threshold=0.9, extractors={"find_engineer_by_name": r"engineer\s+(?P<name>.+)"})
+        router = ToolRouter(agent, tools, semantic)
+
+        calls, source = router.route("sports news", [])
+        self.assertEqual((calls[0]["name"], calls[0]["arguments"], source),
+                         ("find_headline_report", {"headline": "sports news"}, "semantic"))
+        calls, source = router.route("engineer Bob Smith", [])
+        self.assertEqual(calls[0]["arguments"], {"name": "Bob Smith"})
+        agent.get_response.assert_not_called()
+
+    @patch("tool_router.get_model")
+    def test_semantic_router_falls_back_below_threshold(self, mock_get_model):
+        mock_get_model.return_value = fake_model()
+        agent = MagicMock()
+        agent.get_response.return_value = llm_response("find_headline_report", {"headline": "weather"})
+        router = ToolRouter(agent, tools, SemanticRouter(tools, {"find_headline_report": ["Latest news"]}, threshold=0.9))
+
+        calls, source = router.route("what about the weather", [])
+        self.assertEqual(source, "llm")
+        agent.get_response.assert_called_once()
+
+    @patch("tool_router.get_model")
+    def test_semantic_router_defers_inputs_naming_an_enum_option(self, mock_get_model):
+        from news_tools import tools as news_tools
+        mock_get_model.return_value = fake_model()
+        agent = MagicMock()
+        agent.get_response.return_value = llm_response("find_headline_report", {"headline": "Braves", "category": "Sports"})
+        router = ToolRouter(agent, news_tools, SemanticRouter(news_tools, {"find_headline_report": ["Latest news"]},
+                                                              threshold=0.9))
+
+        calls, source = router.route("Braves news", [])
+        self.assertEqual((calls[0]["arguments"], source), ({"headline": "Braves news"}, "semantic"))
+        for user_input in ("sports news about the Braves", "technology news"):
+            calls, source = router.route(user_input, [])
+            self.assertEqual((calls[0]["arguments"]["category"], source), ("Sports", "llm"))
+        self.assertEqual(router.route("sports news about the Braves", [])[0][0]["arguments"]["category"], "Sports")
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,174 @@
+"""
+tool_dispatcher.py
+@ken.chen
+
+Executes every tool call an LLM response asks for, concurrently, instead of only the first one.
+The tool registry is built from the `tools` schema: each tool name maps to the function of the
+same name, so servers no longer need an if/elif chain. Results come back in call order, and a
+call that fails or exceeds its timeout reports an error, with an HTTP status (400 for invalid
+arguments, 504 for a timeout, 500 otherwise), without affecting the others. Each call's timeout
+runs from its submission, so a batch of calls never waits longer than its slowest timeout.
+
+Usage:
+    dispatcher = ToolDispatcher(tools, globals())
+    results = dispatcher.dispatch([{"name": "find_report", "arguments": {"title": "sales"}}])
+    # [{"tool": "find_report", "arguments": {...}, "result": "Found a report for sales"}]
+
+Environment:
+    TOOL_WORKERS: threads executing tool calls (default: 8)
+    TOOL_TIMEOUT_SECONDS: default per-tool timeout (default: 30)
+"""
+
+import asyncio, inspect, os, time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from metrics import in_context, timer
+
+class ToolDispatcher:
+    def __init__(self, tools: list, functions: dict, timeouts: dict = None, timeout: float = None,
+                 max_workers: int = None):
+        """
+        Args:
+            tools (list): The OpenAI tools schema.
+            functions (dict): Namespace to look tool functions up in by name, e.g. globals().
+            timeouts (dict): Per-tool timeouts in seconds, overriding `timeout`.
+            timeout (float): Default timeout in seconds for a tool call.
+            max_workers (int): Threads used to run tool calls concurrently.
+        """
+        self.registry = {}
+        for tool in tools:
+            name = tool["function"]["name"]
+            if not callable(functions.get(name)):
+                raise ValueError(f"No function found for tool '{name}'")
+            self.registry[name] = functions[name]
+        self.timeout = timeout or float(os.getenv("TOOL_TIMEOUT_SECONDS", "30"))
+        self.timeouts = timeouts or {}
+        self._pool = ThreadPoolExecutor(max_workers=max_workers or int(os.getenv("TOOL_WORKERS", "8")),
+                                        thread_name_prefix="tool")
+
+    def timeout_for(self, name: str) -> float:
+        return self.timeouts.get(name, self.timeout)
+
+    def submit(self, call: dict):
+        """
+        Starts one tool call on the thread pool and returns its Future (None for unknown tools).
+        """
+        function = self.registry.get(call["name"])
+        if function is None:
+            return None
+        return self._pool.submit(in_context(_timed), call["name"], function, call.get("arguments"))
+
+    def deadline(self, call: dict) -> float:
+        """
+        The time.monotonic() by which a call submitted now must finish.
+        """
+        return time.monotonic() + self.timeout_for(call["name"])
+
+    def collect(self, call: dict, future, deadline: float = None) -> dict:
+        """
+        Waits for a submitted call until `deadline` (default: its timeout from now) and returns its
+        {"tool", "arguments", "result"} dict, or "error" and "status" when it failed.
+        """
+        item = {"tool": call["name"], "arguments": call.get("arguments")}
+        if future is None:
+            item["result"] = "Unknown tool"
+            return item
+        deadline = self.deadline(call) if deadline is None else deadline
+        try:
+            item["result"] = future.result(timeout=max(0.0, deadline - time.monotonic()))
+        except FutureTimeoutError:
+            # The thread cannot be interrupted; its result is discarded when it finishes
+            future.cancel()
+            item.update(timed_out(call["name"], self.timeout_for(call["name"])))
+        except Exception as e:
+            item.update(failed(e))
+        return item
+
+    def dispatch(self, calls: list) -> list:
+        """
+        Runs tool calls concurrently on the thread pool.
+
+        Args:
+            calls (list): {"name", "arguments"} dicts as returned by ToolRouter.route.
+
+        Returns:
+            list: One {"tool", "arguments", "result"} (or "error") dict per call, in call order.
+        """
+        submitted = [(self.submit(call), self.deadline(call)) for call in calls]
+        return [self.collect(call, future, deadline) for call, (future, deadline) in zip(calls, submitted)]
+
+    async def dispatch_async(self, calls: list) -> list:
+        """
+        Same as `dispatch` for asyncio servers: coroutine tools are awaited concurrently and
+        plain functions run on the thread pool.
+        """
+        loop = asyncio.get_running_loop()
+
+        async def run(call):
+            item = {"tool": call["name"], "arguments": call.get("arguments")}
+            function = self.registry.get(call["name"])
+            if function is None:
+                item["result"] = "Unknown tool"
+                return item
+            try:
+                arguments = tool_arguments(call["name"], function, call.get("arguments"))
+                if inspect.iscoroutinefunction(function):
+                    pending = function(**arguments)
+                else:
+                    pending = loop.run_in_executor(self._pool, in_context(lambda: function(**arguments)))
+                with timer("tool"):
+                    item["result"] = await asyncio.wait_for(pending, self.timeout_for(call["name"]))
+            except asyncio.TimeoutError:
+                item.update(timed_out(call["name"], self.timeout_for(call["name"])))
+            except Exception as e:
+                item.update(failed(e))
+            return item
+
+        return list(await asyncio.gather(*(run(call) for call in calls)))
+
+    def shutdown(self):
+        self._pool.shutdown(wait=False)
+
+class InvalidArguments(ValueError):
+    pass
+
+def tool_arguments(name: str, function, arguments) -> dict:
+    """
+    Returns the keyword arguments of a call; raises InvalidArguments unless they are a JSON
+    object that fits the tool function's signature.
+    """
+    if not isinstance(arguments, dict):
+        raise InvalidArguments(f"Arguments of tool '{name}' must be an object, got {type(arguments).__name__}")
+    try:
+        inspect.signature(function).bind(**arguments)
+    except TypeError as e:
+        raise InvalidArguments(f"Invalid arguments for tool '{name}': {e}") from e
+    return arguments
+
+def timed_out(name: str, timeout: float) -> dict:
+    return {"error": f"Tool '{name}' timed out after {timeout}s", "status": 504}
+
+def failed(error: Exception) -> dict:
+    return {"error": str(error), "status": 400 if isinstance(error, InvalidArguments) else 500}
+
+def _timed(name: str, function, arguments):
+    arguments = tool_arguments(name, function, arguments)
+    with timer("tool"):
+        return function(**arguments)
+
+def build_response(results: list) -> tuple:
+    """
+    Builds the /mcp response body: the first successful call's result at the top level, as
+    before, plus every call under "calls" when the model asked for more than one.
+
+    Returns:
+        tuple: (body dict, HTTP status). When every call failed, the body is the first call's
+            error and the status that call's status (400, 500 or 504).
+    """
+    succeeded = [item for item in results if "error" not in item]
+    if not succeeded:
+        body, status = {"error": results[0]["error"]}, results[0].get("status", 500)
+    else:
+        body, status = dict(succeeded[0]), 200
+    if len(results) > 1:
+        body["calls"] = results
+    return body, status
@@ -0,0 +1,243 @@
+"""
+tool_router.py
+@ken.chen
+
+Routing layer in front of OpenAIClient that picks a tool and its arguments for a user input,
+skipping the LLM round trip whenever possible:
+
+    cache      (normalized input, tool schema hash) -> tool calls, with TTL and LRU eviction
+    semantic   optional local router that embeds the input with all-MiniLM-L6-v2 and matches it
+               against per-tool exemplars; used only above a confidence threshold
+    llm        OpenAIClient.get_response with the tools schema, as before
+
+Every decision is logged with its source and counted, so the hit rate can be measured.
+
+Usage:
+    router = ToolRouter(agent, tools, SemanticRouter(tools, exemplars))
+    calls, source = router.route(user_input, messages)
+    # calls: [{"name": "find_headline_report", "arguments": {"headline": "..."}}]
+
+Environment:
+    ROUTER_CACHE_TTL: seconds a cached routing decision stays valid (default: 300)
+    ROUTER_CACHE_SIZE: cached routing decisions (default: 1024)
+    SEMANTIC_ROUTER: set to "true" to enable the local semantic router
+    SEMANTIC_ROUTER_THRESHOLD: minimum cosine similarity to accept a semantic match (default: 0.6)
+    ENCODER_BACKEND: backend of the semantic router's encoder, see encoder_backends.py (default: torch)
+"""
+
+import asyncio, copy, hashlib, json, os, re, threading, time
+from collections import OrderedDict
+import numpy as np
+from embedding_cache import get_cache
+from encoder_backends import cache_name, query_backend
+from metrics import in_context, inc
+from model_registry import DEFAULT_MODEL, get_model
+
+def normalize_input(text: str) -> str:
+    return " ".join(text.lower().split())
+
+def schema_hash(tools: list) -> str:
+    return hashlib.sha256(json.dumps(tools, sort_keys=True).encode()).hexdigest()
+
+class TTLCache:
+    def __init__(self, ttl: float = 300, capacity: int = 1024):
+        self.ttl = ttl
+        self.capacity = capacity
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires, value = entry
+            if expires < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def put(self, key, value):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.capacity:
+                self._entries.popitem(last=False)
+
+    def __len__(self):
+        return len(self._entries)
+
+class SemanticRouter:
+    def __init__(self, tools: list, exemplars: dict, threshold: float = 0.6, extractors: dict = None,
+                 model_name: str = DEFAULT_MODEL):
+        """
+        Args:
+            tools (list): The OpenAI tools schema.
+            exemplars (dict): Tool name -> example user inputs for that tool.
+            threshold (float): Minimum cosine similarity to accept a match.
+            extractors (dict): Tool name -> regex with named groups for the tool's arguments.
+                Tools without one are only routed locally when they take a single required
+                string argument, which is then filled with the user input. Either way, an input
+                that names a value of an optional enum argument left unfilled (e.g. a news
+                category) is deferred to the LLM, which can set it.
+        """
+        self.threshold = threshold
+        self.model_name = model_name
+        self.extractors = {name: re.compile(pattern, re.IGNORECASE) for name, pattern in (extractors or {}).items()}
+        self.parameters = {tool["function"]["name"]: tool["function"].get("parameters", {}) for tool in tools}
+        self.enum_values = {name: self._enum_patterns(parameters) for name, parameters in self.parameters.items()}
+        self.names = [name for name, texts in exemplars.items() for _ in texts]
+        self.texts = [text for texts in exemplars.values() for text in texts]
+        self._embeddings = None
+
+    def _encode(self, texts: list) -> np.ndarray:
+        backend = query_backend()
+        embeddings = get_cache().encode(get_model(self.model_name, backend=backend), texts,
+                                        cache_name(self.model_name, backend))
+        return embeddings / np.maximum(np.linalg.norm(embeddings, axis=1, keepdims=True), 1e-12)
+
+    def match(self, user_input: str):
+        """
+        Returns (tool name, arguments, score) for a confident match, otherwise None.
+        """
+        if not self.texts:
+            return None
+        if self._embeddings is None:
+            self._embeddings = self._encode(self.texts)
+        scores = self._embeddings @ self._encode([user_input])[0]
+        best = int(np.argmax(scores))
+        if scores[best] < self.threshold:
+            return None
+        name = self.names[best]
+        arguments = self.extract_arguments(name, user_input)
+        if arguments is None:
+            return None
+        return name, arguments, float(scores[best])
+
+    @staticmethod
+    def _enum_patterns(parameters: dict) -> dict:
+        # Argument -> regex matching words that start like one of its values ("Sci/Tech" -> sci..., tech...)
+        patterns = {}
+        for key, schema in parameters.get("properties", {}).items():
+            words = {word.lower() for value in schema.get("enum", [])
+                     for word in re.findall(r"[A-Za-z0-9]+", str(value))}
+            if words and key not in parameters.get("required", []):
+                patterns[key] = re.compile(r"\b(?:" + "|".join(sorted(map(re.escape, words))) + ")", re.IGNORECASE)
+        return patterns
+
+    def extract_arguments(self, name: str, user_input: str):
+        required = self.parameters.get(name, {}).get("required", [])
+        extractor = self.extractors.get(name)
+        if extractor is not None:
+            found = extractor.search(user_input)
+            if not found:
+                return None
+            arguments = {key: value.strip() for key, value in found.groupdict().items() if value}
+            if not all(key in arguments for key in required):
+                return None
+        elif len(required) == 1:
+            arguments = {required[0]: user_input.strip()}
+        else:
+            return None
+        # The input may ask for an option only the LLM can map to its enum value
+        if any(pattern.search(user_input) for key, pattern in self.enum_values.get(name, {}).items()
+               if key not in arguments):
+            return None
+        return arguments
+
+class ToolRouter:
+    def __init__(self, agent, tools: list, semantic_router: SemanticRouter = None,
+                 ttl: float = None, capacity: int = None):
+        self.agent = agent
+        self.tools = tools
+        self.semantic_router = semantic_router
+        self.schema = schema_hash(tools)
+        self.cache = TTLCache(ttl if ttl is not None else float(os.getenv("ROUTER_CACHE_TTL", "300")),
+                              capacity or int(os.getenv("ROUTER_CACHE_SIZE", "1024")))
+        self.counts = {"cache": 0, "semantic": 0, "llm": 0}
+        self._lock = threading.Lock()
+
+    def route(self, user_input: str, messages: list) -> tuple:
+        """
+        Picks the tool calls for `user_input`, asking the LLM with `messages` only when
+        neither the cache nor the semantic router can answer.
+
+        Returns:
+            tuple: (list of {"name", "arguments"} dicts, source)
+        """
+        key, calls, source = self._route_locally(user_input)
+        if calls is None:
+            calls, source = self._parse(self.agent.get_response(messages, self.tools)), "llm"
+        return self._record(key, calls, source)
+
+    def route_stream(self, user_input: str, messages: list):
+        """
+        Same as `route`, but yields (tool call, source) pairs one at a time; on the LLM path
+        each tool call is yielded as soon as the streamed completion has finished its arguments.
+        """
+        key, calls, source = self._route_locally(user_input)
+        if calls is not None:
+            self._record(key, calls, source)
+            yield from ((call, source) for call in calls)
+            return
+        calls = []
+        for call in self.agent.stream_tool_calls(messages, self.tools):
+            calls.append(call)
+            yield call, "llm"
+        self._record(key, calls, "llm")
+
+    async def route_async(self, user_input: str, messages: list, executor=None) -> tuple:
+        """
+        Same as `route`, for asyncio servers: the semantic match runs on `executor` and the
+        LLM is called through `get_response_async`.
+        """
+        loop = asyncio.get_running_loop()
+        key, calls, source = await loop.run_in_executor(executor, in_context(self._route_locally), user_input)
+        if calls is None:
+            calls, source = self._parse(await self.agent.get_response_async(messages, self.tools)), "llm"
+        return self._record(key, calls, source)
+
+    def _route_locally(self, user_input: str) -> tuple:
+        key = (normalize_input(user_input), self.schema)
+        calls = self.cache.get(key)
+        if calls is not None:
+            # Callers may mutate the arguments they get; the cached decision must not change
+            return key, copy.deepcopy(calls), "cache"
+        match = self.semantic_router.match(user_input) if self.semantic_router else None
+        if match is not None:
+            name, arguments, score = match
+            return key, [{"name": name, "arguments": arguments}], "semantic"
+        return key, None, None
+
+    @staticmethod
+    def _parse(response) -> list:
+        tool_calls = response.choices[0].message.tool_calls or []
+        return [{"name": call.function.name, "arguments": json.loads(call.function.arguments)}
+                for call in tool_calls]
+
+    def _record(self, key, calls: list, source: str) -> tuple:
+        if calls and source != "cache":
+            self.cache.put(key, copy.deepcopy(calls))
+        with self._lock:
+            self.counts[source] += 1
+        inc("mcp_route_decisions_total", source=source)
+        print(f"Routing: source={source} tools={[call['name'] for call in calls]}")
+        return calls, source
+
+    def stats(self) -> dict:
+        with self._lock:
+            total = sum(self.counts.values())
+            return {**self.counts, "cached": len(self.cache),
+                    "llm_skipped_rate": (total - self.counts["llm"]) / total if total else 0.0}
+
+def create_router(agent, tools: list, exemplars: dict = None, extractors: dict = None) -> ToolRouter:
+    """
+    Builds a ToolRouter configured from the environment; the semantic router is only
+    enabled when SEMANTIC_ROUTER is "true" and exemplars are given.
+    """
+    semantic_router = None
+    if exemplars and os.getenv("SEMANTIC_ROUTER", "false").lower() == "true":
+        semantic_router = SemanticRouter(tools, exemplars, float(os.getenv("SEMANTIC_ROUTER_THRESHOLD", "0.6")),
+                                         extractors)
+    return ToolRouter(agent, tools, semantic_router)